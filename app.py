@@ -1,17 +1,33 @@
-import os, logging, asyncio, threading, re, unicodedata
+from __future__ import annotations
+import os, logging, asyncio, contextvars, threading, re, time, unicodedata
+_T0 = time.perf_counter()
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
-from typing import Optional, Tuple
-
-# Telegram (PTB v20)
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-
-# DB (SQLite helpers)
-from db_sqlite import (
-    init_db, ensure_schema, cfg_get, cfg_set,
-    get_all, exec_sql, insert_and_get_id
-)
+from flask import Flask, Response, request, jsonify
+from typing import Optional, Tuple, TYPE_CHECKING
+
+# Telegram (PTB v20): import khi dựng bot (build_app), không làm chậm lúc khởi động
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
+
+# DB: SQLite (DB_PATH) hoặc SQLAlchemy/Postgres (DATABASE_URL), xem repo.py
+from repo import get_repository, EXPORT_TABLES
+import portfolio
+import ledger
+import export
+from update_queue import UpdateQueue
+import payout
+from models import Line, Bids
+from line_cache import LineCache
+from render_cache import RenderCache
+from reminders import ReminderScheduler
+from outbox import Outbox, PRIO_REPLY, PRIO_REMINDER
+from dedup import UpdateDedup
+from shards import ShardedRunner, KeyedLocks
+from loop_lag import LoopLagMonitor
+import write_coalescer
+import metrics
 
 # ================= Flask app & config =================
 app = Flask(__name__)
@@ -21,11 +37,44 @@ logger = logging.getLogger("huibot")
 BOT_TOKEN = (os.getenv("TELEGRAM_TOKEN") or os.getenv("BOT_TOKEN") or "").strip()
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
+# sync: chờ xử lý xong rồi mới trả 200 · queue: xếp hàng rồi trả 200 ngay
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync").strip().lower()
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "1000"))
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", "2"))
+LINE_CACHE_SIZE = int(os.getenv("LINE_CACHE_SIZE", "512"))
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "1024"))
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1").strip() not in ("0", "false", "no")
+# Giới hạn gửi của Telegram: ~30 tin/s toàn bot, ~1 tin/s mỗi chat
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+ALERT_DIGEST_SEC = float(os.getenv("ALERT_DIGEST_SEC", "60"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+DANHSACH_PAGE = int(os.getenv("DANHSACH_PAGE", "25"))
+TG_MAX_TEXT = 4096
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(2 * 1024 * 1024)))
+# /mophong: số đường mô phỏng, phân phối thăm mặc định (empirical|uniform|tri)
+MC_PATHS = int(os.getenv("MC_PATHS", "20000"))
+MC_DIST = os.getenv("MC_DIST", "empirical").strip().lower()
+MC_MAX_ROWS = 40
+# Chống xử lý trùng update_id: số id nhớ trong RAM / số id giữ trong bảng seen_updates
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "10000"))
+DEDUP_KEEP = int(os.getenv("DEDUP_KEEP", "100000"))
+# Giây một instance giữ update đang xử lý; quá hạn (instance chết giữa chừng) thì lần gửi lại được nhận
+DEDUP_LEASE = int(os.getenv("DEDUP_LEASE", "120"))
+# Số update xử lý song song (mỗi chat luôn vào cùng một worker → giữ thứ tự) và hàng chờ mỗi worker
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_SHARD_MAX = int(os.getenv("UPDATE_SHARD_MAX", "100"))
+# background: dựng bot song song khi khởi động · webhook: dựng ở update/route đầu tiên cần tới bot
+# (nhắc hẹn cũng chỉ chạy từ lúc đó; để background nếu cần nhắc đúng giờ khi không có tin nhắn)
+BOT_INIT = os.getenv("BOT_INIT", "background").strip().lower()
+BOT_READY_WAIT = float(os.getenv("BOT_READY_WAIT", "20"))
 
 ISO_FMT = "%Y-%m-%d"
 
 # ================= Utils =================
 def strip_accents(s: str) -> str:
+    s = s.replace("đ", "d").replace("Đ", "D")   # đ không tách dấu khi NFKD
     return ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
 
 def parse_iso(s: str) -> datetime:
@@ -83,27 +132,50 @@ def parse_percent(x: str) -> float:
     return float(s)
 
 # ---------- Business helpers ----------
-def k_date(line, k: int) -> datetime:
-    return parse_iso(line["start_date"]) + timedelta(days=(k-1)*int(line["period_days"]))
+def k_date(line: Line, k: int) -> datetime:
+    return line.start + timedelta(days=(k-1)*line.period_days)
 
 def roi_to_str(r: float) -> str:
     return f"{r*100:.2f}%"
 
-def get_bids(line_id: int):
-    rows = get_all("SELECT k, bid FROM rounds WHERE line_id=? ORDER BY k", (line_id,))
-    return {int(r["k"]): int(r["bid"]) for r in rows}
-
-def payout_at_k(line, bids: dict, k: int) -> int:
-    M, N = int(line["contrib"]), int(line["legs"])
-    T_k = int(bids.get(k, 0))
-    D   = int(round(M * float(line.get("thau_rate", 0)) / 100.0))
-    return (k-1)*M + (N - k)*(M - T_k) - D
-
-def paid_so_far_if_win_at_k(bids: dict, M: int, k: int) -> int:
-    return sum((M - int(bids.get(j, 0))) for j in range(1, k))
-
-def compute_profit_var(line, k: int, bids: dict):
-    M = int(line["contrib"])
+repo = get_repository()
+# Dây + thăm được cache (LRU); các lệnh ghi cập nhật/xoá cache ngay sau khi ghi DB.
+# DB dùng chung (DATABASE_URL, nhiều instance): instance này không thấy ghi của instance khác → tắt cache
+line_cache = LineCache(0 if repo.shared else LINE_CACHE_SIZE)
+# Câu trả lời /tomtat, /hottot, /mophong theo (dây, version, lệnh, metric, ngày); version đổi khi ghi
+render_cache = RenderCache(0 if repo.shared else RENDER_CACHE_SIZE)
+# Khoá theo dây cho các lệnh đọc-sửa-ghi thăm (/tham, /nhap) khi nhiều chat ghi cùng dây
+line_locks = KeyedLocks()
+
+async def load_line_bids(line_id: int):
+    """(Line, Bids, version) hoặc None nếu không có dây."""
+    e = line_cache.lookup(line_id)
+    if e is not None:
+        return e
+    tok = line_cache.begin_fill(line_id)     # /tham ghi trong lúc đang đọc → không cache bản cũ
+    row = await repo.load_line(line_id)
+    if row is None:
+        return None
+    line = Line(row)
+    return line_cache.store(line_id, line, Bids.from_map(line.legs, await repo.load_bids(line_id)), tok)
+
+async def load_line(line_id: int):
+    e = await load_line_bids(line_id)
+    return e[0] if e else None
+
+async def get_bids(line_id: int):
+    e = await load_line_bids(line_id)
+    return e[1] if e else {}
+
+def payout_at_k(line: Line, bids: Bids, k: int) -> int:
+    M, N, D = line.contrib, line.legs, line.thau_amount
+    return (k-1)*M + (N - k)*(M - bids.get(k, 0)) - D
+
+def paid_so_far_if_win_at_k(bids: Bids, M: int, k: int) -> int:
+    return sum(M - t for t in bids.dense()[1:k])
+
+def compute_profit_var(line: Line, k: int, bids: Bids):
+    M = line.contrib
     po = payout_at_k(line, bids, k)
     paid = paid_so_far_if_win_at_k(bids, M, k)
     base = paid if paid > 0 else M
@@ -111,36 +183,87 @@ def compute_profit_var(line, k: int, bids: dict):
     roi = profit / base if base else 0.0
     return profit, roi, po, paid
 
-def best_k_var(line, bids: dict, metric="roi"):
-    bestk, bestkey, bestinfo = 1, -1e18, None
-    for kk in range(1, int(line["legs"]) + 1):
-        p, r, po, paid = compute_profit_var(line, kk, bids)
-        key = r if metric == "roi" else p
-        if key > bestkey:
-            bestk, bestkey, bestinfo = kk, key, (p, r, po, paid)
-    return bestk, bestinfo
-
-def is_finished(line) -> bool:
-    if line.get("status") == "CLOSED": return True
-    last = k_date(line, int(line["legs"])).date()
+def best_k_var(line: Line, bids: Bids, metric="roi"):
+    # O(N): prefix-sum engine, same results as looping compute_profit_var over k
+    return payout.best_k(line, bids, metric)
+
+def is_finished(line: Line) -> bool:
+    if line.status == "CLOSED": return True
+    last = k_date(line, line.legs).date()
     return datetime.now().date() >= last
 
 # ---------- DB init ----------
-init_db(); ensure_schema()
+# Thời gian khởi động (giây), hiện ở /health: import module, DB init, dựng bot
+STARTUP = {"import_s": round(time.perf_counter() - _T0, 4)}
+if repo.name == "sqlite":
+    _t = time.perf_counter()
+    asyncio.run(repo.init())     # SQLAlchemy: khởi tạo trên event loop của bot (_runner)
+    STARTUP["db_init_s"] = round(time.perf_counter() - _t, 4)
+dedup = UpdateDedup(repo, DEDUP_WINDOW, DEDUP_KEEP, lease=DEDUP_LEASE)
 
 # ================= Telegram Bot state =================
-app_state = {"loop": None, "application": None, "started": False}
+bot_ready = threading.Event()
+_bot_start_lock = threading.Lock()
+_loop_lock = threading.Lock()
+app_state = {"loop": None, "application": None, "started": False, "queue": None, "reminders": None, "outbox": None,
+             "runner": None, "repo_init": None}
+# Độ trễ của event loop bot: DB chạy trên thread pool (repo), loop phải luôn rảnh
+loop_lag = LoopLagMonitor(LOOP_LAG_INTERVAL)
+
+async def send_text(chat_id, text: str, priority=PRIO_REPLY, **kw):
+    ob = app_state.get("outbox")
+    if ob is not None:
+        return await ob.send(chat_id, text, priority, **kw)
+    return await app_state["application"].bot.send_message(chat_id=chat_id, text=text, **kw)
+
+async def reply(upd: Update, text: str, **kw):
+    """Trả lời qua outbox (giới hạn tốc độ, ưu tiên cao nhất); như reply_text của PTB."""
+    ob = app_state.get("outbox")
+    if ob is None:
+        return await upd.message.reply_text(text, **kw)
+    if upd.effective_chat.type != "private":
+        kw.setdefault("reply_to_message_id", upd.message.message_id)
+    return await ob.send(upd.effective_chat.id, text, PRIO_REPLY, **kw)
 
 async def notify_admin(text: str):
-    if ADMIN_CHAT_ID and app_state.get("application"):
+    if ADMIN_CHAT_ID and app_state.get("outbox"):
+        app_state["outbox"].alert(text)
+    elif ADMIN_CHAT_ID and app_state.get("application"):
         try:
             await app_state["application"].bot.send_message(chat_id=ADMIN_CHAT_ID, text=text[:4000])
         except Exception:
             logger.exception("notify_admin failed")
 
+# ================= Reminders =================
+async def reminder_text(line, k: int) -> str:
+    bids = await get_bids(int(line["id"]))
+    if not isinstance(line, Line): line = Line(line)     # lịch nhắc giữ dòng dict từ repo
+    return (
+        f"⏰ Nhắc hụi — Dây #{line['id']} · {line['name']}\n"
+        f"• Hôm nay {to_user_str(k_date(line, k))} là kỳ {k}/{line['legs']} · Mệnh giá {int(line['contrib']):,} VND\n"
+        f"• Đã nhập thăm: {len(bids)} kỳ\n"
+        f"➡️ Nhập thăm: /tham {line['id']} {k} <số_tiền_thăm>"
+    )
+
+async def send_reminder(line, k: int) -> bool:
+    chat_id = (await repo.cfg_get("bot_cfg", {}) or {}).get("report_chat_id")
+    if not chat_id or not app_state.get("application"):
+        logger.warning("reminder for line %s: chưa có report_chat_id (/baocao)", line["id"])
+        return False
+    await send_text(chat_id, await reminder_text(line, k), PRIO_REMINDER)
+    line_cache.update_line(int(line["id"]), last_remind_iso=line["last_remind_iso"])
+    return True
+
+async def reschedule_reminder(line_id: int):
+    sch = app_state.get("reminders")
+    if sch is None: return
+    line = await load_line(line_id)
+    if line: sch.schedule(line)
+    else: sch.cancel(line_id)
+
 # ================= Commands =================
 async def cmd_start(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await upd.message.reply_text("👋 HỤI BOT – TèLe đã sẵn sàng. Gõ /lenh để xem lệnh.")
+    await reply(upd, "👋 HỤI BOT – TèLe đã sẵn sàng. Gõ /lenh để xem lệnh.")
 
 def _int_like(s: str) -> int:
     m = re.search(r"-?\d+", s or "")
@@ -148,7 +271,7 @@ def _int_like(s: str) -> int:
     return int(m.group(0))
 
 async def cmd_lenh(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await upd.message.reply_text(
+    await reply(upd,
         "🌟 LỆNH CHÍNH (định dạng ngày DD-MM-YYYY)\n"
         "/tao <tên> <tuần|tháng> <DD-MM-YYYY> <số_chân> <mệnh_giá> <sàn_%> <trần_%> <đầu_thảo_%>\n"
         "  • mệnh_giá: 2tr | 2.000.000 | 2000000 | 2000k\n"
@@ -157,20 +280,23 @@ async def cmd_lenh(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         "/tham <mã_dây> <kỳ> <số_tiền_thăm> [DD-MM-YYYY]\n"
         "Ví dụ: /tham 1 1 2tr 10-11-2025\n\n"
         "/hen <mã_dây> <HH:MM>\n"
-        "/danhsach \n/tomtat <mã_dây>\n/hottot <mã_dây> [Roi%|Lãi]\n/dong <mã_dây>\n"
-        "/baocao [chat_id]"
+        "/nhap <mã_dây> + mỗi dòng `<kỳ> <số_tiền_thăm> [DD-MM-YYYY]` (hoặc gửi file CSV, chú thích /nhap <mã_dây>)\n"
+        "/danhsach [mở|đóng] [tuần|tháng]\n/tomtat <mã_dây>\n/hottot <mã_dây> [Roi%|Lãi]\n"
+        "/mophong <mã_dây> [empirical|uniform|tri]\n/dong <mã_dây>\n"
+        "/baocao [chat_id]\n/tongquan [Roi%|Lãi]\n"
+        "/dongtien <mã_dây> <số_tiền> [DD-MM-YYYY]\n/congno [mã_dây]"
     )
 
 async def cmd_setreport(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    cfg = cfg_get("bot_cfg", {}) or {}
+    cfg = await repo.cfg_get("bot_cfg", {}) or {}
     if ctx.args:
         try: cid = int(ctx.args[0])
-        except Exception: return await upd.message.reply_text("❌ `chat_id` không hợp lệ.")
+        except Exception: return await reply(upd, "❌ `chat_id` không hợp lệ.")
     else:
         cid = upd.effective_chat.id
     cfg["report_chat_id"] = cid
-    cfg_set("bot_cfg", cfg)
-    await upd.message.reply_text(f"✅ Đã lưu nơi nhận báo cáo/nhắc: {cid}")
+    await repo.cfg_set("bot_cfg", cfg)
+    await reply(upd, f"✅ Đã lưu nơi nhận báo cáo/nhắc: {cid}")
 
 async def _create_line_and_reply(upd: Update, name, kind, start_user, legs, contrib, base_rate, cap_rate, thau_rate):
     kind_l = str(kind).lower()
@@ -186,13 +312,10 @@ async def _create_line_and_reply(upd: Update, name, kind, start_user, legs, cont
     if not (0 <= base_rate <= cap_rate <= 100): raise ValueError("sàn% ≤ trần% ≤ 100")
     if not (0 <= thau_rate <= 100): raise ValueError("đầu thảo% trong [0..100]")
 
-    line_id = insert_and_get_id(
-        "INSERT INTO lines(name,period_days,start_date,legs,contrib,bid_type,bid_value,status,base_rate,cap_rate,thau_rate,remind_hour,remind_min,last_remind_iso) "
-        "VALUES(?,?,?,?,?,'dynamic',0,'OPEN',?,?,?,8,0,NULL)",
-        (name, period_days, start_iso, legs, contrib_i, base_rate, cap_rate, thau_rate)
-    )
+    line_id = await repo.create_line(name, period_days, start_iso, legs, contrib_i, base_rate, cap_rate, thau_rate)
+    await reschedule_reminder(line_id)
 
-    await upd.message.reply_text(
+    await reply(upd,
         f"✅ Tạo dây #{line_id} ({name}) — {'Hụi Tuần' if period_days==7 else 'Hụi Tháng'}\n"
         f"• Mở: {to_user_str(start_dt)} · Chân: {legs} · Mệnh giá: {contrib_i:,} VND\n"
         f"• Sàn {base_rate:.2f}% · Trần {cap_rate:.2f}% · Đầu thảo {thau_rate:.2f}% (hụi dây)\n"
@@ -204,7 +327,7 @@ async def _create_line_and_reply(upd: Update, name, kind, start_user, legs, cont
 async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     # /tao <tên> <tuần|tháng> <DD-MM-YYYY> <số_chân> <mệnh_giá> <sàn_%> <trần_%> <đầu_thảo_%>
     if len(ctx.args) < 8:
-        return await upd.message.reply_text(
+        return await reply(upd,
             "❗ Cú pháp:\n"
             "/tao <tên> <tuần|tháng> <DD-MM-YYYY> <số_chân> <mệnh_giá> <sàn_%> <trần_%> <đầu_thảo_%>\n\n"
             "Ví dụ:\n"
@@ -221,7 +344,7 @@ async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     try:
         _ = parse_user_date(user_date)
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ Ngày không hợp lệ: `{user_date}`. Định dạng đúng: DD-MM-YYYY. Ví dụ: 02-08-2025"
         )
 
@@ -231,7 +354,7 @@ async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if legs <= 0:
             raise ValueError()
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <số_chân> không hợp lệ: `{legs_s}`. Ví dụ đúng: 12 hoặc 27"
         )
 
@@ -241,7 +364,7 @@ async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if contrib <= 0:
             raise ValueError()
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <mệnh_giá> không hợp lệ: `{contrib_s}`.\n"
             "Ví dụ: 2tr · 5tr · 2000000 · 2000k · 2.000.000"
         )
@@ -250,31 +373,31 @@ async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     try:
         base_rate = parse_percent(base_s)
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <sàn_%> không hợp lệ: `{base_s}`. Ví dụ: 5 hoặc 5% hoặc 5,5"
         )
     try:
         cap_rate = parse_percent(cap_s)
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <trần_%> không hợp lệ: `{cap_s}`. Ví dụ: 10 hoặc 10%"
         )
     try:
         thau_rate = parse_percent(thau_s)
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <đầu_thảo_%> không hợp lệ: `{thau_s}`. Ví dụ: 50 hoặc 50%"
         )
 
     # Ràng buộc %
     if not (0 <= base_rate <= cap_rate <= 100):
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ Ràng buộc % sai.\n"
             f"Yêu cầu: 0 ≤ sàn% ≤ trần% ≤ 100.\n"
             f"Bạn nhập: sàn {base_rate} · trần {cap_rate}."
         )
     if not (0 <= thau_rate <= 100):
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <đầu_thảo_%> phải trong khoảng [0..100]. Bạn nhập: {thau_rate}"
         )
 
@@ -285,12 +408,12 @@ async def cmd_tao(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         )
     except Exception as e:
         logger.exception("cmd_tao error: %s", e)
-        await upd.message.reply_text(f"⚠️ Lỗi khi tạo dây: {e}")
+        await reply(upd, f"⚠️ Lỗi khi tạo dây: {e}")
 
 # ----- /tham với báo lỗi chi tiết -----
 async def cmd_tham(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if len(ctx.args) < 3:
-        return await upd.message.reply_text(
+        return await reply(upd,
             "❗ Cú pháp: /tham <mã_dây> <kỳ> <số_tiền_thăm> [DD-MM-YYYY]\n"
             "Ví dụ: /tham 1 1 2tr 10-11-2025"
         )
@@ -298,25 +421,25 @@ async def cmd_tham(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     try:
         line_id = int(ctx.args[0])
     except Exception:
-        return await upd.message.reply_text(f"❌ <mã_dây> phải là số: `{ctx.args[0]}`")
+        return await reply(upd, f"❌ <mã_dây> phải là số: `{ctx.args[0]}`")
     try:
         k = int(ctx.args[1])
     except Exception:
-        return await upd.message.reply_text(f"❌ <kỳ> phải là số: `{ctx.args[1]}`")
+        return await reply(upd, f"❌ <kỳ> phải là số: `{ctx.args[1]}`")
 
     # 2) tải dây
-    rows = get_all("SELECT * FROM lines WHERE id=?", (line_id,))
-    if not rows:
-        return await upd.message.reply_text("❌ Không tìm thấy dây.")
-    line = rows[0]
+    e = await load_line_bids(line_id)
+    line = e[0] if e else None
+    if not line:
+        return await reply(upd, "❌ Không tìm thấy dây.")
     if not (1 <= k <= int(line["legs"])):
-        return await upd.message.reply_text(f"❌ Kỳ hợp lệ 1..{line['legs']}.")
+        return await reply(upd, f"❌ Kỳ hợp lệ 1..{line['legs']}.")
 
     # 3) parse tiền thăm + kiểm tra min/max theo sàn/trần
     try:
         bid = parse_money(ctx.args[2])
     except Exception:
-        return await upd.message.reply_text(
+        return await reply(upd,
             f"❌ <số_tiền_thăm> không hợp lệ: `{ctx.args[2]}`.\n"
             "Ví dụ: 2tr, 500000, 1.500.000"
         )
@@ -329,69 +452,228 @@ async def cmd_tham(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
             rdate_iso = to_iso_str(parse_user_date(ctx.args[3]))
         except Exception:
-            return await upd.message.reply_text(
+            return await reply(upd,
                 f"❌ Ngày không hợp lệ: `{ctx.args[3]}`. Định dạng đúng: DD-MM-YYYY."
             )
     else:
         rdate_iso = None
 
     if not (min_bid <= bid <= max_bid):
-        return await upd.message.reply_text(
+        return await reply(upd,
             "❌ Số tiền thăm nằm ngoài khoảng hợp lệ.\n"
             f"Khoảng đúng: [{min_bid:,} .. {max_bid:,}] VND\n"
             f"— Sàn {line['base_rate']}% · Trần {line['cap_rate']}% · M={M:,}"
         )
 
-    exec_sql(
-        "INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,?) "
-        "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid, round_date=excluded.round_date",
-        (line_id, k, bid, rdate_iso)
-    )
-    await upd.message.reply_text(
+    async with line_locks(line_id):      # đọc-sửa-ghi thăm: lấy lại bản mới nhất khi đã giữ khoá dây
+        e = await load_line_bids(line_id) or e
+        await repo.upsert_round(line, k, bid, rdate_iso, e[1].with_bid(k, bid))
+        line_cache.put_bid(line_id, k, bid)
+    await reply(upd,
         f"✅ Lưu thăm kỳ {k} cho dây #{line_id}: {bid:,} VND"
         + (f" · ngày {to_user_str(parse_iso(rdate_iso))}" if rdate_iso else "")
     )
 
 async def cmd_hen(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if len(ctx.args) != 2:
-        return await upd.message.reply_text("❗Cú pháp: /hen <mã_dây> <HH:MM>  (VD: /hen 1 07:45)")
+        return await reply(upd, "❗Cú pháp: /hen <mã_dây> <HH:MM>  (VD: /hen 1 07:45)")
     try:
         line_id = int(ctx.args[0])
         hh, mm = ctx.args[1].split(":"); hh = int(hh); mm = int(mm)
         if not (0 <= hh <= 23 and 0 <= mm <= 59): raise ValueError("giờ/phút không hợp lệ")
     except Exception as e:
-        return await upd.message.reply_text(f"❌ Tham số không hợp lệ: {e}")
-    rows = get_all("SELECT id FROM lines WHERE id=?", (line_id,))
-    if not rows: return await upd.message.reply_text("❌ Không tìm thấy dây.")
-    exec_sql("UPDATE lines SET remind_hour=?, remind_min=? WHERE id=?", (hh, mm, line_id))
-    await upd.message.reply_text(f"✅ Đã đặt giờ nhắc cho dây #{line_id}: {hh:02d}:{mm:02d}")
-
-def list_text() -> str:
-    rows = get_all("SELECT id,name,period_days,start_date,legs,contrib,base_rate,cap_rate,thau_rate,status,remind_hour,remind_min FROM lines ORDER BY id DESC")
-    if not rows: return "📂 Chưa có dây nào."
-    out = ["📋 **Danh sách dây**:"]
+        return await reply(upd, f"❌ Tham số không hợp lệ: {e}")
+    if not await load_line(line_id): return await reply(upd, "❌ Không tìm thấy dây.")
+    await repo.update_line(line_id, remind_hour=hh, remind_min=mm)
+    line_cache.update_line(line_id, remind_hour=hh, remind_min=mm)
+    await reschedule_reminder(line_id)
+    await reply(upd, f"✅ Đã đặt giờ nhắc cho dây #{line_id}: {hh:02d}:{mm:02d}")
+
+# ----- /nhap: nhập thăm hàng loạt -----
+_IMPORT_SPLIT = re.compile(r"\s*[,;]\s*|\s+")
+
+def _import_date(s: str) -> str:
+    if re.fullmatch(r"\d{4}-\d{1,2}-\d{1,2}", s.strip()):
+        return to_iso_str(datetime.strptime(s.strip(), ISO_FMT))
+    return to_iso_str(parse_user_date(s))
+
+def parse_import(text: str, line):
+    """Dòng `kỳ thăm [ngày]` (cách nhau bởi khoảng trắng, ';' hoặc ',', kể cả ', ') → ({k: (bid, ngày)}, [(số dòng, dòng, lỗi)]).
+
+    Dòng trống/#chú thích được bỏ qua; dòng có nội dung đầu tiên là tiêu đề nếu cột đầu không phải số
+    (chỉ dòng đó). Số tiền không dùng ',' ngăn nghìn (500.000, 500k, 0.5tr); kỳ lặp lại thì lấy dòng sau.
+    """
+    N, M = int(line["legs"]), int(line["contrib"])
+    lo = int(round(M * float(line.get("base_rate", 0)) / 100.0))
+    hi = int(round(M * float(line.get("cap_rate", 100)) / 100.0))
+    rows, errors = {}, []
+    first = True
+    for no, raw in enumerate(text.splitlines(), 1):
+        t = raw.strip()
+        if not t or t.startswith("#"): continue
+        parts = [p for p in _IMPORT_SPLIT.split(t) if p]
+        header, first = first, False
+        if not parts[0].lstrip("-").isdigit():
+            if header: continue                        # tiêu đề CSV
+            errors.append((no, t, "kỳ phải là số")); continue
+        if len(parts) not in (2, 3):
+            errors.append((no, t, "cần: <kỳ> <số_tiền_thăm> [DD-MM-YYYY]")); continue
+        k = int(parts[0])
+        if not (1 <= k <= N):
+            errors.append((no, t, f"kỳ ngoài 1..{N}")); continue
+        try:
+            bid = parse_money(parts[1])
+        except ValueError:
+            errors.append((no, t, "số tiền không hợp lệ")); continue
+        if not (lo <= bid <= hi):
+            errors.append((no, t, f"ngoài [{lo:,} .. {hi:,}]")); continue
+        try:
+            d = _import_date(parts[2]) if len(parts) == 3 else None
+        except Exception:
+            errors.append((no, t, "ngày không hợp lệ")); continue
+        rows[k] = (bid, d)
+    return rows, errors
+
+async def import_rounds(line_id: int, text: str):
+    """Kiểm tra + ghi một lần (executemany, một transaction). None nếu không có dây."""
+    async with line_locks(line_id):
+        e = await load_line_bids(line_id)
+        if not e: return None
+        line, bids, _ = e
+        rows, errors = parse_import(text, line)
+        if rows:
+            new_bids = bids.merged({k: b for k, (b, _) in rows.items()})
+            await repo.upsert_rounds(line, [(k, b, d) for k, (b, d) in sorted(rows.items())], new_bids)
+            line_cache.put_bids(line_id, new_bids)
+    return {"line_id": line_id, "imported": len(rows),
+            "errors": [{"line": no, "text": t, "error": err} for no, t, err in errors]}
+
+def import_report_lines(res: dict, max_errors: int = 30):
+    out = [f"📥 Dây #{res['line_id']}: đã lưu {res['imported']} kỳ · lỗi {len(res['errors'])} dòng"]
+    for er in res["errors"][:max_errors]:
+        out.append(f"• dòng {er['line']}: `{er['text'][:40]}` — {er['error']}")
+    if len(res["errors"]) > max_errors:
+        out.append(f"… và {len(res['errors']) - max_errors} dòng lỗi khác")
+    return out
+
+async def _nhap(upd: Update, id_arg: str, text: str):
+    try: line_id = int(id_arg)
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    if not text.strip():
+        return await reply(upd,
+            "❗ Cú pháp: /nhap <mã_dây> rồi mỗi dòng một kỳ:\n"
+            "<kỳ> <số_tiền_thăm> [DD-MM-YYYY]\n"
+            "Ví dụ:\n/nhap 1\n1 500k 02-08-2025\n2 600k\n"
+            "Hoặc gửi file .csv/.txt với chú thích: /nhap <mã_dây>")
+    res = await import_rounds(line_id, text)
+    if res is None: return await reply(upd, "❌ Không tìm thấy dây.")
+    for m in split_messages(import_report_lines(res)):
+        await reply(upd, m)
+
+async def cmd_nhap(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    # /nhap <mã_dây>\n<kỳ> <thăm> [ngày]\n...
+    if not ctx.args: return await _nhap(upd, "", "")
+    first, _, rest = (upd.message.text or "").partition("\n")
+    extra = first.split()[2:]            # /nhap 1 3 500k → một dòng ngay sau mã dây
+    await _nhap(upd, ctx.args[0], (" ".join(extra) + "\n" + rest) if extra else rest)
+
+async def on_nhap_document(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    # file CSV/TXT, chú thích "/nhap <mã_dây>"
+    args = (upd.message.caption or "").split()
+    doc = upd.message.document
+    if len(args) < 2: return await _nhap(upd, "", "")
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        return await reply(upd, f"❌ File quá lớn (tối đa {IMPORT_MAX_BYTES // 1024} KB).")
+    data = await (await doc.get_file()).download_as_bytearray()
+    await _nhap(upd, args[1], bytes(data).decode("utf-8-sig", errors="replace"))
+
+def tg_len(s: str) -> int:
+    # Telegram đếm độ dài theo UTF-16 (emoji = 2)
+    return len(s.encode("utf-16-le")) // 2
+
+def tg_cut(s: str, limit: int) -> str:
+    # cắt còn ≤ limit đơn vị UTF-16, không tách đôi cặp surrogate của emoji
+    return s.encode("utf-16-le")[:2 * limit].decode("utf-16-le", "ignore")
+
+def split_messages(lines, limit: int = TG_MAX_TEXT):
+    """Ghép các dòng thành nhiều tin, mỗi tin ≤ limit (không cắt giữa dòng, trừ dòng dài hơn limit)."""
+    out, cur, size = [], [], 0
+    for ln in lines:
+        n = tg_len(ln)
+        if n > limit:
+            ln = tg_cut(ln, limit); n = tg_len(ln)
+        if cur and size + 1 + n > limit:
+            out.append("\n".join(cur)); cur, size = [], 0
+        size += n + (1 if cur else 0)
+        cur.append(ln)
+    if cur: out.append("\n".join(cur))
+    return out
+
+# Bộ lọc /danhsach mã hoá gọn cho callback_data: "<trạng thái><kỳ>", vd "o7", "c-", "--"
+def parse_list_filter(args) -> str:
+    st, per = "-", "-"
+    for a in args or []:
+        a = strip_accents(a.strip().lower())
+        if a in ("mo", "open", "dangmo"): st = "o"
+        elif a in ("dong", "closed", "luutru"): st = "c"
+        elif a in ("tuan", "t", "week", "weekly"): per = "7"
+        elif a in ("thang", "month", "monthly"): per = "m"
+    return st + per
+
+def _filter_label(flt: str) -> str:
+    parts = [{"o": "đang mở", "c": "đã đóng"}.get(flt[0]), {"7": "hụi tuần", "m": "hụi tháng"}.get(flt[1])]
+    parts = [p for p in parts if p]
+    return f" ({', '.join(parts)})" if parts else ""
+
+async def list_page(flt: str = "--", before_id: Optional[int] = None, page: int = DANHSACH_PAGE):
+    """Một trang /danhsach theo keyset (id giảm dần) → (các tin nhắn, id để lấy trang sau | None)."""
+    status = {"o": "OPEN", "c": "CLOSED"}.get(flt[0])
+    weekly = {"7": True, "m": False}.get(flt[1])
+    rows = await repo.list_lines(status, weekly, before_id, page + 1)
+    more = len(rows) > page
+    rows = rows[:page]
+    if not rows:
+        return ["📂 Chưa có dây nào." + _filter_label(flt)], None
+    out = [f"📋 **Danh sách dây**{_filter_label(flt)}:"]
     for r in rows:
         kind = "Tuần" if int(r["period_days"])==7 else "Tháng"
         out.append(
             f"• #{r['id']} · {r['name']} · {kind} · mở {to_user_str(parse_iso(r['start_date']))} · chân {r['legs']} · hụi dây {int(r['contrib']):,} VND · "
             f"sàn {float(r['base_rate']):.2f}% · trần {float(r['cap_rate']):.2f}% · thầu {float(r['thau_rate']):.2f}% · nhắc {int(r['remind_hour']):02d}:{int(r['remind_min']):02d} · {r['status']}"
         )
-    return "\n".join(out)
+    return split_messages(out), (int(rows[-1]["id"]) if more else None)
+
+def _next_page_markup(flt: str, cursor: Optional[int]):
+    if cursor is None: return None
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Trang sau ▶️", callback_data=f"ds:{flt}:{cursor}")]])
+
+async def _send_list_page(send, flt: str, before_id: Optional[int]):
+    msgs, cursor = await list_page(flt, before_id)
+    for i, m in enumerate(msgs):
+        last = i == len(msgs) - 1
+        await send(m, reply_markup=_next_page_markup(flt, cursor) if last else None)
 
 async def cmd_danhsach(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await upd.message.reply_text(list_text())
+    # /danhsach [mở|đóng] [tuần|tháng]
+    flt = parse_list_filter(ctx.args)
+    await _send_list_page(lambda t, **kw: reply(upd, t, **kw), flt, None)
 
-def load_line(line_id: int):
-    rows = get_all("SELECT * FROM lines WHERE id=?", (line_id,))
-    return rows[0] if rows else None
+async def cb_danhsach(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = upd.callback_query
+    await q.answer()
+    try:
+        _, flt, cursor = q.data.split(":")
+        cursor = int(cursor)
+        if len(flt) != 2: raise ValueError(flt)
+    except Exception:
+        return
+    await q.edit_message_reply_markup(None)
+    chat_id = q.message.chat.id
+    await _send_list_page(lambda t, **kw: send_text(chat_id, t, **kw), flt, cursor)
 
-async def cmd_tomtat(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args: return await upd.message.reply_text("❗Cú pháp: /tomtat <mã_dây>")
-    try: line_id = int(ctx.args[0])
-    except Exception: return await upd.message.reply_text("❌ mã_dây phải là số.")
-    line = load_line(line_id)
-    if not line: return await upd.message.reply_text("❌ Không tìm thấy dây.")
-    bids = get_bids(line_id)
+async def render_tomtat(line, bids: dict) -> str:
+    line_id = int(line["id"])
     M, N = int(line["contrib"]), int(line["legs"])
     cfg_line = f"Sàn {float(line.get('base_rate',0)):.2f}% · Trần {float(line.get('cap_rate',100)):.2f}% · Đầu thảo {float(line.get('thau_rate',0)):.2f}% (hụi dây)"
     k_now = max(1, min(len(bids)+1, N))
@@ -406,22 +688,15 @@ async def cmd_tomtat(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ]
     best_line = f"⭐ Đề xuất (ROI): kỳ {bestk} · ngày {to_user_str(k_date(line,bestk))} · Payout {bpo:,} · Đã đóng {bpaid:,} · Lãi {int(round(bp)):,} · ROI {roi_to_str(br)}"
     msg.append(best_line)
+    lr = ledger.line_report(line, bids, (await repo.balances([line_id])).get(line_id), datetime.now().date())
+    msg.append(f"• Thực đóng: {lr['paid']:,} / phải đóng tới kỳ {lr['k_due']}: {lr['expected']:,}"
+               + (f" → nợ {lr['arrears']:,}" if lr["arrears"] else " ✅"))
     if is_finished(line): msg.append("✅ Dây đã đến hạn — /dong để lưu trữ.")
-    await upd.message.reply_text("\n".join(msg))
+    return "\n".join(msg)
 
-async def cmd_hottot(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if len(ctx.args) < 1: return await upd.message.reply_text("❗Cú pháp: /hottot <mã_dây> [Roi%|Lãi]")
-    try: line_id = int(ctx.args[0])
-    except Exception: return await upd.message.reply_text("❌ mã_dây phải là số.")
-    metric = "roi"
-    if len(ctx.args) >= 2:
-        raw = strip_accents(ctx.args[1].strip().lower().replace("%", ""))
-        if raw in ("roi", "lai"): metric = raw
-    line = load_line(line_id)
-    if not line: return await upd.message.reply_text("❌ Không tìm thấy dây.")
-    bids = get_bids(line_id)
-    bestk, (bp, br, bpo, bpaid) = best_k_var(line, bids, metric=("roi" if metric=="roi" else "lai"))
-    await upd.message.reply_text(
+def render_hottot(line, bids: dict, metric: str) -> str:
+    bestk, (bp, br, bpo, bpaid) = best_k_var(line, bids, metric=metric)
+    return (
         f"🔎 Gợi ý theo {'ROI%' if metric=='roi' else 'Lãi'}:\n"
         f"• Nên hốt kỳ: {bestk}\n"
         f"• Ngày dự kiến: {to_user_str(k_date(line,bestk))}\n"
@@ -430,37 +705,266 @@ async def cmd_hottot(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
         f"• Lãi ước tính: {int(round(bp)):,} — ROI: {roi_to_str(br)}"
     )
 
+async def cmd_tomtat(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not ctx.args: return await reply(upd, "❗Cú pháp: /tomtat <mã_dây>")
+    try: line_id = int(ctx.args[0])
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    e = await load_line_bids(line_id)
+    if not e: return await reply(upd, "❌ Không tìm thấy dây.")
+    line, bids, ver = e
+    day = datetime.now().strftime(ISO_FMT)
+    text = render_cache.get(line_id, ver, "tomtat", "", day)
+    if text is None:
+        text = render_cache.put(line_id, ver, "tomtat", "", day, await render_tomtat(line, bids))
+    await reply(upd, text)
+
+async def cmd_hottot(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if len(ctx.args) < 1: return await reply(upd, "❗Cú pháp: /hottot <mã_dây> [Roi%|Lãi]")
+    try: line_id = int(ctx.args[0])
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    metric = _metric_arg(ctx.args, 1)
+    e = await load_line_bids(line_id)
+    if not e: return await reply(upd, "❌ Không tìm thấy dây.")
+    line, bids, ver = e
+    day = datetime.now().strftime(ISO_FMT)
+    text = render_cache.get(line_id, ver, "hottot", metric, day)
+    if text is None:
+        text = render_cache.put(line_id, ver, "hottot", metric, day, render_hottot(line, bids, metric))
+    await reply(upd, text)
+
+def render_mophong(line, sim: dict) -> str:
+    import montecarlo
+    lo, hi = sim["bid_range"]
+    kr, kp = sim["best_k_roi"], sim["best_k_profit"]
+    pm, rm, pct = sim["profit_mean"], sim["roi_mean"], sim["profit_pct"]
+    p_lo, p_mid, p_hi = (pct[p] for p in montecarlo.PCTS)
+    msg = [
+        f"🎲 Mô phỏng dây #{line['id']} · {line['name']} — {sim['paths']:,} lần · phân phối {sim['dist']}",
+        f"• Kỳ chưa có thăm: {len(sim['sampled_k'])} · rút trong [{lo:,} .. {hi:,}] VND",
+        f"⭐ ROI kỳ vọng cao nhất: kỳ {kr} · ngày {to_user_str(k_date(line,kr))} · ROI {roi_to_str(rm[kr-1])} · Lãi TB {int(round(pm[kr-1])):,}",
+        f"⭐ Lãi kỳ vọng cao nhất: kỳ {kp} · ngày {to_user_str(k_date(line,kp))} · Lãi TB {int(round(pm[kp-1])):,} · ROI {roi_to_str(rm[kp-1])}",
+        f"Kỳ · Lãi TB · ROI TB · P{montecarlo.PCTS[0]}–P{montecarlo.PCTS[-1]} (trung vị)",
+    ]
+    for k in range(1, min(len(pm), MC_MAX_ROWS) + 1):
+        i = k - 1
+        msg.append(f"k{k}: {int(round(pm[i])):,} · {roi_to_str(rm[i])} · "
+                   f"{int(round(p_lo[i])):,}–{int(round(p_hi[i])):,} ({int(round(p_mid[i])):,})")
+    if len(pm) > MC_MAX_ROWS:
+        msg.append(f"… còn {len(pm) - MC_MAX_ROWS} kỳ")
+    return "\n".join(msg)
+
+async def cmd_mophong(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not ctx.args: return await reply(upd, "❗Cú pháp: /mophong <mã_dây> [empirical|uniform|tri]")
+    import montecarlo                    # numpy: chỉ nạp khi có người dùng /mophong
+    try: line_id = int(ctx.args[0])
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    dist = ctx.args[1].strip().lower() if len(ctx.args) > 1 else MC_DIST
+    if dist not in montecarlo.DISTS:
+        return await reply(upd, "❌ Phân phối phải là: " + " | ".join(montecarlo.DISTS))
+    if montecarlo.np is None:
+        return await reply(upd, "❌ Máy chủ chưa cài numpy, không mô phỏng được.")
+    e = await load_line_bids(line_id)
+    if not e: return await reply(upd, "❌ Không tìm thấy dây.")
+    line, bids, ver = e
+    day = datetime.now().strftime(ISO_FMT)
+    text = render_cache.get(line_id, ver, "mophong", dist, day)
+    if text is None:
+        # CPU nặng (paths × legs): chạy ngoài event loop; seed theo version → cùng version cùng kết quả
+        sim = await asyncio.to_thread(montecarlo.simulate, line, bids, MC_PATHS, dist, ver)
+        text = render_cache.put(line_id, ver, "mophong", dist, day, render_mophong(line, sim))
+    await reply(upd, text)
+
+# ----- Sổ đóng tiền (payments / line_balances) -----
+async def ledger_report(line_id: Optional[int] = None, per_line: bool = True):
+    """Thực đóng so với phải đóng tới hôm nay: một dây (None nếu không có) hoặc mọi dây đang mở."""
+    today = datetime.now().date()
+    if line_id is not None:
+        e = await load_line_bids(line_id)
+        if not e: return None
+        return ledger.report([e[0]], {line_id: e[1]}, await repo.balances([line_id]), today, per_line)
+    lines = await repo.open_lines()
+    _, rounds = await repo.portfolio_rows()
+    bids = {}
+    for lid, k, b in rounds:
+        bids.setdefault(lid, {})[k] = b
+    return ledger.report(lines, bids, await repo.balances(), today, per_line)
+
+async def cmd_dongtien(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    # /dongtien <mã_dây> <số_tiền> [DD-MM-YYYY]   (số âm = điều chỉnh)
+    if len(ctx.args) < 2:
+        return await reply(upd, "❗Cú pháp: /dongtien <mã_dây> <số_tiền> [DD-MM-YYYY]\nVí dụ: /dongtien 1 1.8tr 09-08-2025")
+    try: line_id = int(ctx.args[0])
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    try:
+        amount = parse_money(ctx.args[1])
+        if amount == 0: raise ValueError
+    except Exception:
+        return await reply(upd, f"❌ <số_tiền> không hợp lệ: `{ctx.args[1]}`")
+    try:
+        pay_date = to_iso_str(parse_user_date(ctx.args[2]) if len(ctx.args) >= 3 else datetime.now())
+    except Exception:
+        return await reply(upd, f"❌ Ngày không hợp lệ: `{ctx.args[2]}`. Định dạng đúng: DD-MM-YYYY.")
+    if not await load_line(line_id): return await reply(upd, "❌ Không tìm thấy dây.")
+    await repo.add_payment(line_id, amount, pay_date)
+    line_cache.touch(line_id)
+    r = (await ledger_report(line_id))["per_line"][0]
+    await reply(upd,
+        f"✅ Ghi {'đóng' if amount > 0 else 'điều chỉnh'} {amount:,} VND cho dây #{line_id} · ngày {to_user_str(parse_iso(pay_date))}\n"
+        f"• Thực đóng: {r['paid']:,} ({r['n_payments']} lần) · Phải đóng tới kỳ {r['k_due']}: {r['expected']:,}\n"
+        + (f"• Còn nợ: {r['arrears']:,} VND" if r["arrears"] else f"• Dư: {r['balance']:,} VND")
+    )
+
+def ledger_text(rep: dict, top: int = 20) -> list:
+    if not rep["lines"]: return ["📂 Chưa có dây nào đang mở."]
+    out = [
+        f"💰 Công nợ {rep['lines']} dây đến {to_user_str(parse_iso(rep['date']))}",
+        f"• Phải đóng: {rep['expected']:,} · Thực đóng: {rep['paid']:,} · Chênh: {rep['balance']:,} VND",
+        f"• Nợ: {rep['arrears']:,} VND ở {rep['lines_in_arrears']} dây",
+    ]
+    debt = sorted((r for r in rep["per_line"] if r["arrears"]), key=lambda r: r["arrears"], reverse=True)
+    out += [f"  #{r['line_id']} {r['name']} · kỳ {r['k_due']} · đóng {r['paid']:,}/{r['expected']:,} · nợ {r['arrears']:,}"
+            for r in debt[:top]]
+    if len(debt) > top: out.append(f"  … và {len(debt) - top} dây khác")
+    return out
+
+async def cmd_congno(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    line_id = None
+    if ctx.args:
+        try: line_id = int(ctx.args[0])
+        except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    rep = await ledger_report(line_id)
+    if rep is None: return await reply(upd, "❌ Không tìm thấy dây.")
+    for m in split_messages(ledger_text(rep)):
+        await reply(upd, m)
+
+def _metric_arg(args, idx: int) -> str:
+    if len(args) > idx:
+        raw = strip_accents(args[idx].strip().lower().replace("%", ""))
+        if raw in ("roi", "lai"): return raw
+    return "roi"
+
+def portfolio_text(rep: dict, top: int = 5) -> str:
+    if not rep["lines"]: return "📂 Chưa có dây nào đang mở."
+    metric = rep["metric"]
+    msg = [
+        f"📊 Tổng quan {rep['lines']} dây đang mở (theo {'ROI%' if metric=='roi' else 'Lãi'})",
+        f"• Đã đóng tới kỳ hiện tại: {rep['paid_in']:,} VND",
+        f"• Vốn đóng tới kỳ hốt đề xuất: {rep['exposure']:,} VND",
+        f"• Payout dự kiến: {rep['expected_payout']:,} · Lãi dự kiến: {rep['expected_profit']:,} (ROI {roi_to_str(rep['roi'])})",
+    ]
+    key = "best_roi" if metric == "roi" else "best_profit"
+    best = sorted(rep["per_line"], key=lambda r: r[key], reverse=True)[:top]
+    if best:
+        msg.append(f"⭐ Top {len(best)}:")
+        msg += [f"  #{r['line_id']} {r['name']} · hốt kỳ {r['best_k']} · Lãi {r['best_profit']:,} · ROI {roi_to_str(r['best_roi'])}"
+                for r in best]
+    return "\n".join(msg)
+
+async def cmd_tongquan(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    metric = _metric_arg(ctx.args, 0)
+    summary = await repo.portfolio_summary(metric)
+    await reply(upd, portfolio_text(portfolio.report(metric, summary=summary)))
+
 async def cmd_dong(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args: return await upd.message.reply_text("❗Cú pháp: /dong <mã_dây>")
+    if not ctx.args: return await reply(upd, "❗Cú pháp: /dong <mã_dây>")
     try: line_id = int(ctx.args[0])
-    except Exception: return await upd.message.reply_text("❌ mã_dây phải là số.")
-    exec_sql("UPDATE lines SET status='CLOSED' WHERE id=?", (line_id,))
-    await upd.message.reply_text(f"🗂️ Đã đóng & lưu trữ dây #{line_id}.")
+    except Exception: return await reply(upd, "❌ mã_dây phải là số.")
+    await repo.update_line(line_id, status="CLOSED")
+    line_cache.update_line(line_id, status="CLOSED")
+    await reschedule_reminder(line_id)
+    await reply(upd, f"🗂️ Đã đóng & lưu trữ dây #{line_id}.")
 
 async def cmd_huy(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await upd.message.reply_text("🛑 Huỷ wizard. Hãy dùng các lệnh một bước như /tao, /tham, /hen ...")
+    await reply(upd, "🛑 Huỷ wizard. Hãy dùng các lệnh một bước như /tao, /tham, /hen ...")
 
 async def handle_text(upd: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await upd.message.reply_text("💡 Vui lòng dùng lệnh: /tao, /tham, /hen, /danhsach, /tomtat, /hottot, /dong, /baocao")
+    await reply(upd, "💡 Vui lòng dùng lệnh: /tao, /tham, /hen, /danhsach, /tomtat, /hottot, /dong, /baocao")
+
+def update_key(update: Update):
+    """Khoá shard: chat của update (update không có chat thì rải theo update_id)."""
+    chat = update.effective_chat
+    return chat.id if chat is not None else update.update_id
+
+class UpdateFailed(Exception):
+    """Handler của update bị lỗi; update_id đã được nhả để Telegram gửi lại."""
+
+_update_errors = contextvars.ContextVar("update_errors", default=None)   # on_error → process_update
+
+async def process_update(update: Update):
+    """process_update của PTB, trừ khi update_id đã được instance nào đó nhận (seen_updates).
+
+    → True đã xử lý; False bỏ qua (đã xử lý xong); None bỏ qua vì instance khác đang xử lý.
+    Update chỉ được đánh dấu xong khi PTB xử lý xong không lỗi; lỗi thì nhả ra và raise UpdateFailed.
+    """
+    uid = update.update_id
+    if uid is not None:
+        got = await dedup.claim(uid)
+        if not got:
+            logger.info("duplicate update %s skipped (%s)", uid, "in progress" if got is None else "done")
+            return got
+    errors = []
+    token = _update_errors.set(errors)
+    try:
+        await app_state["application"].process_update(update)
+    except BaseException:
+        if uid is not None: await dedup.release(uid)
+        raise
+    finally:
+        _update_errors.reset(token)
+    if uid is not None:
+        if errors:
+            await dedup.release(uid)
+            raise UpdateFailed(f"update {uid}: {errors[0]!r}")
+        await dedup.done(uid)
+    return True
 
 # ================= Build PTB Application =================
-def build_app():
-    application = Application.builder().token(BOT_TOKEN).build()
+def timed_handler(name: str, fn):
+    async def wrapper(upd, ctx):
+        t = time.perf_counter()
+        try:
+            return await fn(upd, ctx)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - t, name)
+    return wrapper
+
+def build_app(request=None):
+    """request: telegram.request.BaseRequest thay cho HTTPX (bench.py webhook dùng bot giả)."""
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+    from telegram.request import HTTPXRequest
+    from tg_request import TimedRequest
+    req = TimedRequest(request if request is not None else HTTPXRequest(connection_pool_size=256))
+    application = Application.builder().token(BOT_TOKEN).request(req).build()
     application.add_handler(CommandHandler("start",    cmd_start))
     application.add_handler(CommandHandler("lenh",     cmd_lenh))
     application.add_handler(CommandHandler("baocao",   cmd_setreport))
     application.add_handler(CommandHandler("tao",      cmd_tao))
     application.add_handler(CommandHandler("tham",     cmd_tham))
     application.add_handler(CommandHandler("hen",      cmd_hen))
+    application.add_handler(CommandHandler("nhap",     cmd_nhap))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/nhap(@\w+)?\b"), on_nhap_document))
     application.add_handler(CommandHandler("danhsach", cmd_danhsach))
+    application.add_handler(CallbackQueryHandler(cb_danhsach, pattern=r"^ds:"))
     application.add_handler(CommandHandler("tomtat",   cmd_tomtat))
     application.add_handler(CommandHandler("hottot",   cmd_hottot))
+    application.add_handler(CommandHandler("mophong",  cmd_mophong))
     application.add_handler(CommandHandler("dong",     cmd_dong))
+    application.add_handler(CommandHandler("tongquan", cmd_tongquan))
+    application.add_handler(CommandHandler("dongtien", cmd_dongtien))
+    application.add_handler(CommandHandler("congno",   cmd_congno))
     application.add_handler(CommandHandler("huy",      cmd_huy))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    for h in application.handlers[0]:      # /metrics: thời gian mỗi handler, nhãn = tên lệnh
+        name = next(iter(h.commands)) if isinstance(h, CommandHandler) else h.callback.__name__
+        h.callback = timed_handler(name, h.callback)
 
     async def on_error(update, context):
         logger.exception("PTB error: %s", context.error)
+        errors = _update_errors.get()
+        if errors is not None: errors.append(context.error)
         try:
             await notify_admin(f"⚠️ PTB error: {context.error}")
         except Exception:
@@ -468,35 +972,78 @@ def build_app():
     application.add_error_handler(on_error)
     return application
 
-def run_bot_background():
+def ensure_bot() -> bool:
+    """Bot đã sẵn sàng (BOT_INIT=webhook: khởi động ở lần cần đầu tiên, chờ tối đa BOT_READY_WAIT giây)."""
+    if not BOT_TOKEN: return False
+    if not app_state["started"]:
+        with _bot_start_lock:            # nhiều luồng gunicorn cùng gặp update đầu tiên
+            run_bot_background()
+    return app_state["started"] and bot_ready.wait(BOT_READY_WAIT)
+
+def app_loop():
+    """Event loop chung (một thread) của bot và các route Flask, dựng ở lần cần đầu tiên.
+
+    Repo SQLAlchemy được init một lần trên loop này (engine async gắn với loop), nên route
+    dùng được repo mà không phải dựng bot PTB; bot khởi động sau vẫn chạy trên cùng loop.
+    """
+    with _loop_lock:
+        loop = app_state["loop"]
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="app-loop", daemon=True).start()
+            if repo.name != "sqlite":
+                app_state["repo_init"] = asyncio.run_coroutine_threadsafe(repo.init(), loop)
+            app_state["loop"] = loop
+    return loop
+
+def run_bot_background(request=None):
     if getattr(run_bot_background, "_started", False):
         return
     if not BOT_TOKEN:
         logger.warning("BOT_TOKEN is empty; bot will not start.")
         return
-    loop = asyncio.new_event_loop()
-    app_state["loop"] = loop
+    loop = app_loop()
+    app_state["runner"] = ShardedRunner(process_update, UPDATE_WORKERS, UPDATE_SHARD_MAX)
+    if WEBHOOK_MODE == "queue":
+        app_state["queue"] = UpdateQueue(WEBHOOK_QUEUE_MAX)
+        app_state["queue"].bind(loop)
+    if REMINDERS_ENABLED:
+        app_state["reminders"] = ReminderScheduler(repo, send_reminder)
 
     async def _runner():
-        app_state["application"] = build_app()
+        t = time.perf_counter()
+        if app_state["repo_init"]:
+            await asyncio.wrap_future(app_state["repo_init"])
+        app_state["application"] = build_app(request)
         await app_state["application"].initialize()
         await app_state["application"].start()
-        logger.info("Telegram application started")
+        app_state["outbox"] = Outbox(
+            app_state["application"].bot, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+            chat_burst=OUTBOX_CHAT_BURST, admin_chat_id=ADMIN_CHAT_ID, digest_window=ALERT_DIGEST_SEC)
+        app_state["outbox_task"] = loop.create_task(app_state["outbox"].run())
+        app_state["runner"].start()
+        app_state["loop_lag_task"] = loop.create_task(loop_lag.run())
+        if app_state["queue"]:
+            app_state["queue_task"] = loop.create_task(app_state["queue"].run(
+                lambda u: app_state["runner"].put(update_key(u), u)))
+        if app_state["reminders"]:
+            app_state["reminders_task"] = loop.create_task(app_state["reminders"].run())
+        STARTUP["bot_init_s"] = round(time.perf_counter() - t, 4)
+        bot_ready.set()
+        logger.info("Telegram application started (webhook mode: %s, %.2fs)", WEBHOOK_MODE, STARTUP["bot_init_s"])
         while True:
             await asyncio.sleep(3600)
 
-    def _thread():
-        asyncio.set_event_loop(loop)
-        loop.create_task(_runner())
-        loop.run_forever()
-
-    t = threading.Thread(target=_thread, name="tg-bot", daemon=True)
-    t.start()
+    app_state["bot_task"] = asyncio.run_coroutine_threadsafe(_runner(), loop)
+    app_state["bot_task"].add_done_callback(
+        lambda f: f.cancelled() or logger.error("Telegram application stopped: %r", f.exception()))
     app_state["started"] = True
     run_bot_background._started = True
 
-# start bot in background when module loads (Cloud Run container start)
-run_bot_background()
+# BOT_INIT=background: dựng bot song song ngay khi nạp module (Cloud Run container start);
+# BOT_INIT=webhook: để tới update đầu tiên (ensure_bot), /health trả lời ngay từ đầu
+if BOT_INIT != "webhook":
+    run_bot_background()
 
 # ================= HTTP routes =================
 @app.get("/")
@@ -505,28 +1052,203 @@ def root():
 
 @app.get("/health")
 def health():
-    return jsonify(status="ok"), 200
+    out = {"status": "ok", "line_cache": line_cache.stats(), "render_cache": render_cache.stats(),
+           "loop_lag": loop_lag.stats(), "dedup": dedup.stats(), "startup": STARTUP}
+    if write_coalescer.coalescer():
+        out["writes"] = write_coalescer.coalescer().stats()
+    if app_state.get("runner"):
+        out["runner"] = app_state["runner"].stats()
+    if app_state.get("queue"):
+        out["queue"] = app_state["queue"].stats()
+    if app_state.get("reminders"):
+        out["reminders"] = app_state["reminders"].stats()
+    if app_state.get("outbox"):
+        out["outbox"] = app_state["outbox"].stats()
+    return jsonify(out), 200
+
+metrics.register_stats("huibot_line_cache", "LineCache", line_cache.stats)
+metrics.register_stats("huibot_render_cache", "RenderCache", render_cache.stats)
+metrics.register_stats("huibot_loop_lag", "LoopLagMonitor", loop_lag.stats)
+metrics.register_stats("huibot_dedup", "UpdateDedup", dedup.stats)
+metrics.register_stats("huibot_writes", "Group commit",
+                       lambda: write_coalescer.coalescer() and write_coalescer.coalescer().stats())
+for _k in ("runner", "queue", "reminders", "outbox"):
+    metrics.register_stats(f"huibot_{_k}", _k, lambda k=_k: app_state.get(k) and app_state[k].stats())
+
+@app.get("/metrics")
+def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def repo_loop():
+    """Loop chạy coroutine của repo cho route Flask: app_loop(), không khởi động bot
+    (/report, /payments, /balances, /export, /import không trả giá dựng PTB)."""
+    loop = app_loop()
+    if app_state["repo_init"]:
+        app_state["repo_init"].result(timeout=60)
+    return loop
+
+def run_sync(coro, timeout: float = 10):
+    """Chạy coroutine của repo từ route Flask (trên repo_loop())."""
+    return asyncio.run_coroutine_threadsafe(coro, repo_loop()).result(timeout=timeout)
+
+def iter_sync(agen):
+    """Duyệt async generator của repo từ route Flask (từng khối, trên repo_loop())."""
+    loop = repo_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result(timeout=60)
+            except StopAsyncIteration:
+                break
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result(timeout=10)
+
+def _secret_ok() -> bool:
+    expected = WEBHOOK_SECRET or ""
+    got = request.args.get("secret", "")
+    return not expected or got == expected
+
+@app.get("/report")
+def report():
+    if not _secret_ok():
+        return "forbidden", 403
+    metric = request.args.get("metric", "roi")
+    per_line = request.args.get("lines", "0") not in ("0", "", "false")
+    metric = "lai" if metric == "lai" else "roi"
+    summary = run_sync(repo.portfolio_summary(metric))
+    return jsonify(portfolio.report(metric, per_line=per_line, summary=summary)), 200
+
+@app.post("/payments")
+def payments_http():
+    # {"line_id": 1, "amount": 1800000, "pay_date": "2025-08-09"}; amount nhận cả "1.8tr"
+    if not _secret_ok():
+        return "forbidden", 403
+    data = request.get_json(silent=True) or {}
+    try:
+        line_id = int(data["line_id"])
+        amount = parse_money(data["amount"])
+        pay_date = to_iso_str(parse_iso(data["pay_date"]) if data.get("pay_date") else datetime.now())
+        if amount == 0: raise ValueError("amount = 0")
+    except Exception as e:
+        return jsonify({"error": f"invalid payment: {e}"}), 400
+
+    async def _add():
+        if not await load_line(line_id): return None
+        await repo.add_payment(line_id, amount, pay_date)
+        line_cache.touch(line_id)
+        return (await ledger_report(line_id))["per_line"][0]
+    res = run_sync(_add())
+    if res is None:
+        return jsonify({"error": "line not found"}), 404
+    return jsonify(res), 201
+
+@app.get("/balances")
+def balances_http():
+    # ?line_id=1 → một dây; không có → mọi dây đang mở (&lines=0 bỏ chi tiết)
+    if not _secret_ok():
+        return "forbidden", 403
+    line_id = request.args.get("line_id", type=int)
+    per_line = request.args.get("lines", "1") not in ("0", "", "false")
+    rep = run_sync(ledger_report(line_id, per_line))
+    if rep is None:
+        return jsonify({"error": "line not found"}), 404
+    return jsonify(rep), 200
+
+def _date_arg(name: str) -> Optional[str]:
+    v = request.args.get(name)
+    if not v: return None
+    return to_iso_str(parse_iso(v) if re.fullmatch(r"\d{4}-\d{2}-\d{2}", v) else parse_user_date(v))
+
+@app.get("/export/<table>.<fmt>")
+def export_http(table: str, fmt: str):
+    # /export/rounds.csv?line_id=1&from=01-08-2025&to=2025-12-31 ; gzip nếu Accept-Encoding có gzip
+    if not _secret_ok():
+        return "forbidden", 403
+    if table not in EXPORT_TABLES or fmt not in export.FORMATS:
+        return jsonify({"error": f"tables: {', '.join(EXPORT_TABLES)} · formats: {', '.join(export.FORMATS)}"}), 404
+    try:
+        line_id = request.args.get("line_id", type=int)
+        date_from, date_to = _date_arg("from"), _date_arg("to")
+    except Exception as e:
+        return jsonify({"error": f"invalid filter: {e}"}), 400
+    cols = EXPORT_TABLES[table][0]
+    parts = export.encode(iter_sync(repo.export_chunks(table, line_id, date_from, date_to)), cols, fmt)
+    headers = {"Content-Disposition": f'attachment; filename="{table}.{fmt}"'}
+    if request.accept_encodings["gzip"] > 0:          # "gzip;q=0" là từ chối
+        headers["Content-Encoding"] = "gzip"
+        body = export.gzip_stream(parts)
+    else:
+        body = export.utf8(parts)
+    return Response(body, content_type=export.FORMATS[fmt], headers=headers)
+
+@app.post("/import/<int:line_id>")
+def import_http(line_id: int):
+    # body: text/csv hoặc text/plain, mỗi dòng `kỳ,thăm[,ngày]`
+    if not _secret_ok():
+        return "forbidden", 403
+    if (request.content_length or 0) > IMPORT_MAX_BYTES:
+        return "too large", 413
+    res = run_sync(import_rounds(line_id, request.get_data(as_text=True)), timeout=60)
+    if res is None:
+        return jsonify({"error": "line not found"}), 404
+    return jsonify(res), 200
+
+def parse_update(data: dict):
+    from telegram import Update
+    return Update.de_json(data, app_state["application"].bot)
 
 @app.post("/webhook")
 def webhook():
-    expected = WEBHOOK_SECRET or ""
-    got = request.args.get("secret", "")
-    if expected and got != expected:
+    if not _secret_ok():
         return "forbidden", 403
 
-    if not app_state.get("application") or not app_state.get("loop"):
+    if not ensure_bot():
         return "bot not started", 503
 
     data = request.get_json(silent=True) or {}
+    uid = data.get("update_id")
+    if isinstance(uid, int) and not dedup.check(uid):
+        return "ok", 200                     # Telegram gửi lại update đã nhận
+    q = app_state.get("queue")
+    if q:
+        try:
+            update = parse_update(data)
+        except Exception as e:
+            logger.exception("webhook parse error: %s", e)
+            return "ok", 200
+        if not q.put(update):
+            if isinstance(uid, int): dedup.forget(uid)
+            logger.warning("update queue full (%d); asking Telegram to retry", q.maxsize)
+            return "queue full", 503, {"Retry-After": str(WEBHOOK_RETRY_AFTER)}
+        return "ok", 200
+
+    try:
+        update = parse_update(data)
+    except Exception as e:
+        logger.exception("webhook parse error: %s", e)
+        return "ok", 200
     try:
-        update = Update.de_json(data, app_state["application"].bot)
         fut = asyncio.run_coroutine_threadsafe(
-            app_state["application"].process_update(update),
+            app_state["runner"].run(update_key(update), update),
             app_state["loop"]
         )
-        fut.result(timeout=10)
+        t = time.perf_counter()
+        try:
+            res = fut.result(timeout=10)
+        finally:
+            metrics.WEBHOOK_WAIT.observe(time.perf_counter() - t)
+    except FutureTimeout:
+        metrics.WEBHOOK_TIMEOUTS.inc()
+        logger.warning("webhook: process_update quá 10s")
     except Exception as e:
+        # xử lý lỗi: update_id đã được nhả, Telegram gửi lại
+        if isinstance(uid, int): dedup.forget(uid)
         logger.exception("webhook error: %s", e)
+        return "error", 500
+    else:
+        if res is None:                      # instance khác đang xử lý: gửi lại sau, phòng nó chết giữa chừng
+            if isinstance(uid, int): dedup.forget(uid)
+            return "in progress", 503, {"Retry-After": str(WEBHOOK_RETRY_AFTER)}
     return "ok", 200
 
 if __name__ == "__main__":
@@ -0,0 +1,747 @@
+"""Micro-benchmarks cho HuiBot.
+
+    python bench.py db [--n 5000]
+    python bench.py payout [--n 5000] [--legs 27]
+    python bench.py repo [--n 500] [--url postgresql://...]
+    python bench.py loop [--n 40] [--slow-ms 50]
+    python bench.py group [--n 2000] [--sync NORMAL|FULL]
+    python bench.py import [--n 10000]
+    python bench.py ledger [--n 300000]
+    python bench.py export [--n 300000]
+    python bench.py rows [--n 10000] [--legs 27]
+    python bench.py mc [--n 100000] [--legs 27]
+    python bench.py portfolio [--lines 5000] [--legs 27]
+    python bench.py webhook [--n 2000] [--concurrency 1,8,32] [--lines 1000]
+    python bench.py hot [--n 5000]
+    python bench.py shards [--n 400] [--concurrency 1,8,32]
+
+Mỗi phần in kết quả (JSON) ra stdout, --out FILE ghi thêm ra file để so giữa các lần chạy;
+chạy trên DB tạm (không đụng db/hui.db).
+"""
+import os, sys, time, json, sqlite3, tempfile, argparse
+
+def _tmp_db():
+    d = tempfile.mkdtemp(prefix="huibench-")
+    path = os.path.join(d, "hui.db")
+    os.environ["DB_PATH"] = path
+    return path
+
+def _timeit(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n * 1e6  # µs/op
+
+# ================= db: per-query overhead =================
+def bench_db(args):
+    path = _tmp_db()
+    import db_sqlite
+    db_sqlite.init_db()
+    lid = db_sqlite.insert_and_get_id(
+        "INSERT INTO lines(name,period_days,start_date,legs,contrib,bid_type,bid_value,status,base_rate,cap_rate,thau_rate) "
+        "VALUES('bench',7,'2025-01-01',27,2000000,'dynamic',0,'OPEN',5,10,50)")
+
+    # Cách cũ: mỗi lệnh mở kết nối mới + makedirs + PRAGMA WAL rồi đóng.
+    def legacy_conn():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def legacy_read(i):
+        conn = legacy_conn(); cur = conn.cursor()
+        cur.execute("SELECT * FROM lines WHERE id=?", (lid,))
+        [dict(r) for r in cur.fetchall()]
+        conn.close()
+
+    def legacy_write(i):
+        conn = legacy_conn(); cur = conn.cursor()
+        cur.execute("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,NULL) "
+                    "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid", (lid, i % 27 + 1, i))
+        conn.commit(); conn.close()
+
+    def pooled_read(i):
+        db_sqlite.get_all("SELECT * FROM lines WHERE id=?", (lid,))
+
+    def pooled_write(i):
+        db_sqlite.exec_sql("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,NULL) "
+                           "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid", (lid, i % 27 + 1, i))
+
+    n = args.n
+    res = {
+        "legacy_read_us":  _timeit(legacy_read, n),
+        "pooled_read_us":  _timeit(pooled_read, n),
+        "legacy_write_us": _timeit(legacy_write, n),
+        "pooled_write_us": _timeit(pooled_write, n),
+    }
+    res["read_speedup"] = res["legacy_read_us"] / res["pooled_read_us"]
+    res["write_speedup"] = res["legacy_write_us"] / res["pooled_write_us"]
+    return res
+
+# ================= payout: best_k_var =================
+def bench_payout(args):
+    import random
+    import payout
+    N = args.legs
+    line = {"contrib": 2_000_000, "legs": N, "thau_rate": 50}
+    bids = {k: random.randint(100_000, 200_000) for k in range(1, N // 2 + 1)}
+
+    def quadratic(i):  # cách cũ: tính lại tổng đã đóng cho từng k
+        M = line["contrib"]
+        for kk in range(1, N + 1):
+            sum(M - bids.get(j, 0) for j in range(1, kk))
+
+    return {
+        "legs": N,
+        "quadratic_us": _timeit(quadratic, max(1, args.n // 10)),
+        "engine_us": _timeit(lambda i: payout.best_k(line, bids), args.n),
+        "numpy": payout.numpy() is not None and N >= payout.NUMPY_MIN_LEGS,
+    }
+
+# ================= repo: contract + latency per backend =================
+async def _repo_contract(r):
+    """Cùng một kịch bản cho mọi backend; sai lệch → AssertionError."""
+    lid = await r.create_line("c1", 7, "2025-01-06", 10, 2_000_000, 5.0, 50.0, 10.0)
+    lid2 = await r.create_line("c2", 30, "2025-02-01", 12, 5_000_000, 4.0, 15.0, 40.0)
+    line = await r.load_line(lid)
+    assert line["name"] == "c1" and line["status"] == "OPEN" and int(line["remind_hour"]) == 8, line
+    assert await r.load_line(10 ** 9) is None
+    assert await r.load_bids(lid) == {}
+    await r.upsert_round(line, 1, 300_000, None)
+    await r.upsert_round(line, 2, 400_000, "2025-01-13", {1: 300_000, 2: 400_000})
+    await r.upsert_round(line, 1, 350_000, "2025-01-06")                # ghi đè
+    assert await r.load_bids(lid) == {1: 350_000, 2: 400_000}
+    await r.upsert_rounds(line, [(2, 450_000, None), (3, 500_000, "2025-01-20")], {1: 350_000, 2: 450_000, 3: 500_000})
+    assert await r.load_bids(lid) == {1: 350_000, 2: 450_000, 3: 500_000}
+    assert await r.update_line(lid, remind_hour=7, remind_min=45) == 1
+    assert int((await r.load_line(lid))["remind_min"]) == 45
+    assert [x["id"] for x in await r.list_lines()] == [lid2, lid]
+    assert [x["id"] for x in await r.list_lines(weekly=True)] == [lid]
+    assert [x["id"] for x in await r.list_lines(before_id=lid2, limit=5)] == [lid]
+    lines, rounds = await r.portfolio_rows()
+    assert [l[0] for l in lines] == [lid, lid2] and sorted(rounds) == [(lid, 1, 350_000), (lid, 2, 450_000), (lid, 3, 500_000)]
+    import portfolio
+    for metric in ("roi", "lai"):
+        assert portfolio.report(metric, summary=await r.portfolio_summary(metric)) == \
+            portfolio.report(metric, rows=(lines, rounds)), metric
+    assert await r.claim_reminder(lid, "2025-01-13") and not await r.claim_reminder(lid, "2025-01-13")
+    await r.release_reminder(lid, "2025-01-13", None)
+    assert (await r.load_line(lid))["last_remind_iso"] is None
+    await r.update_line(lid2, status="CLOSED")
+    assert [x["id"] for x in await r.open_lines()] == [lid]
+    assert [x["id"] for x in await r.list_lines("CLOSED")] == [lid2]
+    assert await r.add_payment(lid, 1_650_000, "2025-01-13") == (1_650_000, 1)
+    assert await r.add_payment(lid, 1_600_000, "2025-01-06") == (3_250_000, 2)
+    bal = (await r.balances([lid]))[lid]
+    assert (bal["paid_total"], bal["last_pay_date"]) == (3_250_000, "2025-01-13") and await r.balances([lid2]) == {}
+    chunks = [c async for c in r.export_chunks("rounds", lid, "2025-01-07", None, size=1)]
+    assert [list(map(tuple, c)) for c in chunks] == [[(lid, 3, 500_000, "2025-01-20")]], chunks
+    assert sum([len(c) async for c in r.export_chunks("lines")]) == 2
+    assert await r.claim_update(100) and await r.claim_update(101) and not await r.claim_update(100)
+    assert await r.prune_updates(101) == 1 and await r.claim_update(100)
+    assert await r.cfg_get("bot_cfg", {}) == {}
+    await r.cfg_set("bot_cfg", {"report_chat_id": -1}); await r.cfg_set("bot_cfg", {"report_chat_id": -2})
+    assert await r.cfg_get("bot_cfg") == {"report_chat_id": -2}
+    return line
+
+async def _repo_timing(r, line, n):
+    async def t(fn):
+        t0 = time.perf_counter()
+        for i in range(n):
+            await fn(i)
+        return (time.perf_counter() - t0) / n * 1e6
+    lid = int(line["id"])
+    return {
+        "load_line_us": await t(lambda i: r.load_line(lid)),
+        "load_bids_us": await t(lambda i: r.load_bids(lid)),
+        "upsert_round_us": await t(lambda i: r.upsert_round(line, i % 10 + 1, 300_000 + i, None)),
+        "list_lines_us": await t(lambda i: r.list_lines(limit=26)),
+    }
+
+def bench_repo(args):
+    import asyncio
+    d = os.path.dirname(_tmp_db())
+    from repo import SQLiteRepository, SQLAlchemyRepository
+    # Không có Postgres thì dùng sqlite+aiosqlite làm backend SQLAlchemy thay thế
+    url = args.url or f"sqlite+aiosqlite:///{os.path.join(d, 'sa.db')}"
+    n = min(args.n, 500)
+
+    async def run(r):
+        await r.init()
+        try:
+            line = await _repo_contract(r)
+            return {"contract": "ok", **await _repo_timing(r, line, n)}
+        finally:
+            await r.close()
+
+    return {"n": n,
+            "sqlite": asyncio.run(run(SQLiteRepository())),
+            "sqlalchemy": {"url": url.split("@")[-1], **asyncio.run(run(SQLAlchemyRepository(url)))}}
+
+# ================= loop: event-loop lag while writes are slow =================
+def bench_loop(args):
+    import asyncio
+    _tmp_db()
+    import db_sqlite
+    from loop_lag import LoopLagMonitor
+    db_sqlite.init_db()
+    slow = args.slow_ms / 1000
+
+    def slow_write(i):     # giả lập fsync chậm: giữ thread trong lúc ghi
+        with db_sqlite.transaction():
+            db_sqlite.exec_sql("INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                               (f"bench{i}", "1"))
+            time.sleep(slow)
+
+    async def run(offload):
+        mon = LoopLagMonitor(interval=0.01)
+        task = asyncio.create_task(mon.run())
+        await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+
+        async def handler(i):  # một update: một lần ghi
+            if offload: await db_sqlite.run_db(slow_write, i)
+            else: slow_write(i)
+        await asyncio.gather(*(handler(i) for i in range(args.n)))
+        dt = time.perf_counter() - t0
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return {"seconds": round(dt, 3), **mon.stats()}
+
+    return {"writes": args.n, "slow_ms": args.slow_ms,
+            "blocking": asyncio.run(run(False)), "run_db": asyncio.run(run(True))}
+
+# ================= group: group commit vs commit per write =================
+def bench_group(args):
+    import asyncio
+    _tmp_db()
+    import db_sqlite
+    from write_coalescer import WriteCoalescer
+    # FULL: mỗi COMMIT là một fsync (NORMAL + WAL chỉ fsync khi checkpoint)
+    db_sqlite.PRAGMAS = tuple(p for p in db_sqlite.PRAGMAS if "synchronous" not in p) + (f"PRAGMA synchronous={args.sync};",)
+    db_sqlite.init_db()
+    lid = db_sqlite.insert_and_get_id(
+        "INSERT INTO lines(name,period_days,start_date,legs,contrib,bid_type,bid_value,status,base_rate,cap_rate,thau_rate) "
+        "VALUES('bench',7,'2025-01-01',27,2000000,'dynamic',0,'OPEN',5,10,50)")
+
+    def write(i):
+        return db_sqlite.exec_sql("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,NULL) "
+                                  "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid", (lid, i % 27 + 1, i))
+
+    async def run(submit, conc):
+        n = args.n
+        sem = asyncio.Semaphore(conc)
+        async def one(i):
+            async with sem:
+                await submit(i)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        return round(n / (time.perf_counter() - t0), 1)
+
+    out = {"writes": args.n, "synchronous": args.sync, "window_ms": args.window_ms}
+    for conc in (1, 4, 16, 64):
+        wc = WriteCoalescer(args.window_ms, 64)
+        per_write = asyncio.run(run(lambda i: db_sqlite.run_db(write, i), conc))
+        grouped = asyncio.run(run(lambda i: asyncio.wrap_future(wc.submit(write, i)), conc))
+        out[f"c{conc}"] = {"per_write_wps": per_write, "group_wps": grouped,
+                           "avg_batch": wc.stats()["avg_batch"]}
+    return out
+
+# ================= import: /nhap với n dòng =================
+def bench_import(args):
+    import asyncio
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    import app
+    n = args.n
+    line_id = asyncio.run(app.repo.create_line("bench", 7, "2025-01-06", n, 2_000_000, 5.0, 50.0, 10.0))
+    text = "\n".join(f"{k},{100_000 + k % 900_000},06-01-2025" for k in range(1, n + 1))
+
+    def once():
+        t0 = time.perf_counter()
+        res = asyncio.run(app.import_rounds(line_id, text))
+        assert res["imported"] == n and not res["errors"], res["errors"][:3]
+        return round((time.perf_counter() - t0) * 1000, 1)
+    return {"rows": n, "insert_ms": once(), "update_ms": once()}
+
+# ================= ledger: /congno với nhiều payments =================
+def bench_ledger(args):
+    import asyncio, random
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    import app, db_sqlite, ledger
+    n_lines = 200
+    ids = [asyncio.run(app.repo.create_line(f"l{i}", 7, "2025-01-06", 27, 2_000_000, 5.0, 50.0, 10.0))
+           for i in range(n_lines)]
+    with db_sqlite.transaction() as conn:
+        conn.executemany("INSERT INTO payments(line_id,pay_date,amount) VALUES(?,?,?)",
+                         ((random.choice(ids), f"2025-{random.randint(1, 12):02d}-01", 1_800_000) for _ in range(args.n)))
+    ledger.rebuild()
+    t0 = time.perf_counter()
+    asyncio.run(app.repo.add_payment(ids[0], 1_800_000, "2025-06-01"))
+    add_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    rep = asyncio.run(app.ledger_report())
+    report_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()   # cách tính lại từ lịch sử (không có line_balances)
+    db_sqlite.get_all("SELECT line_id, SUM(amount) FROM payments GROUP BY line_id")
+    sum_ms = (time.perf_counter() - t0) * 1000
+    assert not ledger.rebuild(check_only=True)
+    return {"payments": args.n + 1, "lines": rep["lines"], "add_payment_ms": round(add_ms, 2),
+            "report_ms": round(report_ms, 2), "sum_history_ms": round(sum_ms, 2)}
+
+# ================= export: bộ nhớ khi stream n dòng rounds =================
+def bench_export(args):
+    import tracemalloc
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    import app, db_sqlite
+    legs = 1000
+    with db_sqlite.transaction() as conn:
+        for lid in range(1, args.n // legs + 2):
+            conn.executemany("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,?)",
+                             ((lid, k, 500_000 + k, "2025-01-06") for k in range(1, legs + 1)))
+    client = app.app.test_client()
+
+    def stream(n_lines, gz):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        r = client.get("/export/rounds.csv?to=2099-01-01" + (f"&line_id={n_lines}" if n_lines else ""),
+                       headers={"Accept-Encoding": "gzip"} if gz else {}, buffered=False)
+        size = sum(len(b) for b in r.response)
+        r.close()
+        dt = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"bytes": size, "seconds": round(dt, 3), "peak_kib": round(peak / 1024)}
+    return {"rows": (args.n // legs + 1) * legs,
+            "one_line": stream(1, False), "all_csv": stream(None, False), "all_csv_gzip": stream(None, True)}
+
+# ================= rows: dict vs Line/Bids khi nạp + tính n dây =================
+def bench_rows(args):
+    import tracemalloc, random
+    _tmp_db()
+    import db_sqlite, payout
+    from models import Line, Bids
+    db_sqlite.init_db()
+    N = args.legs
+    with db_sqlite.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO lines(id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+            "base_rate,cap_rate,thau_rate) VALUES(?,?,7,'2025-01-06',?,2000000,'dynamic',0,'OPEN',5,50,10)",
+            ((i, f"D{i}", N) for i in range(1, args.n + 1)))
+        conn.executemany("INSERT INTO rounds(line_id,k,bid) VALUES(?,?,?)",
+                         ((i, k, random.randint(100_000, 900_000)) for i in range(1, args.n + 1)
+                          for k in range(1, N // 2 + 1)))
+    lines = db_sqlite.get_all("SELECT * FROM lines")
+    bids = {}
+    for r in db_sqlite.get_all("SELECT line_id, k, bid FROM rounds"):
+        bids.setdefault(int(r["line_id"]), {})[int(r["k"])] = int(r["bid"])
+
+    def build(compact):
+        if compact:
+            return [(l := Line(r), Bids.from_map(l.legs, bids[l.id])) for r in lines]
+        return [(dict(r), dict(bids[int(r["id"])])) for r in lines]
+
+    def load(compact):
+        t0 = time.perf_counter()
+        out = build(compact)
+        dt = time.perf_counter() - t0
+        tracemalloc.start()                   # đo bộ nhớ ở lần nạp riêng (tracemalloc làm chậm)
+        kept = build(compact)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return out, {"seconds": round(dt, 3), "kib": round(size / 1024)}
+
+    def profit_dict(line, k, b):   # cách cũ của app.compute_profit_var trên dict
+        M, N = int(line["contrib"]), int(line["legs"])
+        D = int(round(M * float(line.get("thau_rate", 0)) / 100.0))
+        po = (k-1)*M + (N - k)*(M - int(b.get(k, 0))) - D
+        paid = sum(M - int(b.get(j, 0)) for j in range(1, k))
+        return po - paid
+
+    def profit_compact(line, k, b):
+        M = line.contrib
+        po = (k-1)*M + (line.legs - k)*(M - b.get(k, 0)) - line.thau_amount
+        return po - sum(M - t for t in b.dense()[1:k])
+
+    def evaluate(rows, profit):
+        t0 = time.perf_counter()
+        for line, b in rows:
+            k, _ = payout.best_k(line, b)
+            profit(line, k, b)
+        return round(time.perf_counter() - t0, 3)
+
+    d_rows, d_load = load(False)
+    c_rows, c_load = load(True)
+    assert all(payout.best_k(a[0], a[1]) == payout.best_k(c[0], c[1]) for a, c in zip(d_rows, c_rows))
+    return {"lines": args.n, "legs": N,
+            "dict": {**d_load, "eval_seconds": evaluate(d_rows, profit_dict)},
+            "compact": {**c_load, "eval_seconds": evaluate(c_rows, profit_compact)}}
+
+# ================= mc: Monte Carlo n đường cho một dây =================
+def bench_mc(args):
+    import montecarlo
+    from models import Line, Bids
+    N = args.legs
+    line = Line({"id": 1, "name": "mc", "period_days": 7, "start_date": "2025-01-06", "legs": N,
+                 "contrib": 2_000_000, "base_rate": 5, "cap_rate": 50, "thau_rate": 10})
+    bids = Bids.from_map(N, {k: 300_000 + 50_000 * (k % 5) for k in range(1, N // 3 + 1)})
+    out = {"paths": args.n, "legs": N, "sampled_k": N - len(bids)}
+    for dist in montecarlo.DISTS:
+        t0 = time.perf_counter()
+        montecarlo.simulate(line, bids, args.n, dist, seed=1)
+        out[f"{dist}_seconds"] = round(time.perf_counter() - t0, 3)
+    return out
+
+# ================= portfolio: /tongquan, GET /report trên --lines dây mở =================
+def bench_portfolio(args):
+    """report() qua line_stats (load_summary) so với kéo mọi rounds (load_open + evaluate); cùng kết quả."""
+    import random
+    _tmp_db()
+    import db_sqlite, line_stats, portfolio
+    db_sqlite.init_db()
+    rnd, N = random.Random(1), args.legs
+    with db_sqlite.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO lines(id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+            "base_rate,cap_rate,thau_rate) VALUES(?,?,7,'2025-01-06',?,?,'dynamic',0,'OPEN',5,50,?)",
+            ((i, f"D{i}", N, rnd.choice((1_000_000, 2_000_000, 5_000_000)), rnd.choice((0, 5, 10)))
+             for i in range(1, args.lines + 1)))
+        conn.executemany("INSERT INTO rounds(line_id,k,bid) VALUES(?,?,?)",
+                         ((i, k, rnd.randint(100_000, 900_000)) for i in range(1, args.lines + 1)
+                          for k in range(1, rnd.randint(0, N) + 1)))
+    line_stats.rebuild()
+    n_rounds = db_sqlite.db().execute("SELECT COUNT(*) FROM rounds").fetchone()[0]
+    out = {"lines": args.lines, "legs": N, "rounds": n_rounds}
+    reps = max(3, min(args.n, 20))
+    for metric in ("roi", "lai"):
+        fast = portfolio.report(metric)
+        full = portfolio.report(metric, rows=portfolio.load_open())
+        assert fast == full, f"{metric}: load_summary lệch so với tính lại từ rounds"
+        for name, fn in (("summary", lambda: portfolio.report(metric)),
+                         ("full", lambda: portfolio.report(metric, rows=portfolio.load_open()))):
+            ts = []
+            for _ in range(reps):
+                t0 = time.perf_counter(); fn(); ts.append(time.perf_counter() - t0)
+            ts.sort()
+            out[f"{metric}_{name}_ms"] = round(ts[len(ts) // 2] * 1000, 1)
+    t0 = time.perf_counter(); portfolio.load_summary("roi"); out["load_summary_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return out
+
+# ================= webhook: Update giả qua /webhook, bot giả (không ra mạng) =================
+WEBHOOK_CMDS = ("tham", "tomtat", "hottot", "danhsach")
+
+def _fake_request():
+    """BaseRequest trả lời sẵn getMe/sendMessage...; đếm số lần gọi theo method."""
+    from collections import Counter
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        calls = Counter()
+
+        async def initialize(self): pass
+        async def shutdown(self): pass
+
+        async def do_request(self, url, method, request_data=None, **kw):
+            api = url.rsplit("/", 1)[-1]
+            self.calls[api] += 1
+            params = request_data.parameters if request_data else {}
+            if api == "getMe":
+                res = {"id": 1, "is_bot": True, "first_name": "HuiBot", "username": "huibench_bot"}
+            elif api in ("sendMessage", "editMessageReplyMarkup"):
+                res = {"message_id": self.calls[api], "date": int(time.time()), "text": params.get("text", ""),
+                       "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}
+            else:
+                res = True
+            return 200, json.dumps({"ok": True, "result": res}).encode()
+    return FakeRequest()
+
+def _update(uid: int, chat: int, text: str) -> dict:
+    cmd = text.split()[0]
+    return {"update_id": uid, "message": {
+        "message_id": uid, "date": int(time.time()), "text": text,
+        "chat": {"id": chat, "type": "private"}, "from": {"id": chat, "is_bot": False, "first_name": "u"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(cmd)}]}}
+
+def _pct(xs, p):
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))] if xs else 0.0
+
+def _app_ready(app) -> bool:
+    return bool(app.app_state.get("application") and app.app_state.get("outbox"))
+
+def bench_webhook(args):
+    """Thông lượng + p50/p95/p99 của POST /webhook (chế độ sync: trả 200 khi xử lý xong)."""
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    os.environ.update(WEBHOOK_MODE="sync", WEBHOOK_SECRET="", REMINDERS_ENABLED="0",
+                      OUTBOX_GLOBAL_RATE=str(args.outbox_rate), OUTBOX_CHAT_RATE=str(args.outbox_rate),
+                      OUTBOX_CHAT_BURST=str(int(args.outbox_rate)))
+    import app, db_sqlite
+    N = args.legs
+    with db_sqlite.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO lines(id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+            "base_rate,cap_rate,thau_rate) VALUES(?,?,7,'2025-01-06',?,2000000,'dynamic',0,'OPEN',5,50,10)",
+            ((i, f"D{i}", N) for i in range(1, args.lines + 1)))
+        conn.executemany("INSERT INTO rounds(line_id,k,bid) VALUES(?,?,?)",
+                         ((i, k, random.randint(100_000, 1_000_000)) for i in range(1, args.lines + 1)
+                          for k in range(1, N // 2 + 1)))
+    req = _fake_request()
+    app.BOT_TOKEN = "123456:bench"
+    app.run_bot_background(request=req)
+    t0 = time.monotonic()
+    while not _app_ready(app):
+        if time.monotonic() - t0 > 10: raise RuntimeError("bot giả không khởi động được")
+        time.sleep(0.01)
+    client = app.app.test_client()
+    rnd = random.Random(1)
+
+    def text(cmd):
+        lid = rnd.randint(1, args.lines)
+        if cmd == "tham": return f"/tham {lid} {rnd.randint(1, N)} {rnd.randint(100, 1000)}k"
+        if cmd == "danhsach": return "/danhsach"
+        if cmd == "hottot": return f"/hottot {lid} {rnd.choice(('roi', 'lai'))}"
+        return f"/tomtat {lid}"
+
+    out = {"n": args.n, "lines": args.lines, "legs": N, "outbox_rate": args.outbox_rate, "runs": []}
+    uid = 0
+    for conc in [int(c) for c in args.concurrency.split(",")]:
+        per_cmd = {}
+        for cmd in WEBHOOK_CMDS + ("mix",):
+            bodies = []
+            for i in range(args.n):
+                uid += 1
+                bodies.append(_update(uid, 1000 + uid % 200, text(rnd.choice(WEBHOOK_CMDS) if cmd == "mix" else cmd)))
+
+            def post(body):
+                t = time.perf_counter()
+                r = client.post("/webhook", json=body)
+                return time.perf_counter() - t, r.status_code
+
+            sent0 = req.calls["sendMessage"]
+            t = time.perf_counter()
+            with ThreadPoolExecutor(conc) as ex:
+                res = list(ex.map(post, bodies))
+            wall = time.perf_counter() - t
+            lat = sorted(x for x, _ in res)
+            per_cmd[cmd] = {"rps": round(len(res) / wall, 1), "p50_ms": round(_pct(lat, 50) * 1e3, 2),
+                            "p95_ms": round(_pct(lat, 95) * 1e3, 2), "p99_ms": round(_pct(lat, 99) * 1e3, 2),
+                            "errors": sum(1 for _, c in res if c != 200),
+                            "replies": req.calls["sendMessage"] - sent0}
+        out["runs"].append({"concurrency": conc, **per_cmd})
+    return out
+
+# ================= hot: microbenchmark các hàm nóng =================
+def bench_hot(args):
+    import asyncio, random
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    import app, db_sqlite
+    from models import Line, Bids
+    N = args.legs
+    line = Line({"id": 1, "name": "hot", "period_days": 7, "start_date": "2025-01-06", "legs": N,
+                 "contrib": 2_000_000, "base_rate": 5, "cap_rate": 50, "thau_rate": 10})
+    bids = Bids.from_map(N, {k: random.randint(100_000, 1_000_000) for k in range(1, N // 2 + 1)})
+    lid = db_sqlite.insert_and_get_id(
+        "INSERT INTO lines(name,period_days,start_date,legs,contrib,bid_type,bid_value,status,base_rate,cap_rate,thau_rate) "
+        "VALUES('hot',7,'2025-01-06',27,2000000,'dynamic',0,'OPEN',5,50,10)")
+    upsert = ("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,NULL) "
+              "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid")
+    sel = "SELECT * FROM lines WHERE id=?"
+    monies = ("2tr", "2.000.000", "1,5tr", "750k", "2000000")
+    dates = ("02-08-2025", "2/8/2025", "02-08-25")
+
+    def loop_us(coro_fn, n):        # n lần await trong một event loop (không tính asyncio.run)
+        async def go():
+            t = time.perf_counter()
+            for i in range(n): await coro_fn(i)
+            return (time.perf_counter() - t) / n * 1e6
+        return asyncio.run(go())
+
+    def txn(i):
+        with db_sqlite.transaction() as conn:
+            conn.execute(upsert, (lid, i % 27 + 1, i))
+
+    n = args.n
+    return {
+        "parse_money_us": _timeit(lambda i: app.parse_money(monies[i % len(monies)]), n),
+        "parse_user_date_us": _timeit(lambda i: app.parse_user_date(dates[i % len(dates)]), n),
+        "best_k_var_us": _timeit(lambda i: app.best_k_var(line, bids), n),
+        "compute_profit_var_us": _timeit(lambda i: app.compute_profit_var(line, i % N + 1, bids), n),
+        "dedup_check_us": _timeit(lambda i: app.dedup.check(10 ** 9 + i), n),
+        "dedup_claim_us": loop_us(lambda i: app.dedup.claim(10 ** 9 + i), n),
+        "db": {
+            "get_all_us": _timeit(lambda i: db_sqlite.get_all(sel, (lid,)), n),
+            "exec_sql_us": _timeit(lambda i: db_sqlite.exec_sql(upsert, (lid, i % 27 + 1, i)), n),
+            "insert_and_get_id_us": _timeit(lambda i: db_sqlite.insert_and_get_id(
+                "INSERT INTO payments(line_id,pay_date,amount) VALUES(?,'2025-01-06',1)", (lid,)), n),
+            "transaction_us": _timeit(txn, n),
+            "cfg_get_us": _timeit(lambda i: db_sqlite.cfg_get("bot_cfg", {}), n),
+            "cfg_set_us": _timeit(lambda i: db_sqlite.cfg_set("bench", {"i": i}), n),
+            "aget_all_us": loop_us(lambda i: db_sqlite.aget_all(sel, (lid,)), n),
+            "aexec_sql_us": loop_us(lambda i: db_sqlite.aexec_sql(upsert, (lid, i % 27 + 1, i)), n),
+        },
+    }
+
+# ================= shards: update song song theo chat + khoá theo dây =================
+def _shard_run(workers: int, n: int, chats: int = 40, slow_ms: float = 50, fast_ms: float = 5):
+    """n update của `chats` chat (chat 0 chậm) qua ShardedRunner → thông lượng, độ trễ, thứ tự."""
+    import asyncio
+    from shards import ShardedRunner
+
+    async def go():
+        seen, lat = {}, []
+
+        async def handler(u):
+            chat, seq, t0 = u
+            await asyncio.sleep((slow_ms if chat == 0 else fast_ms) / 1000)
+            seen.setdefault(chat, []).append(seq)
+            if chat: lat.append(time.perf_counter() - t0)
+
+        r = ShardedRunner(handler, workers, shard_max=n)
+        t = time.perf_counter()
+        futs = [await r.put(i % chats, (i % chats, i, time.perf_counter())) for i in range(n)]
+        await asyncio.gather(*futs)
+        wall = time.perf_counter() - t
+        lat.sort()
+        return {"workers": workers, "ups": round(n / wall, 1),
+                "p95_ms_other_chats": round(_pct(lat, 95) * 1e3, 1),
+                "in_order": all(v == sorted(v) for v in seen.values())}
+    return asyncio.run(go())
+
+def bench_shards(args):
+    """(1) thông lượng khi một chat chậm; (2) /tham đồng thời từ nhiều chat vào một dây: có/không khoá dây."""
+    import contextlib, random
+    from concurrent.futures import ThreadPoolExecutor
+    out = {"runner": [_shard_run(int(w), args.n) for w in args.concurrency.split(",")]}
+
+    _tmp_db()
+    os.environ["BOT_TOKEN"] = os.environ["TELEGRAM_TOKEN"] = ""
+    os.environ.update(WEBHOOK_MODE="sync", WEBHOOK_SECRET="", REMINDERS_ENABLED="0", OUTBOX_GLOBAL_RATE="1e6",
+                      OUTBOX_CHAT_RATE="1e6", OUTBOX_CHAT_BURST="1000000")
+    import app, line_stats
+    req = _fake_request()
+    app.BOT_TOKEN = "123456:bench"
+    app.run_bot_background(request=req)
+    while not _app_ready(app): time.sleep(0.01)
+    client = app.app.test_client()
+    locks = app.line_locks
+
+    class _NoLocks:
+        def __call__(self, key): return contextlib.nullcontext()
+
+    uid = 0
+    races = {}
+    for mode in ("no_line_locks", "line_locks"):
+        app.line_locks = _NoLocks() if mode == "no_line_locks" else locks
+        lid = app.run_sync(app.repo.create_line("race", 7, "2025-01-06", 200, 2_000_000, 5.0, 50.0, 10.0))
+        bodies = []
+        for k in range(1, 201):
+            uid += 1
+            bodies.append(_update(uid, 5000 + k, f"/tham {lid} {k} {random.randint(100, 1000)}k"))
+        with ThreadPoolExecutor(16) as ex:
+            list(ex.map(lambda b: client.post("/webhook", json=b), bodies))
+        db_bids = app.run_sync(app.repo.load_bids(lid))
+        st = line_stats.get(lid)
+        races[mode] = {"bids_saved": len(db_bids), "line_stats_n_bids": st["n_bids"] if st else 0,
+                       "stats_drift": [d for d, _ in line_stats.rebuild(check_only=True)].count(lid)}
+    app.line_locks = locks
+    out["tham_same_line"] = races
+    return out
+
+_STARTUP_CHILD = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, os.getcwd())
+import app
+t_import = time.perf_counter() - t0
+assert app.app.test_client().get("/health").status_code == 200
+t_health = time.perf_counter() - t0
+heavy = sorted(m for m in ("numpy", "telegram", "montecarlo", "httpx") if m in sys.modules)
+t = time.perf_counter()            # gồm cả import telegram (bot giả import trước build_app)
+import bench
+app.BOT_TOKEN = "123456:bench"
+app.run_bot_background(request=bench._fake_request())
+assert app.bot_ready.wait(30)
+t_bot = time.perf_counter() - t
+t = time.perf_counter()
+r = app.app.test_client().post("/webhook", json=bench._update(1, 1, "/start"))
+print(json.dumps({"import_s": t_import, "health_s": t_health, "bot_wait_s": t_bot,
+                  "first_webhook_s": time.perf_counter() - t, "webhook_status": r.status_code,
+                  "startup": app.STARTUP, "heavy_at_import": heavy}))
+"""
+
+def bench_startup(args):
+    """Khởi động lạnh trong tiến trình mới: import app, DB init, /health đầu tiên, dựng bot, /webhook đầu tiên.
+
+    cold = file DB mới (chạy migration), warm = file đã đúng phiên bản schema. BOT_INIT=webhook
+    để bot (request giả) được dựng sau /health, như khi Cloud Run gửi update đầu tiên;
+    bot_wait_s tính từ lúc bắt đầu dựng bot tới bot_ready, kể cả import telegram.
+    """
+    import statistics, subprocess, tempfile
+    env = {**os.environ, "BOT_TOKEN": "", "TELEGRAM_TOKEN": "", "DATABASE_URL": "", "BOT_INIT": "webhook",
+           "WEBHOOK_MODE": "sync", "WEBHOOK_SECRET": "", "REMINDERS_ENABLED": "0"}
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def child(db_path):
+        t = time.perf_counter()
+        p = subprocess.run([sys.executable, "-c", _STARTUP_CHILD], cwd=here, capture_output=True, text=True,
+                           env={**env, "DB_PATH": db_path})
+        if p.returncode: raise RuntimeError(p.stderr[-2000:])
+        r = json.loads(p.stdout.strip().splitlines()[-1])
+        r["process_s"] = time.perf_counter() - t
+        return r
+
+    def summary(runs):
+        keys = ("process_s", "import_s", "health_s", "bot_wait_s", "first_webhook_s")
+        out = {k: round(statistics.median(r[k] for r in runs), 4) for k in keys}
+        out["db_init_s"] = round(statistics.median(r["startup"]["db_init_s"] for r in runs), 4)
+        out["bot_init_s"] = round(statistics.median(r["startup"]["bot_init_s"] for r in runs), 4)
+        out["heavy_at_import"] = runs[-1]["heavy_at_import"]
+        out["webhook_status"] = runs[-1]["webhook_status"]
+        return out
+
+    reps = max(1, min(args.n, 5))
+    d = tempfile.mkdtemp(prefix="huibench-start-")
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    out = {"runs": reps, "python_s": round(time.perf_counter() - t, 4)}
+    cold = [child(os.path.join(d, f"cold{i}.db")) for i in range(reps)]
+    warm = [child(os.path.join(d, "cold0.db")) for _ in range(reps)]
+    out["cold"], out["warm"] = summary(cold), summary(warm)
+    return out
+
+SECTIONS = {"db": bench_db, "payout": bench_payout, "repo": bench_repo, "loop": bench_loop,
+            "group": bench_group, "import": bench_import, "ledger": bench_ledger, "export": bench_export,
+            "rows": bench_rows, "mc": bench_mc, "portfolio": bench_portfolio, "webhook": bench_webhook, "hot": bench_hot,
+            "shards": bench_shards, "startup": bench_startup}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="HuiBot micro-benchmarks")
+    ap.add_argument("section", choices=sorted(SECTIONS))
+    ap.add_argument("--n", type=int, default=5000, help="số vòng lặp")
+    ap.add_argument("--legs", type=int, default=27, help="số chân của dây mẫu")
+    ap.add_argument("--slow-ms", type=float, default=50, help="loop: thời gian giữ mỗi lần ghi (ms)")
+    ap.add_argument("--sync", default="FULL", choices=("NORMAL", "FULL"), help="group: PRAGMA synchronous")
+    ap.add_argument("--window-ms", type=float, default=0.5, help="group: cửa sổ gom ghi (ms)")
+    ap.add_argument("--url", default="", help="repo: DATABASE_URL cho backend SQLAlchemy (trống = sqlite+aiosqlite tạm)")
+    ap.add_argument("--concurrency", default="1,8,32", help="webhook: các mức đồng thời, phân tách bởi dấu phẩy")
+    ap.add_argument("--lines", type=int, default=1000, help="webhook: số dây trong DB")
+    ap.add_argument("--outbox-rate", type=float, default=1e6,
+                    help="webhook: giới hạn outbox (tin/s); mặc định gần như bỏ giới hạn để đo máy chủ")
+    ap.add_argument("--out", default="", help="ghi kết quả JSON ra file")
+    args = ap.parse_args(argv)
+    res = SECTIONS[args.section](args)
+    text = json.dumps(res, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    sys.exit(main())
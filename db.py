@@ -1,14 +1,23 @@
 import os
-import asyncio
 from typing import Optional
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, Date, ForeignKey, Boolean, Numeric, Text
-from datetime import date
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import String, Integer, BigInteger, Float, Date, ForeignKey, Boolean, Text, Index
+from sqlalchemy import event, func, insert, inspect, select, text
+from datetime import date, datetime
+from time import perf_counter
+
+from metrics import DB_SECONDS, sql_label
 
 _engine = None
 _async_session: Optional[async_sessionmaker[AsyncSession]] = None
 
+# Pool per instance; Cloud Run runs up to 3 instances → ≤ 3 * (size + overflow) connections
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
 class Base(DeclarativeBase):
     pass
 
@@ -46,23 +55,197 @@ class Reminder(Base):
     chat_id: Mapped[str] = mapped_column(String(32), index=True)
     time_hhmm: Mapped[str] = mapped_column(String(5))  # '07:45'
 
-async def init_engine():
+# ---- Schema used by app.py (mirrors db_sqlite.init_db) ----
+class Line(Base):
+    __tablename__ = "lines"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    period_days: Mapped[int] = mapped_column(Integer)
+    start_date: Mapped[str] = mapped_column(String(10))           # YYYY-MM-DD
+    legs: Mapped[int] = mapped_column(Integer)
+    contrib: Mapped[int] = mapped_column(BigInteger)
+    bid_type: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    bid_value: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    status: Mapped[str] = mapped_column(String(10), default="OPEN", index=True)   # idx_lines_status
+    base_rate: Mapped[float] = mapped_column(Float, default=0)
+    cap_rate: Mapped[float] = mapped_column(Float, default=100)
+    thau_rate: Mapped[float] = mapped_column(Float, default=0)
+    remind_hour: Mapped[int] = mapped_column(Integer, default=8)
+    remind_min: Mapped[int] = mapped_column(Integer, default=0)
+    last_remind_iso: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)
+
+class Round(Base):
+    __tablename__ = "rounds"
+    line_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    k: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bid: Mapped[int] = mapped_column(BigInteger)
+    round_date: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)
+
+class Payment(Base):
+    __tablename__ = "payments"
+    __table_args__ = (Index("idx_payments_line_date", "line_id", "pay_date"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    line_id: Mapped[int] = mapped_column(Integer)
+    pay_date: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)
+    amount: Mapped[int] = mapped_column(BigInteger)
+
+class LineBalance(Base):
+    __tablename__ = "line_balances"
+    line_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    paid_total: Mapped[int] = mapped_column(BigInteger, default=0)
+    n_payments: Mapped[int] = mapped_column(Integer, default=0)
+    last_pay_date: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)
+    updated_at: Mapped[Optional[str]] = mapped_column(String(19), nullable=True)
+
+class SeenUpdate(Base):
+    __tablename__ = "seen_updates"
+    update_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    seen_at: Mapped[int] = mapped_column(BigInteger)
+    done: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+
+class ConfigEntry(Base):
+    __tablename__ = "config"
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)
+    value: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+class LineStat(Base):
+    __tablename__ = "line_stats"
+    line_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    n_bids: Mapped[int] = mapped_column(Integer)
+    bid_sum: Mapped[int] = mapped_column(BigInteger)
+    paid_cum: Mapped[int] = mapped_column(BigInteger)
+    k_now: Mapped[int] = mapped_column(Integer)
+    best_k_roi: Mapped[int] = mapped_column(Integer)
+    best_k_profit: Mapped[int] = mapped_column(Integer)
+    updated_at: Mapped[Optional[str]] = mapped_column(String(19), nullable=True)
+
+def normalize_url(db_url: str) -> str:
+    # Heroku/Cloud SQL style URLs → async driver
+    if db_url.startswith("postgres://"):
+        db_url = "postgresql://" + db_url[len("postgres://"):]
+    if db_url.startswith("postgresql://"):
+        db_url = "postgresql+asyncpg://" + db_url[len("postgresql://"):]
+    return db_url
+
+async def init_engine(db_url: Optional[str] = None):
     global _engine, _async_session
     if _engine:
         return
-    db_url = os.environ.get("DATABASE_URL")
+    db_url = db_url or os.environ.get("DATABASE_URL")
     if not db_url:
         raise RuntimeError("DATABASE_URL is required")
-    _engine = create_async_engine(db_url, echo=False, pool_pre_ping=True)
+    db_url = normalize_url(db_url)
+    kwargs = {"echo": False, "pool_pre_ping": True}
+    if not db_url.startswith("sqlite"):
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                      pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE)
+    _engine = create_async_engine(db_url, **kwargs)
+    _instrument(_engine.sync_engine)
     _async_session = async_sessionmaker(_engine, expire_on_commit=False)
 
+def _instrument(engine):
+    """Thời gian mỗi câu lệnh vào cùng histogram với db_sqlite.TimedConnection (nhãn động từ:bảng)."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("t0", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        DB_SECONDS.observe(perf_counter() - conn.info["t0"].pop(), sql_label(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(ctx):
+        t0 = ctx.connection is not None and ctx.connection.info.get("t0")
+        if t0:
+            DB_SECONDS.observe(perf_counter() - t0.pop(), sql_label(ctx.statement or ""))
+
+async def get_engine():
+    if _engine is None:
+        await init_engine()
+    return _engine
+
+async def dispose_engine():
+    global _engine, _async_session
+    if _engine is not None:
+        await _engine.dispose()
+    _engine, _async_session = None, None
+
 async def get_session() -> AsyncSession:
-    global _async_session
     if _async_session is None:
         await init_engine()
     return _async_session()
 
-async def run_migrations():
-    # very light migration: create tables if not exist
-    async with _engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    applied_at: Mapped[Optional[str]] = mapped_column(String(19), nullable=True)
+
+# ---- Versioned schema (same numbering as db_sqlite.MIGRATIONS) ----
+# (version, steps); each step is sync and runs on the migration's connection.
+# Append new versions; never edit an applied one. Steps check first, so
+# databases created by the old create_all() are adopted without errors.
+def _create(*models):
+    return lambda c: Base.metadata.create_all(c, tables=[m.__table__ for m in models])
+
+def _indexes(c):
+    for model in (Line, Payment):
+        for ix in model.__table__.indexes:
+            ix.create(c, checkfirst=True)
+
+def _backfill_balances(c):
+    c.execute(text(
+        "INSERT INTO line_balances(line_id,paid_total,n_payments,last_pay_date) "
+        "SELECT line_id, SUM(amount), COUNT(*), MAX(pay_date) FROM payments "
+        "WHERE line_id NOT IN (SELECT line_id FROM line_balances) GROUP BY line_id"))
+
+def _seen_updates_done(c):
+    # bảng tạo bằng create_all() trước khi có cột done; id cũ coi như đã xong
+    if "done" not in {col["name"] for col in inspect(c).get_columns("seen_updates")}:
+        c.execute(text("ALTER TABLE seen_updates ADD COLUMN done INTEGER NOT NULL DEFAULT 1"))
+
+MIGRATIONS = (
+    (1, (_create(Line, Round, Payment, ConfigEntry, LineStat),)),
+    (2, (_indexes,)),
+    (3, (_create(LineBalance), _backfill_balances)),
+    (4, (_create(SeenUpdate),)),
+    (5, (_seen_updates_done,)),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK = 0x4875_6942          # pg_advisory_xact_lock: instances starting together migrate in turn
+
+def stored_version(c) -> int:
+    """Version recorded in the database (0 when schema_version does not exist yet)."""
+    if not inspect(c).has_table(SchemaVersion.__tablename__):
+        return 0
+    return c.execute(select(func.coalesce(func.max(SchemaVersion.version), 0))).scalar()
+
+def _apply(c, version, steps):
+    if c.dialect.name == "postgresql":
+        c.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": MIGRATION_LOCK})
+    SchemaVersion.__table__.create(c, checkfirst=True)
+    if stored_version(c) >= version:
+        return
+    for step in steps:
+        step(c)
+    c.execute(insert(SchemaVersion).values(version=version, applied_at=datetime.now().isoformat(timespec="seconds")))
+
+async def run_migrations(target: int = SCHEMA_VERSION) -> int:
+    """Apply pending migrations, one transaction each → version reached.
+
+    Raises RuntimeError when the database is newer than this code (an old
+    revision started after a newer one migrated) or did not reach `target`.
+    """
+    engine = await get_engine()
+    async with engine.connect() as conn:
+        current = await conn.run_sync(stored_version)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"schema_version {current} is newer than this code ({SCHEMA_VERSION}); deploy the newer revision")
+    for version, steps in MIGRATIONS:
+        if current < version <= target:
+            async with engine.begin() as conn:
+                await conn.run_sync(_apply, version, steps)
+    async with engine.connect() as conn:
+        current = await conn.run_sync(stored_version)
+    if current != target:
+        raise RuntimeError(f"schema_version {current}, expected {target}")
+    return current
@@ -1,93 +1,280 @@
-import os, sqlite3, json
+import os, sqlite3, json, threading, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+
+from metrics import DB_SECONDS, sql_label
+from queries import CONFIG_GET, CONFIG_SET, HOT_QUERIES
 
 DB_PATH = os.environ.get("DB_PATH", "db/hui.db")
 
-def db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
+# Tuned once per connection (not per query). WAL + synchronous=NORMAL is durable
+# across app crashes; only an OS crash can lose the last transactions.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA cache_size=-16000;",      # ~16 MiB page cache
+    "PRAGMA mmap_size=134217728;",    # 128 MiB
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA foreign_keys=ON;",
+)
+STMT_CACHE_SIZE = int(os.environ.get("DB_STMT_CACHE", "256"))
+# Threads running DB calls for the event loop; each keeps its own connection.
+DB_THREADS = int(os.environ.get("DB_THREADS", "4"))
+
+_local = threading.local()
+_dir_ready = False
+
+class TimedConnection(sqlite3.Connection):
+    """execute/executemany ghi thời gian vào metrics (nhãn động từ:bảng); fetch sau đó không tính."""
+
+    def execute(self, sql, params=()):
+        t = perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            DB_SECONDS.observe(perf_counter() - t, sql_label(sql))
+
+    def executemany(self, sql, seq):
+        t = perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            DB_SECONDS.observe(perf_counter() - t, sql_label(sql))
+
+def _connect():
+    global _dir_ready
+    if not _dir_ready:
+        d = os.path.dirname(DB_PATH)
+        if d: os.makedirs(d, exist_ok=True)
+        _dir_ready = True
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, factory=TimedConnection,
+                           cached_statements=STMT_CACHE_SIZE, isolation_level=None)
+    for p in PRAGMAS:
+        conn.execute(p)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
+def db():
+    """Long-lived connection of the calling thread (opened on first use).
+
+    Connections run in autocommit mode; multi-statement writes go through
+    `transaction()`. Prepared statements are cached per connection by sqlite3.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+def close_db():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+_executor = None
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+    return _executor
+
+async def run_db(fn, *args):
+    """Run a blocking DB function on the DB thread pool and await its result.
+
+    Everything `fn` does (including a whole `transaction()`) stays on one
+    pool thread and its connection, so the event loop never waits on SQLite.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor(), fn, *args)
+
+async def aget_all(q, params=()):
+    return await run_db(get_all, q, params)
+
+async def aexec_sql(q, params=()):
+    return await run_db(exec_sql, q, params)
+
+@contextmanager
+def transaction(immediate=True):
+    """BEGIN ... COMMIT on the thread connection; ROLLBACK on error. Re-entrant."""
     conn = db()
-    cur = conn.cursor()
-    cur.execute("""    CREATE TABLE IF NOT EXISTS lines(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        period_days INTEGER,
-        start_date TEXT,
-        legs INTEGER,
-        contrib INTEGER,
-        bid_type TEXT,
-        bid_value INTEGER,
-        status TEXT,
-        base_rate REAL,
-        cap_rate REAL,
-        thau_rate REAL,
-        remind_hour INTEGER DEFAULT 8,
-        remind_min  INTEGER DEFAULT 0,
-        last_remind_iso TEXT
-    );""")
-    cur.execute("""    CREATE TABLE IF NOT EXISTS rounds(
-        line_id INTEGER,
-        k INTEGER,
-        bid INTEGER,
-        round_date TEXT,
-        PRIMARY KEY(line_id, k)
-    );""")
-    cur.execute("""    CREATE TABLE IF NOT EXISTS payments(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        line_id INTEGER,
-        pay_date TEXT,
-        amount INTEGER
-    );""")
-    cur.execute("""    CREATE TABLE IF NOT EXISTS config(
-        key TEXT PRIMARY KEY,
-        value TEXT
-    );""")
-    conn.commit()
-    conn.close()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
 
-def ensure_schema():
+# Versioned schema: (version, statements). Append new versions; never edit
+# an applied one. Version 1 is the original schema (IF NOT EXISTS, so it also
+# adopts databases created before schema_version existed).
+MIGRATIONS = (
+    (1, (
+        """CREATE TABLE IF NOT EXISTS lines(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            period_days INTEGER,
+            start_date TEXT,
+            legs INTEGER,
+            contrib INTEGER,
+            bid_type TEXT,
+            bid_value INTEGER,
+            status TEXT,
+            base_rate REAL,
+            cap_rate REAL,
+            thau_rate REAL,
+            remind_hour INTEGER DEFAULT 8,
+            remind_min  INTEGER DEFAULT 0,
+            last_remind_iso TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS rounds(
+            line_id INTEGER,
+            k INTEGER,
+            bid INTEGER,
+            round_date TEXT,
+            PRIMARY KEY(line_id, k)
+        )""",
+        """CREATE TABLE IF NOT EXISTS payments(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            line_id INTEGER,
+            pay_date TEXT,
+            amount INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS config(
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS line_stats(
+            line_id INTEGER PRIMARY KEY,
+            n_bids INTEGER,
+            bid_sum INTEGER,
+            paid_cum INTEGER,
+            k_now INTEGER,
+            best_k_roi INTEGER,
+            best_k_profit INTEGER,
+            updated_at TEXT
+        )""",
+    )),
+    (2, (
+        # /danhsach mở|đóng, reminders.load_all, portfolio.load_open
+        "CREATE INDEX IF NOT EXISTS idx_lines_status ON lines(status)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_line_date ON payments(line_id, pay_date)",
+    )),
+    (3, (
+        # ledger.py: tổng đã đóng mỗi dây, cộng dồn khi ghi payments
+        """CREATE TABLE IF NOT EXISTS line_balances(
+            line_id INTEGER PRIMARY KEY,
+            paid_total INTEGER NOT NULL DEFAULT 0,
+            n_payments INTEGER NOT NULL DEFAULT 0,
+            last_pay_date TEXT,
+            updated_at TEXT
+        )""",
+        "INSERT OR IGNORE INTO line_balances(line_id,paid_total,n_payments,last_pay_date,updated_at) "
+        "SELECT line_id, SUM(amount), COUNT(*), MAX(pay_date), datetime('now') FROM payments GROUP BY line_id",
+    )),
+    (4, (
+        # dedup.py: update_id đã nhận (Telegram gửi lại khi /webhook chậm); chỉ giữ các id mới nhất
+        """CREATE TABLE IF NOT EXISTS seen_updates(
+            update_id INTEGER PRIMARY KEY,
+            seen_at INTEGER NOT NULL
+        )""",
+    )),
+    (5, (
+        # dedup.py: done=0 khi đang xử lý (seen_at = lúc nhận), 1 khi xong; id cũ coi như đã xong
+        "ALTER TABLE seen_updates ADD COLUMN done INTEGER NOT NULL DEFAULT 1",
+    )),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn=None) -> int:
+    conn = conn or db()
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, applied_at TEXT)")
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(target: int = SCHEMA_VERSION):
+    """Apply pending migrations, one transaction each → version reached.
+
+    The version is re-read under BEGIN IMMEDIATE, so instances starting
+    together on the same file apply each migration once.
+    """
+    from datetime import datetime
+    for version, stmts in MIGRATIONS:
+        if version > target:
+            break
+        with transaction() as conn:
+            if schema_version(conn) >= version:
+                continue
+            for q in stmts:
+                conn.execute(q)
+            conn.execute("INSERT INTO schema_version(version, applied_at) VALUES(?,?)",
+                         (version, datetime.now().isoformat(timespec="seconds")))
+    return schema_version()
+
+def stored_version(conn=None) -> int:
+    """Version recorded in the file, read-only (0 when schema_version does not exist yet)."""
+    try:
+        return (conn or db()).execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0
+
+def init_db() -> bool:
+    """Cold start: one SELECT when the file is already current, migrate() otherwise → True if migrated."""
+    if stored_version() == SCHEMA_VERSION:
+        return False
+    migrate()
     return True
 
+def ensure_schema():
+    return stored_version() == SCHEMA_VERSION
+
+def full_scans(queries=None):
+    """EXPLAIN QUERY PLAN of each hot query (queries.HOT_QUERIES) → {name: [SCAN steps]} for those that scan a table."""
+    out = {}
+    for name, (q, params) in (queries or HOT_QUERIES).items():
+        plan = db().execute("EXPLAIN QUERY PLAN " + q, params).fetchall()
+        scans = [r["detail"] for r in plan if r["detail"].startswith("SCAN ")]
+        if scans:
+            out[name] = scans
+    return out
+
 def cfg_get(key, default=None):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM config WHERE key=?", (key,))
-    row = cur.fetchone()
-    conn.close()
+    row = db().execute(CONFIG_GET, (key,)).fetchone()
     if not row: return default
     try:
-        import json
         return json.loads(row["value"])
     except Exception:
         return default
 
 def cfg_set(key, value):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-                (key, json.dumps(value)))
-    conn.commit(); conn.close()
+    db().execute(CONFIG_SET, (key, json.dumps(value)))
 
 def get_all(q, params=()):
-    conn = db(); cur = conn.cursor()
-    cur.execute(q, params)
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+    return [dict(r) for r in db().execute(q, params).fetchall()]
 
 def exec_sql(q, params=()):
-    conn = db(); cur = conn.cursor()
-    cur.execute(q, params)
-    conn.commit(); conn.close()
+    return db().execute(q, params).rowcount
 
 def insert_and_get_id(q, params=()):
-    conn = db(); cur = conn.cursor()
-    cur.execute(q, params)
-    conn.commit()
-    new_id = cur.lastrowid
-    conn.close()
-    return new_id
+    return db().execute(q, params).lastrowid
+
+if __name__ == "__main__":
+    # python db_sqlite.py           → migrate DB_PATH, print version
+    # python db_sqlite.py --plans   → also fail (exit 1) if a hot query scans a table
+    import sys
+    before = stored_version()
+    print(f"schema_version {migrate()} (latest {SCHEMA_VERSION})")
+    if stored_version() != before:        # lần khởi động sau không migrate nữa: dựng line_stats ngay
+        import line_stats
+        line_stats.rebuild()
+    if "--plans" in sys.argv[1:]:
+        bad = full_scans()
+        for name, scans in bad.items():
+            print(f"{name}: {'; '.join(scans)}")
+        print(f"{len(HOT_QUERIES) - len(bad)}/{len(HOT_QUERIES)} hot queries use an index")
+        sys.exit(1 if bad else 0)
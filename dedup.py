@@ -0,0 +1,96 @@
+"""Bỏ qua update Telegram gửi lại (webhook trả chậm → Telegram gửi lần nữa), theo update_id.
+
+Hai tầng, đều chạy trước process_update:
+- cửa sổ trong bộ nhớ (`window` id gần nhất): set + deque, kiểm tra ngay trong thread
+  webhook, trước cả Update.de_json;
+- bảng seen_updates (repo.claim_update): chung cho mọi instance. claim() giữ update_id
+  (đang xử lý, hạn `lease` giây); done() đánh dấu xong sau khi PTB xử lý xong; release()
+  nhả ra khi xử lý lỗi, để lần Telegram gửi lại được xử lý. Instance chết giữa chừng thì
+  hết hạn giữ là instance khác nhận lại được. Cứ `prune_every` lần ghi nhận thì xoá id cũ,
+  chỉ giữ `keep` id mới nhất (update_id tăng dần).
+Lỗi DB khi ghi nhận thì vẫn xử lý update (thà trùng còn hơn mất lệnh).
+"""
+import logging, threading
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger("huibot.dedup")
+
+class UpdateDedup:
+    def __init__(self, repo=None, window: int = 10_000, keep: int = 100_000, prune_every: int = 1000,
+                 lease: int = 120):
+        self.repo = repo
+        self.window, self.keep, self.prune_every, self.lease = window, keep, max(1, prune_every), lease
+        self._ids = set()
+        self._order = deque()
+        self._lock = threading.Lock()
+        self._claims = self._max_id = 0
+        self.seen = self.dup_memory = self.dup_db = self.busy = self.released = self.db_errors = 0
+
+    def check(self, update_id: int) -> bool:
+        """True (và ghi nhận) nếu update_id chưa có trong cửa sổ bộ nhớ."""
+        with self._lock:
+            if update_id in self._ids:
+                self.dup_memory += 1
+                return False
+            self._ids.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self.window:
+                self._ids.discard(self._order.popleft())
+            self.seen += 1
+        return True
+
+    def forget(self, update_id: int):
+        """Update bị từ chối (503, hàng đợi đầy, xử lý lỗi): để lần Telegram gửi lại được xử lý."""
+        with self._lock:
+            self._ids.discard(update_id)
+
+    async def claim(self, update_id: int) -> Optional[bool]:
+        """Giữ update_id trong bảng seen_updates → True: xử lý đi; False: đã xử lý xong;
+        None: instance khác đang xử lý (chưa hết hạn giữ)."""
+        if self.repo is None:
+            return True
+        try:
+            got = await self.repo.claim_update(update_id, self.lease)
+            if not got:
+                if got is None: self.busy += 1
+                else: self.dup_db += 1
+                return got
+        except Exception:
+            self.db_errors += 1
+            logger.exception("claim_update %s failed; processing anyway", update_id)
+            return True
+        self._claims += 1
+        if update_id > self._max_id: self._max_id = update_id
+        if self._claims % self.prune_every == 0 and self._max_id > self.keep:
+            try:
+                await self.repo.prune_updates(self._max_id - self.keep)
+            except Exception:
+                logger.exception("prune_updates failed")
+        return True
+
+    async def done(self, update_id: int):
+        """Xử lý xong: lần gửi lại sau này (kể cả sau hạn giữ) bị bỏ qua."""
+        if self.repo is None:
+            return
+        try:
+            await self.repo.finish_update(update_id)
+        except Exception:
+            self.db_errors += 1
+            logger.exception("finish_update %s failed", update_id)
+
+    async def release(self, update_id: int):
+        """Xử lý lỗi: nhả update_id (bộ nhớ và seen_updates) để lần Telegram gửi lại được xử lý."""
+        self.forget(update_id)
+        self.released += 1
+        if self.repo is None:
+            return
+        try:
+            await self.repo.release_update(update_id)
+        except Exception:
+            self.db_errors += 1
+            logger.exception("release_update %s failed", update_id)
+
+    def stats(self) -> dict:
+        return {"window": self.window, "size": len(self._ids), "seen": self.seen, "dup_memory": self.dup_memory,
+                "dup_db": self.dup_db, "busy": self.busy, "released": self.released, "db_errors": self.db_errors}
@@ -0,0 +1,36 @@
+"""Xuất dữ liệu dạng luồng: khối dòng (repo.export_chunks) → CSV/JSONL → gzip (tuỳ chọn).
+
+Mỗi bước là generator, chỉ giữ một khối dòng trong bộ nhớ, nên bảng lớn đến đâu
+bộ nhớ cũng không tăng.
+"""
+import csv, io, json, zlib
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+def encode(chunks, cols, fmt: str):
+    """Khối dòng (list tuple) → các đoạn str CSV (có dòng tiêu đề) hoặc JSONL."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        w = csv.writer(buf, lineterminator="\n")
+        w.writerow(cols)
+        for rows in chunks:
+            w.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+        if buf.tell(): yield buf.getvalue()      # không có dòng nào: chỉ tiêu đề
+    else:
+        dumps = json.dumps
+        for rows in chunks:
+            yield "".join(dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in rows)
+
+def gzip_stream(parts, level: int = 6):
+    """Nén gzip từng đoạn (str) khi đi qua."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)   # wbits 31 = header gzip
+    for p in parts:
+        out = z.compress(p.encode("utf-8"))
+        if out: yield out
+    yield z.flush()
+
+def utf8(parts):
+    for p in parts:
+        if p: yield p.encode("utf-8")
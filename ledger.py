@@ -0,0 +1,94 @@
+"""Sổ đóng tiền: payments + line_balances (tổng đã đóng mỗi dây, cộng dồn khi ghi).
+
+    python ledger.py           # dựng lại line_balances từ payments, in các dây bị lệch
+    python ledger.py --check   # chỉ kiểm tra, không ghi
+
+"Phải đóng" tới hôm nay = Σ (M - thăm_j) cho các kỳ j đã tới ngày (kỳ chưa có thăm tính M),
+cùng cách tính "Đã đóng" của /tomtat. Nợ = phải đóng - thực đóng (nếu dương).
+"""
+import sys
+from datetime import date, datetime
+
+import queries
+from db_sqlite import get_all, transaction
+
+BAL_FIELDS = ("paid_total", "n_payments", "last_pay_date")
+
+def k_due(line, today: date) -> int:
+    """Số kỳ đã tới ngày (ngày kỳ ≤ today)."""
+    start = datetime.strptime(str(line["start_date"]), "%Y-%m-%d").date()
+    if today < start:
+        return 0
+    return min(int(line["legs"]), (today - start).days // int(line["period_days"]) + 1)
+
+def expected_due(line, bids: dict, today: date) -> int:
+    M = int(line["contrib"])
+    return sum(M - int(bids.get(j, 0)) for j in range(1, k_due(line, today) + 1))
+
+def line_report(line, bids: dict, bal, today: date) -> dict:
+    exp = expected_due(line, bids, today)
+    paid = int(bal["paid_total"]) if bal else 0
+    return {"line_id": int(line["id"]), "name": line.get("name"), "k_due": k_due(line, today),
+            "expected": exp, "paid": paid, "balance": paid - exp, "arrears": max(0, exp - paid),
+            "n_payments": int(bal["n_payments"]) if bal else 0,
+            "last_pay_date": bal["last_pay_date"] if bal else None}
+
+def report(lines, bids_by_line: dict, balances: dict, today: date, per_line=True) -> dict:
+    rows = [line_report(l, bids_by_line.get(int(l["id"]), {}), balances.get(int(l["id"])), today) for l in lines]
+    out = {"date": today.isoformat(), "lines": len(rows),
+           "expected": sum(r["expected"] for r in rows), "paid": sum(r["paid"] for r in rows),
+           "arrears": sum(r["arrears"] for r in rows),
+           "lines_in_arrears": sum(1 for r in rows if r["arrears"] > 0)}
+    out["balance"] = out["paid"] - out["expected"]
+    if per_line:
+        out["per_line"] = rows
+    return out
+
+# ---------- SQLite ----------
+def add_payment(line_id: int, amount: int, pay_date: str):
+    """Ghi một lần đóng + cộng vào line_balances (cùng transaction) → (paid_total, n_payments)."""
+    with transaction() as conn:
+        conn.execute(queries.PAYMENT_INSERT, (line_id, pay_date, amount))
+        conn.execute(queries.BALANCE_ADD, (line_id, amount, pay_date, datetime.now().isoformat(timespec="seconds")))
+        row = conn.execute(queries.BALANCE_OF_LINE, (line_id,)).fetchone()
+    return int(row[0]), int(row[1])
+
+def balances(line_ids=None) -> dict:
+    if line_ids is None:
+        rows = get_all(queries.ALL_BALANCES)
+    else:
+        ids = [int(i) for i in line_ids]
+        if not ids: return {}
+        rows = get_all(queries.balances_in(len(ids)), ids)
+    return {int(r["line_id"]): r for r in rows}
+
+def rebuild(check_only: bool = False):
+    """So line_balances với tổng từ payments; sửa (nếu không check_only). → [(line_id, {field: (stored, fresh)})]"""
+    fresh = {int(r["line_id"]): r for r in get_all(
+        "SELECT line_id, SUM(amount) AS paid_total, COUNT(*) AS n_payments, MAX(pay_date) AS last_pay_date "
+        "FROM payments GROUP BY line_id")}
+    stored = balances()
+    drift = []
+    with transaction() as conn:
+        for lid in sorted(set(fresh) | set(stored)):
+            f, s = fresh.get(lid), stored.get(lid)
+            diff = {k: (s[k] if s else None, f[k] if f else None)
+                    for k in BAL_FIELDS if not s or not f or s[k] != f[k]}
+            if not diff: continue
+            drift.append((lid, diff))
+            if check_only: continue
+            if f is None:
+                conn.execute("DELETE FROM line_balances WHERE line_id=?", (lid,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO line_balances(line_id,paid_total,n_payments,last_pay_date,updated_at) "
+                    "VALUES(?,?,?,?,?)", (lid, *(f[k] for k in BAL_FIELDS), datetime.now().isoformat(timespec="seconds")))
+    return drift
+
+if __name__ == "__main__":
+    check = "--check" in sys.argv[1:]
+    drift = rebuild(check_only=check)
+    for lid, diff in drift:
+        print(f"line {lid}: " + ", ".join(f"{f} {a} -> {b}" for f, (a, b) in diff.items()))
+    print(f"{len(drift)} line(s) {'drifted' if check else 'rebuilt'}")
+    sys.exit(1 if check and drift else 0)
@@ -0,0 +1,134 @@
+import itertools, threading
+from collections import OrderedDict
+
+class LineCache:
+    """Bounded LRU of lines (models.Line) and their bids (models.Bids), keyed by line_id.
+
+    Write paths (/tham, /hen, /dong, ...) update entries in place
+    (write-through) or drop them; every change bumps the entry's version.
+    Versions come from one global counter, so a (line_id, version) pair is
+    never reused, even after eviction and reload.
+
+    A miss is filled with begin_fill() → load from the DB → store(token): a
+    write to the line while the load is in flight drops its token, so rows
+    read before that write are returned but never cached over newer data.
+
+    maxsize=0 disables caching: every get is a miss and store() only hands
+    out a fresh version (shared DB, where other instances write too).
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # line_id -> [line, bids, version]
+        self._fills = {}                # line_id -> token of the load in flight
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.hits = self.misses = self.evictions = 0
+
+    def lookup(self, line_id: int):
+        """(line, bids, version) when cached, else None (counted as a miss)."""
+        with self._lock:
+            e = self._entries.get(line_id)
+            if e is not None:
+                self._entries.move_to_end(line_id)
+                self.hits += 1
+                return e[0], e[1], e[2]
+            self.misses += 1
+        return None
+
+    def begin_fill(self, line_id: int):
+        """Token to pass to store() for a load started after a miss."""
+        if not self.maxsize:
+            return None
+        tok = object()
+        with self._lock:
+            if len(self._fills) >= self.maxsize:    # abandoned fills (missing line, failed load)
+                self._fills.clear()
+            self._fills[line_id] = tok
+        return tok
+
+    def store(self, line_id: int, line, bids, token=None):
+        """Cache a freshly loaded line; returns (line, bids, version).
+
+        An entry cached meanwhile is newer and wins. With a token, a fill
+        whose line was written during the load is returned uncached, under
+        a version of its own.
+        """
+        if not self.maxsize:
+            return line, bids, next(self._counter)
+        with self._lock:
+            e = self._entries.get(line_id)
+            if e is not None:
+                self._entries.move_to_end(line_id)
+                return e[0], e[1], e[2]
+            if token is not None and self._fills.get(line_id) is not token:
+                return line, bids, next(self._counter)
+            self._fills.pop(line_id, None)
+            e = [line, bids, next(self._counter)]
+            self._entries[line_id] = e
+            self._entries.move_to_end(line_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return e[0], e[1], e[2]
+
+    def get(self, line_id: int, load_line, load_bids):
+        """(line, bids, version) or None when the line does not exist."""
+        e = self.lookup(line_id)
+        if e is not None:
+            return e
+        tok = self.begin_fill(line_id)
+        line = load_line(line_id)
+        if line is None:
+            return None
+        return self.store(line_id, line, load_bids(line_id), tok)
+
+    def version(self, line_id: int):
+        e = self._entries.get(line_id)
+        return e[2] if e is not None else None
+
+    def put_bid(self, line_id: int, k: int, bid: int):
+        with self._lock:
+            self._fills.pop(line_id, None)
+            e = self._entries.get(line_id)
+            if e is not None:
+                e[1] = e[1].with_bid(int(k), int(bid))
+                e[2] = next(self._counter)
+
+    def put_bids(self, line_id: int, bids: dict):
+        """Replace the whole {k: bid} map (bulk import)."""
+        with self._lock:
+            self._fills.pop(line_id, None)
+            e = self._entries.get(line_id)
+            if e is not None:
+                e[1] = bids
+                e[2] = next(self._counter)
+
+    def update_line(self, line_id: int, **fields):
+        with self._lock:
+            self._fills.pop(line_id, None)
+            e = self._entries.get(line_id)
+            if e is not None:
+                e[0] = e[0].replace(**fields)
+                e[2] = next(self._counter)
+
+    def touch(self, line_id: int):
+        """Bump the version only: data derived from the line changed elsewhere (payments)."""
+        with self._lock:
+            self._fills.pop(line_id, None)
+            e = self._entries.get(line_id)
+            if e is not None:
+                e[2] = next(self._counter)
+
+    def invalidate(self, line_id: int = None):
+        with self._lock:
+            if line_id is None:
+                self._entries.clear(); self._fills.clear()
+            else:
+                self._entries.pop(line_id, None); self._fills.pop(line_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
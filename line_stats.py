@@ -0,0 +1,77 @@
+"""Bảng line_stats: tóm tắt mỗi dây, cập nhật cùng transaction với /tham.
+
+    python line_stats.py           # dựng lại toàn bộ, in các dây bị lệch
+    python line_stats.py --check   # chỉ kiểm tra, không ghi
+"""
+import sys
+from datetime import datetime
+
+import payout
+import queries
+from db_sqlite import db, get_all, transaction
+
+FIELDS = ("n_bids", "bid_sum", "paid_cum", "k_now", "best_k_roi", "best_k_profit")
+
+def compute(line, bids: dict) -> dict:
+    """Số liệu của dây từ {k: bid}; k_now và paid_cum giống cách /tomtat ước tính."""
+    M, N, _ = payout.line_params(line)
+    k_now = max(1, min(len(bids) + 1, N))
+    _, paid, _, _ = payout.evaluate(line, bids)
+    return {
+        "n_bids": len(bids),
+        "bid_sum": sum(int(b) for b in bids.values()),
+        "paid_cum": int(paid[k_now - 1]) if N else 0,
+        "k_now": k_now,
+        "best_k_roi": payout.best_k(line, bids, "roi")[0],
+        "best_k_profit": payout.best_k(line, bids, "lai")[0],
+    }
+
+def save(line, bids: dict):
+    """Ghi số liệu của dây; gọi trong transaction của lệnh ghi rounds/lines."""
+    st = compute(line, bids)
+    db().execute(queries.LINE_STATS_SAVE,
+                 (int(line["id"]), *(st[f] for f in FIELDS), datetime.now().isoformat(timespec="seconds")))
+    return st
+
+def get(line_id: int):
+    rows = get_all(queries.LINE_STATS_BY_ID, (line_id,))
+    return rows[0] if rows else None
+
+def _all_bids():
+    out = {}
+    for r in db().execute("SELECT line_id, k, bid FROM rounds"):
+        out.setdefault(int(r["line_id"]), {})[int(r["k"])] = int(r["bid"])
+    return out
+
+def rebuild(check_only: bool = False):
+    """So line_stats với tính lại từ rounds; sửa (nếu không check_only). → [(line_id, {field: (stored, fresh)})]"""
+    lines = get_all("SELECT * FROM lines")
+    bids = _all_bids()
+    stored = {int(r["line_id"]): r for r in get_all("SELECT * FROM line_stats")}
+    drift = []
+    with transaction():
+        for line in lines:
+            lid = int(line["id"])
+            fresh = compute(line, bids.get(lid, {}))
+            old = stored.get(lid)
+            diff = {f: (old[f] if old else None, fresh[f]) for f in FIELDS if not old or old[f] != fresh[f]}
+            if diff:
+                drift.append((lid, diff))
+                if not check_only: save(line, bids.get(lid, {}))
+    return drift
+
+def ensure_built(migrated: bool = False):
+    """Dựng lại bảng khi vừa migrate hoặc bảng còn trống (dữ liệu có từ trước khi có line_stats).
+
+    Khởi động bình thường chỉ tốn một lần đọc, không duyệt các dây.
+    """
+    if migrated or not db().execute("SELECT EXISTS(SELECT 1 FROM line_stats)").fetchone()[0]:
+        rebuild()
+
+if __name__ == "__main__":
+    check = "--check" in sys.argv[1:]
+    drift = rebuild(check_only=check)
+    for lid, diff in drift:
+        print(f"line {lid}: " + ", ".join(f"{f} {a} -> {b}" for f, (a, b) in diff.items()))
+    print(f"{len(drift)} line(s) {'drifted' if check else 'rebuilt'}")
+    sys.exit(1 if check and drift else 0)
@@ -0,0 +1,36 @@
+import asyncio, time
+
+from metrics import LOOP_LAG
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task.
+
+    Every `interval` seconds the task asks to be woken; the overshoot is the
+    time the loop was busy with something else (e.g. a blocking DB call in a
+    handler). Healthy loops stay around a millisecond.
+    """
+
+    def __init__(self, interval: float = 0.25, slow_ms: float = 100.0):
+        self.interval = interval
+        self.slow_ms = slow_ms
+        self.samples = self.slow = 0
+        self.last_ms = self.max_ms = self._sum_ms = 0.0
+
+    def record(self, lag_ms: float):
+        self.samples += 1
+        self.last_ms = lag_ms
+        self._sum_ms += lag_ms
+        if lag_ms > self.max_ms: self.max_ms = lag_ms
+        if lag_ms >= self.slow_ms: self.slow += 1
+        LOOP_LAG.observe(lag_ms / 1000)
+
+    async def run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, (time.perf_counter() - t0 - self.interval) * 1000))
+
+    def stats(self) -> dict:
+        return {"samples": self.samples, "last_ms": round(self.last_ms, 2), "max_ms": round(self.max_ms, 2),
+                "avg_ms": round(self._sum_ms / self.samples, 2) if self.samples else 0.0,
+                "slow": self.slow, "slow_ms": self.slow_ms}
@@ -0,0 +1,138 @@
+"""Chỉ số cho /metrics (Prometheus text format 0.0.4), không cần thư viện ngoài.
+
+Histogram có bucket cố định; mỗi giá trị nhãn được cấp một mảng đếm đúng một lần
+(lần đầu gặp), sau đó observe() chỉ là bisect + cộng số, đủ rẻ để luôn bật. observe()
+không khoá (chỉ khoá khi tạo series mới): nhiều luồng ghi cùng lúc hiếm khi mất một lần
+đếm, chấp nhận được cho chỉ số; _count suy ra từ tổng bucket nên luôn khớp với bucket.
+Các số liệu sẵn có (cache, outbox, ...) được đọc lúc render qua register_stats().
+"""
+import re, threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+_registry = []          # Histogram | Counter, theo thứ tự khai báo
+_stats = []             # (prefix, help, fn) → gauge từ dict số liệu
+
+def _fmt(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class _Series:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, n: int):
+        self.counts = [0] * n
+        self.sum = 0.0
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str = None, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _get(self, value):
+        s = self._series.get(value)
+        if s is None:
+            with self._lock:
+                s = self._series.setdefault(value, _Series(len(self.buckets) + 1))
+        return s
+
+    def observe(self, seconds: float, value=""):
+        s = self._series.get(value) or self._get(value)
+        s.counts[bisect_left(self.buckets, seconds)] += 1
+        s.sum += seconds
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            snap = [(v, list(s.counts), s.sum) for v, s in sorted(self._series.items())]
+        for value, counts, total in snap:
+            n = sum(counts)
+            lbl = f'{self.label}="{_esc(value)}",' if self.label else ""
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                out.append(f'{self.name}_bucket{{{lbl}le="{le}"}} {acc}')
+            out.append(f'{self.name}_bucket{{{lbl}le="+Inf"}} {n}')
+            tail = f"{{{lbl[:-1]}}}" if lbl else ""
+            out.append(f"{self.name}_sum{tail} {_fmt(total)}")
+            out.append(f"{self.name}_count{tail} {n}")
+
+class Counter:
+    def __init__(self, name: str, help: str, label: str = None):
+        self.name, self.help, self.label = name, help, label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, value="", n: int = 1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + n
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.label:
+            items = [("", 0)]
+        for value, n in items:
+            lbl = f'{{{self.label}="{_esc(value)}"}}' if self.label else ""
+            out.append(f"{self.name}{lbl} {n}")
+
+def register_stats(prefix: str, help: str, fn):
+    """Mỗi số trong fn() (dict) thành gauge `<prefix>_<key>`; fn() trả None thì bỏ qua."""
+    _stats.append((prefix, help, fn))
+
+def render() -> str:
+    out = []
+    for m in _registry:
+        m.render(out)
+    for prefix, help, fn in _stats:
+        try:
+            st = fn()
+        except Exception:
+            continue
+        for k, v in (st or {}).items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)): continue
+            name = f"{prefix}_{k}"
+            out.append(f"# HELP {name} {help}: {k}")
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {_fmt(v)}")
+    return "\n".join(out) + "\n"
+
+# ---------- nhãn SQL: động từ + bảng, để số series có hạn ----------
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?|ON)\s+(\w+)", re.I)
+_sql_labels = {}
+SQL_LABEL_CACHE = 1024
+
+def sql_label(sql: str) -> str:
+    """'SELECT * FROM lines WHERE id=?' → 'select:lines' (đệm theo chuỗi SQL)."""
+    lbl = _sql_labels.get(sql)
+    if lbl is None:
+        head = sql.lstrip().split(None, 1)
+        verb = head[0].lower().rstrip(";") if head else ""
+        m = _SQL_TABLE.search(sql) if verb not in ("begin", "commit", "rollback", "savepoint", "release", "pragma") else None
+        lbl = f"{verb}:{m.group(1).lower()}" if m else verb
+        if len(_sql_labels) < SQL_LABEL_CACHE:
+            _sql_labels[sql] = lbl
+    return lbl
+
+# ---------- chỉ số của bot ----------
+HANDLER_SECONDS = Histogram("huibot_handler_seconds", "Thời gian xử lý mỗi lệnh Telegram", "command")
+HANDLER_ERRORS = Counter("huibot_handler_errors_total", "Số lần handler ném lỗi", "command")
+DB_SECONDS = Histogram("huibot_db_statement_seconds", "Thời gian execute SQL (SQLite, SQLAlchemy) theo câu lệnh (động từ:bảng)",
+                       "statement", DB_BUCKETS)
+WEBHOOK_WAIT = Histogram("huibot_webhook_wait_seconds", "Thời gian /webhook chờ process_update (fut.result)")
+WEBHOOK_TIMEOUTS = Counter("huibot_webhook_timeouts_total", "Số lần /webhook hết thời gian chờ")
+LOOP_LAG = Histogram("huibot_loop_lag_seconds", "Độ trễ đánh thức của event loop bot",
+                     buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+TELEGRAM_SECONDS = Histogram("huibot_telegram_request_seconds", "Thời gian gọi Bot API theo method", "method")
+TELEGRAM_ERRORS = Counter("huibot_telegram_request_errors_total", "Số lần gọi Bot API lỗi theo method", "method")
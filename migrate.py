@@ -1,10 +1,9 @@
 import asyncio
-from db import run_migrations, init_engine
+from db import run_migrations, init_engine, SCHEMA_VERSION
 
 async def main():
     await init_engine()
-    await run_migrations()
-    print("migrations ok")
+    print(f"schema_version {await run_migrations()} (latest {SCHEMA_VERSION})")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,137 @@
+"""Compact in-memory rows: a line with fields parsed once, and its bids as a dense array.
+
+Both keep the read-only mapping interface the handlers already use
+(line["contrib"], line.get("thau_rate", 0), len(bids), bids.items(), ...),
+so code can move to attribute access (line.contrib, bids.get(k)) gradually.
+"""
+from array import array
+from datetime import datetime
+
+MISSING = -1        # bid sentinel: kỳ chưa có thăm
+
+class Line:
+    FIELDS = ("id", "name", "period_days", "start_date", "legs", "contrib", "bid_type", "bid_value",
+              "status", "base_rate", "cap_rate", "thau_rate", "remind_hour", "remind_min", "last_remind_iso")
+    __slots__ = FIELDS + ("start", "thau_amount")
+
+    def __init__(self, row):
+        g = row.get
+        self.id = int(row["id"])
+        self.name = g("name")
+        self.period_days = int(g("period_days") or 0)
+        self.start_date = str(row["start_date"])
+        self.legs = int(g("legs") or 0)
+        self.contrib = int(g("contrib") or 0)
+        self.bid_type = g("bid_type")
+        self.bid_value = g("bid_value")
+        self.status = g("status") or "OPEN"
+        self.base_rate = float(g("base_rate") or 0)
+        self.cap_rate = float(100 if g("cap_rate") is None else g("cap_rate"))
+        self.thau_rate = float(g("thau_rate") or 0)
+        self.remind_hour = int(8 if g("remind_hour") is None else g("remind_hour"))
+        self.remind_min = int(g("remind_min") or 0)
+        self.last_remind_iso = g("last_remind_iso")
+        self.start = datetime.fromisoformat(self.start_date[:10])
+        self.thau_amount = int(round(self.contrib * self.thau_rate / 100.0))   # D, đầu thảo
+
+    # mapping interface (read-only), for code written against dict rows
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self) -> dict:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def replace(self, **fields) -> "Line":
+        return Line({**self.to_dict(), **fields})
+
+    def __repr__(self):
+        return f"Line(id={self.id}, name={self.name!r}, legs={self.legs}, status={self.status})"
+
+class Bids:
+    """Bids of one line: T[k] for k = 1..legs (T[0] unused), MISSING when not entered.
+
+    Immutable: with_bid()/merged() return a copy, so a cached instance can be
+    shared between handlers.
+    """
+    __slots__ = ("T", "n")
+
+    def __init__(self, legs: int, T=None, n: int = 0):
+        self.T = T if T is not None else array("q", [MISSING]) * (legs + 1)
+        self.n = n                  # số kỳ đã có thăm
+
+    @classmethod
+    def from_map(cls, legs: int, bids) -> "Bids":
+        """{k: bid} → Bids; ValueError nếu có kỳ ngoài 1..legs (không có chỗ trong mảng)."""
+        b = cls(legs)
+        for k, v in bids.items():
+            k = int(k)
+            if not 1 <= k <= legs:
+                raise ValueError(f"kỳ {k} ngoài 1..{legs}")
+            if b.T[k] == MISSING: b.n += 1
+            b.T[k] = int(v)
+        return b
+
+    @property
+    def legs(self) -> int:
+        return len(self.T) - 1
+
+    def get(self, k, default=None):
+        if 1 <= k < len(self.T):
+            t = self.T[k]
+            if t != MISSING: return t
+        return default
+
+    def __getitem__(self, k):
+        t = self.get(k)
+        if t is None: raise KeyError(k)
+        return t
+
+    def __contains__(self, k):
+        return self.get(k) is not None
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return (k for k, t in enumerate(self.T) if k and t != MISSING)
+
+    keys = __iter__
+
+    def items(self):
+        return ((k, t) for k, t in enumerate(self.T) if k and t != MISSING)
+
+    def values(self):
+        return (t for t in self.T[1:] if t != MISSING)
+
+    def __eq__(self, other):
+        if isinstance(other, Bids): return self.T == other.T
+        if isinstance(other, dict): return dict(self.items()) == other
+        return NotImplemented
+
+    def dense(self) -> list:
+        """[0, T1, ..., TN] with 0 for missing kỳ (payout formulas)."""
+        return [0 if t == MISSING else t for t in self.T]
+
+    def with_bid(self, k: int, bid: int) -> "Bids":
+        return self.merged({k: bid})
+
+    def merged(self, bids) -> "Bids":
+        b = Bids(self.legs, array("q", self.T), self.n)
+        for k, v in bids.items():
+            k = int(k)
+            if 1 <= k <= self.legs:
+                if b.T[k] == MISSING: b.n += 1
+                b.T[k] = int(v)
+        return b
+
+    def __repr__(self):
+        return f"Bids({dict(self.items())})"
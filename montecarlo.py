@@ -0,0 +1,83 @@
+"""Mô phỏng Monte Carlo: lãi/ROI kỳ vọng mỗi kỳ k khi thăm các kỳ sau chưa biết.
+
+best_k_var coi kỳ chưa có thăm là T_k = 0. Ở đây các kỳ thiếu được rút ngẫu nhiên trong
+[sàn, trần] của dây, mỗi đường (path) là một dãy thăm đầy đủ; cùng công thức với payout:
+
+    payout(k) = (k-1)*M + (N-k)*(M - T_k) - D
+    paid(k)   = sum_{j<k} (M - T_j)
+
+Phân phối: "uniform" (đều trong [sàn, trần]), "tri" (tam giác, đỉnh giữa khoảng),
+"empirical" (rút lại từ thăm đã có của dây; ít hơn EMPIRICAL_MIN kỳ thì dùng uniform).
+Tính theo mảng (paths × legs), chia khối CHUNK đường để giới hạn bộ nhớ.
+"""
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+import payout
+
+DISTS = ("empirical", "uniform", "tri")
+EMPIRICAL_MIN = 3
+CHUNK = 25_000
+PCTS = (5, 50, 95)
+
+def bid_range(line) -> tuple:
+    M = int(line["contrib"])
+    return (int(round(M * float(line.get("base_rate", 0)) / 100.0)),
+            int(round(M * float(line.get("cap_rate", 100)) / 100.0)))
+
+def _sampler(rng, dist, lo, hi, known):
+    if dist == "empirical":
+        pool = np.clip(known, lo, hi)
+        if len(pool) >= EMPIRICAL_MIN:
+            return lambda size: rng.choice(pool, size=size)
+        dist = "uniform"
+    if hi <= lo:
+        return lambda size: np.full(size, lo, dtype=np.int64)
+    if dist == "tri":
+        return lambda size: np.rint(rng.triangular(lo, (lo + hi) / 2, hi, size)).astype(np.int64)
+    return lambda size: rng.integers(lo, hi + 1, size=size)
+
+def simulate(line, bids, paths: int = 20_000, dist: str = "empirical", seed=None) -> dict:
+    """Lãi, ROI kỳ vọng và dải phân vị lãi cho mọi k = 1..legs (list, chỉ số k-1)."""
+    if np is None:
+        raise RuntimeError("cần numpy để mô phỏng")
+    if dist not in DISTS:
+        raise ValueError(f"phân phối không hợp lệ: {dist}")
+    M, N, D = payout.line_params(line)
+    lo, hi = bid_range(line)
+    T = np.full(N, -1, dtype=np.int64)
+    for k, b in bids.items():
+        if 1 <= int(k) <= N: T[int(k) - 1] = int(b)
+    miss = T < 0
+    known = T[~miss]
+    rng = np.random.default_rng(seed)
+    sample = _sampler(rng, dist, lo, hi, known)
+    used = dist if dist != "empirical" or len(known) >= EMPIRICAL_MIN else "uniform"
+
+    ks = np.arange(1, N + 1)
+    profit = np.empty((paths, N), dtype=np.int64)
+    roi_sum = np.zeros(N)
+    for start in range(0, paths, CHUNK):
+        n = min(CHUNK, paths - start)
+        S = np.broadcast_to(T, (n, N)).copy()
+        if miss.any():
+            S[:, miss] = sample((n, int(miss.sum())))
+        c = M - S
+        paid = np.zeros_like(S)
+        np.cumsum(c[:, :-1], axis=1, out=paid[:, 1:])
+        pr = (ks - 1) * M + (N - ks) * c - D - paid
+        profit[start:start + n] = pr
+        roi_sum += (pr / np.where(paid > 0, paid, M)).sum(axis=0)
+
+    mean = profit.mean(axis=0)
+    roi = roi_sum / paths if paths else roi_sum
+    bands = np.percentile(profit, PCTS, axis=0) if paths else np.zeros((len(PCTS), N))
+    return {
+        "paths": paths, "dist": used, "bid_range": [lo, hi], "sampled_k": (np.flatnonzero(miss) + 1).tolist(),
+        "profit_mean": mean.tolist(), "roi_mean": roi.tolist(),
+        "profit_pct": {p: b.tolist() for p, b in zip(PCTS, bands)},
+        "best_k_roi": int(np.argmax(roi)) + 1 if N else 0,
+        "best_k_profit": int(np.argmax(mean)) + 1 if N else 0,
+    }
@@ -0,0 +1,193 @@
+import asyncio, itertools, logging, time
+from collections import Counter
+
+logger = logging.getLogger("huibot.outbox")
+
+# Lower value = sent first
+PRIO_REPLY, PRIO_REMINDER, PRIO_ALERT = 0, 1, 2
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "blocked_until", "used")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.stamp = capacity, now
+        self.blocked_until = 0.0
+        self.used = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 = ready now)."""
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+        self.used = self.stamp
+
+    def idle(self, now: float, ttl: float) -> bool:
+        """Full, not held back by a 429 and unused for `ttl` s: same as a fresh bucket."""
+        return (now - self.used >= ttl and now >= self.blocked_until
+                and self.tokens + (now - self.stamp) * self.rate >= self.capacity)
+
+class _Item:
+    __slots__ = ("prio", "seq", "chat_id", "text", "kwargs", "future", "attempts", "not_before")
+
+    def __init__(self, prio, seq, chat_id, text, kwargs, future):
+        self.prio, self.seq, self.chat_id, self.text = prio, seq, chat_id, text
+        self.kwargs, self.future = kwargs, future
+        self.attempts, self.not_before = 0, 0.0
+
+class Outbox:
+    """Rate-limited sender in front of `bot.send_message`.
+
+    A global bucket (Telegram: ~30 msg/s) and one bucket per chat (~1 msg/s)
+    gate every message; among messages that may go out, the lowest priority
+    value wins, so replies overtake reminders and admin alerts. 429 responses
+    (`retry_after` on the exception) are retried after the advised delay and
+    hold back the whole chat meanwhile. Admin alerts are coalesced: the first
+    one in a window is sent, the rest are folded into a single digest.
+
+    Per-chat buckets that are full and idle for `chat_idle_ttl` seconds are
+    dropped (checked every `sweep_every` s), so one bucket per chat ever seen
+    does not pile up on a long-running instance; a dropped bucket is
+    recreated full, exactly as it was.
+
+    Only `bot.send_message(chat_id=..., text=..., **kwargs)` is used, so any
+    object with that coroutine method can stand in for the PTB Bot.
+    """
+
+    def __init__(self, bot, *, global_rate=30.0, chat_rate=1.0, chat_burst=3,
+                 admin_chat_id=0, digest_window=60.0, max_retries=5, chat_idle_ttl=300.0,
+                 sweep_every=60.0, clock=time.monotonic):
+        self.bot = bot
+        self.global_rate, self.chat_rate, self.chat_burst = global_rate, chat_rate, chat_burst
+        self.admin_chat_id = admin_chat_id
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._chats = {}
+        self.chat_idle_ttl, self.sweep_every = chat_idle_ttl, sweep_every
+        self._next_sweep = clock() + sweep_every
+        self._pending = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._inflight = set()
+        self._alerts = Counter()
+        self._digest_task = None
+        self.sent = self.retried = self.failed = self.coalesced = self.evicted = 0
+
+    # ---------- public ----------
+    def submit(self, chat_id, text, priority=PRIO_REPLY, **kwargs) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append(_Item(priority, next(self._seq), chat_id, text, kwargs, fut))
+        self._wakeup.set()
+        return fut
+
+    async def send(self, chat_id, text, priority=PRIO_REPLY, **kwargs):
+        """Queue a message and wait until Telegram accepted it (returns the Message)."""
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def alert(self, text: str):
+        """Admin alert, coalesced with the others of the current window."""
+        if not self.admin_chat_id:
+            return
+        if self._digest_task is None:
+            self.submit(self.admin_chat_id, text[:4000], PRIO_ALERT).add_done_callback(_ignore_result)
+            self._digest_task = asyncio.get_running_loop().create_task(self._flush_digest())
+        else:
+            self._alerts[text.splitlines()[0][:200] if text else ""] += 1
+            self.coalesced += 1
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "inflight": len(self._inflight), "chats": len(self._chats),
+                "sent": self.sent, "retried": self.retried, "failed": self.failed,
+                "coalesced": self.coalesced, "evicted": self.evicted}
+
+    # ---------- internals ----------
+    def _bucket(self, chat_id):
+        b = self._chats.get(chat_id)
+        if b is None:
+            b = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, self._clock())
+        return b
+
+    def _sweep(self, now):
+        idle = [c for c, b in self._chats.items() if b.idle(now, self.chat_idle_ttl)]
+        for c in idle:
+            del self._chats[c]
+        self.evicted += len(idle)
+        self._next_sweep = now + self.sweep_every
+
+    def _pick(self, now):
+        """(item, 0) for the best sendable item, else (None, seconds to wait)."""
+        gwait = self._global.wait_time(now)
+        best, wait = None, None
+        for it in self._pending:
+            w = max(gwait, it.not_before - now, self._bucket(it.chat_id).wait_time(now))
+            if w <= 0:
+                if best is None or (it.prio, it.seq) < (best.prio, best.seq):
+                    best = it
+            elif wait is None or w < wait:
+                wait = w
+        return (best, 0.0) if best is not None else (None, wait)
+
+    async def run(self):
+        while True:
+            now = self._clock()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            item, wait = self._pick(now) if self._pending else (None, None)
+            if item is not None:
+                self._pending.remove(item)
+                self._global.take(); self._bucket(item.chat_id).take()
+                t = asyncio.get_running_loop().create_task(self._deliver(item))
+                self._inflight.add(t); t.add_done_callback(self._inflight.discard)
+                continue
+            self._wakeup.clear()
+            try:
+                async with asyncio.timeout(wait):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    async def _deliver(self, item: _Item):
+        try:
+            msg = await self.bot.send_message(chat_id=item.chat_id, text=item.text, **item.kwargs)
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None and item.attempts < self.max_retries:
+                item.attempts += 1
+                delay = float(retry_after) + 0.5 * item.attempts
+                self._bucket(item.chat_id).blocked_until = self._clock() + delay
+                item.not_before = self._clock() + delay
+                self.retried += 1
+                logger.warning("429 for chat %s, retry in %.1fs", item.chat_id, delay)
+                self._pending.append(item)
+                self._wakeup.set()
+                return
+            self.failed += 1
+            if not item.future.done(): item.future.set_exception(e)
+            return
+        self.sent += 1
+        if not item.future.done(): item.future.set_result(msg)
+
+    async def _flush_digest(self):
+        try:
+            while True:
+                await asyncio.sleep(self.digest_window)
+                if not self._alerts:
+                    return
+                total = sum(self._alerts.values())
+                lines = [f"⚠️ {total} lỗi khác trong {int(self.digest_window)}s:"]
+                lines += [f"• {n}× {t}" for t, n in self._alerts.most_common(20)]
+                self._alerts.clear()
+                self.submit(self.admin_chat_id, "\n".join(lines)[:4000], PRIO_ALERT).add_done_callback(_ignore_result)
+        finally:
+            self._digest_task = None
+
+def _ignore_result(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.warning("outbox: admin alert not delivered: %s", fut.exception())
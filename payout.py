@@ -0,0 +1,95 @@
+"""Payout engine: evaluates every kỳ k of a line in one pass.
+
+For a line with mệnh giá M, N chân, đầu thảo D and bids T_j (0 when missing):
+
+    payout(k) = (k-1)*M + (N-k)*(M - T_k) - D
+    paid(k)   = sum_{j<k} (M - T_j)          (prefix sum, built once)
+    profit(k) = payout(k) - paid(k)
+    roi(k)    = profit(k) / (paid(k) if paid(k) > 0 else M)
+
+Results are identical (same ints, same floats) to the per-k helpers in app.py.
+NumPy is used when installed and the line is long enough to amortise it; it is
+imported on the first such line, not at startup (numpy() below).
+"""
+np = None
+_np_tried = False
+
+from models import Line, Bids, MISSING
+
+NUMPY_MIN_LEGS = 48
+
+def numpy():
+    """The numpy module, imported on first call; None when not installed."""
+    global np, _np_tried
+    if not _np_tried:
+        try:
+            import numpy as _np
+        except ImportError:  # pragma: no cover - optional dependency
+            _np = None
+        np, _np_tried = _np, True
+    return np
+
+def line_params(line):
+    if isinstance(line, Line):
+        return line.contrib, line.legs, line.thau_amount
+    M, N = int(line["contrib"]), int(line["legs"])
+    D = int(round(M * float(line.get("thau_rate", 0)) / 100.0))
+    return M, N, D
+
+def dense_bids(bids, N: int) -> list:
+    """T[0..N] with T[k] = bid of kỳ k (0 when missing); T[0] unused."""
+    if isinstance(bids, Bids) and bids.legs == N:
+        return bids.dense()
+    T = [0] * (N + 1)
+    for k, b in bids.items():
+        k = int(k)
+        if 1 <= k <= N: T[k] = int(b)
+    return T
+
+def _table_py(M, N, D, T):
+    payout, paid, profit, roi = [], [], [], []
+    cum = 0
+    for k in range(1, N + 1):
+        po = (k-1)*M + (N-k)*(M - T[k]) - D
+        p = po - cum
+        base = cum if cum > 0 else M
+        payout.append(po); paid.append(cum); profit.append(p)
+        roi.append(p / base if base else 0.0)
+        cum += M - T[k]
+    return payout, paid, profit, roi
+
+def _table_np(M, N, D, T):
+    t = np.asarray(T[1:], dtype=np.int64)
+    k = np.arange(1, N + 1, dtype=np.int64)
+    payout = (k - 1) * M + (N - k) * (M - t) - D
+    paid = np.zeros(N, dtype=np.int64)
+    np.cumsum(M - t[:-1], out=paid[1:])
+    profit = payout - paid
+    base = np.where(paid > 0, paid, M)
+    if M:
+        roi = profit / base
+    else:
+        roi = np.divide(profit, base, out=np.zeros(N), where=base != 0)
+    return payout, paid, profit, roi
+
+def evaluate(line, bids):
+    """(payout, paid, profit, roi) sequences indexed by k-1, for k = 1..legs."""
+    M, N, D = line_params(line)
+    if N >= NUMPY_MIN_LEGS and numpy() is not None:
+        if isinstance(bids, Bids) and bids.legs == N:     # mảng sẵn có, không copy qua list
+            T = np.frombuffer(bids.T, dtype=np.int64)
+            return _table_np(M, N, D, np.where(T == MISSING, 0, T))
+        return _table_np(M, N, D, dense_bids(bids, N))
+    return _table_py(M, N, D, dense_bids(bids, N))
+
+def best_k(line, bids, metric="roi"):
+    """Same contract as app.best_k_var: (bestk, (profit, roi, payout, paid))."""
+    payout, paid, profit, roi = evaluate(line, bids)
+    if not len(payout):
+        return 1, None
+    key = roi if metric == "roi" else profit
+    if np is not None and isinstance(key, np.ndarray):
+        i = int(np.argmax(key))
+    else:
+        i = max(range(len(key)), key=key.__getitem__)  # first max, like the k loop
+    return i + 1, (int(profit[i]), float(roi[i]), int(payout[i]), int(paid[i]))
@@ -0,0 +1,152 @@
+"""Báo cáo tổng quan tất cả dây đang mở.
+
+Mỗi dây được đánh giá như /tomtat (kỳ hiện tại ước tính) và /hottot (kỳ tốt nhất).
+report() dùng load_summary(): một câu SQL, mỗi dây một dòng lấy k_now/paid_cum/best_k
+sẵn có trong line_stats cộng ba phép tra rounds theo khoá chính (thăm ở k_now, ở best_k
+và tổng thăm trước best_k), nên không phải kéo mọi rounds về Python. load_open() +
+evaluate() (ma trận dây × kỳ, NumPy) vẫn dùng khi cần cả bảng thăm (sổ đóng tiền).
+"""
+import itertools
+
+import payout
+import queries
+from db_sqlite import db
+from queries import SUMMARY_SQL
+
+COLS = ("line_id", "k_now", "paid_now", "payout_now",
+        "best_k", "best_payout", "best_paid", "best_profit", "best_roi")
+
+def _tuples(sql, params=()):
+    cur = db().cursor()
+    cur.row_factory = None          # tuple thô, nhanh hơn sqlite3.Row với hàng chục nghìn dòng
+    return cur.execute(sql, params).fetchall()
+
+def load_open():
+    """(lines, rounds): [(id, name, legs, contrib, thau_rate)] theo id, [(line_id, k, bid)]."""
+    lines = _tuples(queries.PORTFOLIO_LINES)
+    rounds = _tuples(queries.PORTFOLIO_ROUNDS)
+    return lines, rounds
+
+def best_col(metric: str) -> str:
+    return "best_k_roi" if metric == "roi" else "best_k_profit"
+
+def load_summary(metric="roi"):
+    """(rows, bids): mỗi dây mở một dòng (id, name, legs, contrib, thau_rate, k_now, paid_now,
+    best_k, thăm k_now, thăm best_k, tổng thăm trước best_k); bids = {line_id: {k: bid}} chỉ cho
+    dây chưa có line_stats (k_now NULL), tính lại đầy đủ."""
+    rows = _tuples(SUMMARY_SQL.format(best=best_col(metric)))
+    missing = [r[0] for r in rows if r[5] is None]
+    bids = {}
+    for i in range(0, len(missing), 500):
+        part = missing[i:i + 500]
+        for lid, k, b in _tuples(queries.rounds_in(len(part)), part):
+            bids.setdefault(lid, {})[k] = b
+    return rows, bids
+
+def evaluate_summary(rows, bids, metric="roi"):
+    """Cột như evaluate(), từ các dòng của load_summary(): O(1) mỗi dây."""
+    out = {c: [] for c in COLS}
+    for lid, _, N, M, thau, k_now, paid_now, b, t_now, t_best, pre in rows:
+        if k_now is None:
+            line = {"contrib": M, "legs": N, "thau_rate": thau or 0}
+            bb = bids.get(lid, {})
+            po, paid, _, _ = payout.evaluate(line, bb)
+            k_now = max(1, min(len(bb) + 1, N))
+            vals = (lid, k_now, int(paid[k_now-1]), int(po[k_now-1]), *_best(payout.best_k(line, bb, metric)))
+        else:
+            D = int(round(M * float(thau or 0) / 100.0))
+            bpo = (b-1)*M + (N-b)*(M - (t_best or 0)) - D
+            bpaid = (b-1)*M - pre
+            profit = bpo - bpaid
+            base = bpaid if bpaid > 0 else M
+            vals = (lid, k_now, paid_now, (k_now-1)*M + (N-k_now)*(M - (t_now or 0)) - D,
+                    b, bpo, bpaid, profit, profit / base if base else 0.0)
+        for c, v in zip(COLS, vals):
+            out[c].append(v)
+    return out
+
+def _best(res):
+    bk, (p, r, bpo, bpaid) = res
+    return bk, bpo, bpaid, p, r
+
+def _evaluate_np(lines, rounds, metric):
+    np = payout.np
+    L = len(lines)
+    ids = np.fromiter((l[0] for l in lines), np.int64, L)
+    N = np.fromiter((l[2] for l in lines), np.int64, L)
+    M = np.fromiter((l[3] for l in lines), np.int64, L)
+    D = np.fromiter((int(round(int(l[3]) * float(l[4] or 0) / 100.0)) for l in lines), np.int64, L)
+    W = int(N.max())
+    T = np.zeros((L, W + 1), dtype=np.int64)           # T[:, k]; cột 0 bỏ trống
+    n_bids = np.zeros(L, dtype=np.int64)
+    if rounds:
+        r = np.fromiter(itertools.chain.from_iterable(rounds), np.int64, 3 * len(rounds)).reshape(-1, 3)
+        row = np.searchsorted(ids, r[:, 0])
+        n_bids = np.bincount(row, minlength=L)
+        ok = (r[:, 1] >= 1) & (r[:, 1] <= N[row])
+        T[row[ok], r[ok, 1]] = r[ok, 2]
+    T = T[:, 1:]
+    k = np.arange(1, W + 1, dtype=np.int64)[None, :]
+    Mc, Nc = M[:, None], N[:, None]
+    po = (k - 1) * Mc + (Nc - k) * (Mc - T) - D[:, None]
+    paid = np.zeros((L, W), dtype=np.int64)
+    np.cumsum(Mc - T[:, :-1], axis=1, out=paid[:, 1:])
+    profit = po - paid
+    base = np.where(paid > 0, paid, Mc)
+    roi = np.divide(profit, base, out=np.zeros((L, W)), where=base != 0)
+    key = np.where(k <= Nc, roi if metric == "roi" else profit.astype(np.float64), -np.inf)
+    best = key.argmax(axis=1)
+    now = np.minimum(n_bids + 1, N) - 1
+    rows = np.arange(L)
+    cols = (ids, now + 1, paid[rows, now], po[rows, now], best + 1,
+            po[rows, best], paid[rows, best], profit[rows, best], roi[rows, best])
+    return {c: a.tolist() for c, a in zip(COLS, cols)}
+
+def _evaluate_py(lines, rounds, metric):
+    bids = {}
+    for lid, k, b in rounds:
+        bids.setdefault(lid, {})[k] = b
+    out = {c: [] for c in COLS}
+    for lid, _, legs, contrib, thau in lines:
+        line = {"contrib": contrib, "legs": legs, "thau_rate": thau or 0}
+        b = bids.get(lid, {})
+        po, paid, _, _ = payout.evaluate(line, b)
+        kn = max(1, min(len(b) + 1, legs))
+        bk, (p, r, bpo, bpaid) = payout.best_k(line, b, metric)
+        for c, v in zip(COLS, (lid, kn, paid[kn-1], po[kn-1], bk, bpo, bpaid, p, r)):
+            out[c].append(v)
+    return out
+
+def evaluate(lines, rounds, metric="roi"):
+    """Cột theo từng dây (cùng thứ tự `lines`, dây có legs > 0)."""
+    if not lines:
+        return {c: [] for c in COLS}
+    if payout.numpy() is not None:
+        return _evaluate_np(lines, rounds, metric)
+    return _evaluate_py(lines, rounds, metric)
+
+def report(metric="roi", per_line=True, rows=None, summary=None):
+    """`summary` = (rows, bids) như load_summary(metric) (repo.portfolio_summary), mặc định đọc SQLite;
+    `rows` = (lines, rounds) như load_open() thì tính lại từ toàn bộ thăm."""
+    if rows is not None:
+        lines, rounds = rows
+        cols = evaluate(lines, rounds, metric)
+    else:
+        lines, bids = summary if summary is not None else load_summary(metric)
+        cols = evaluate_summary(lines, bids, metric)
+    exposure = sum(cols["best_paid"])
+    exp_profit = sum(cols["best_profit"])
+    base = exposure if exposure > 0 else sum(l[3] for l in lines)
+    out = {
+        "lines": len(lines),
+        "metric": metric,
+        "paid_in": sum(cols["paid_now"]),            # đã đóng tới kỳ hiện tại
+        "exposure": exposure,                        # vốn phải đóng tới kỳ hốt đề xuất
+        "expected_payout": sum(cols["best_payout"]), # payout nếu hốt ở kỳ đề xuất
+        "expected_profit": exp_profit,
+        "roi": exp_profit / base if base else 0.0,
+    }
+    if per_line:
+        names = [l[1] for l in lines]
+        out["per_line"] = [dict(zip(COLS, v), name=n) for n, *v in zip(names, *(cols[c] for c in COLS))]
+    return out
@@ -0,0 +1,116 @@
+"""Câu SQL (SQLite) chạy theo từng update / nhắc / báo cáo.
+
+Code chạy chúng (repo, line_stats, ledger, portfolio, db_sqlite) và phép kiểm tra
+EXPLAIN QUERY PLAN (db_sqlite.full_scans, `python db_sqlite.py --plans`) cùng dùng
+các hằng ở đây, nên câu được kiểm tra chính là câu được chạy. Không câu nào trong
+HOT_QUERIES được quét cả bảng.
+"""
+
+# ----- lines / rounds -----
+LINE_BY_ID = "SELECT * FROM lines WHERE id=?"
+BIDS_OF_LINE = "SELECT k, bid FROM rounds WHERE line_id=? ORDER BY k"
+ROUND_UPSERT = ("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,?) "
+                "ON CONFLICT(line_id,k) DO UPDATE SET bid=excluded.bid, round_date=excluded.round_date")
+OPEN_LINES = "SELECT * FROM lines WHERE status='OPEN'"
+
+# /danhsach: mọi trang (kể cả trang đầu, con trỏ FIRST_PAGE) là "id<?" → SEARCH theo khoá chính, không SCAN
+LIST_COLS = ("id", "name", "period_days", "start_date", "legs", "contrib", "base_rate",
+             "cap_rate", "thau_rate", "status", "remind_hour", "remind_min")
+FIRST_PAGE = 2 ** 63 - 1
+
+def list_where(status=None, weekly=None, before_id=None):
+    """(" WHERE ...", params) của /danhsach; SQLAlchemyRepository dựng cùng điều kiện bằng select()."""
+    where, params = [], []
+    if status: where.append("status=?"); params.append(status)
+    if weekly is True: where.append("period_days=7")
+    elif weekly is False: where.append("period_days<>7")
+    where.append("id<?"); params.append(FIRST_PAGE if before_id is None else before_id)
+    return " WHERE " + " AND ".join(where), params
+
+def list_lines(status=None, weekly=None, before_id=None, limit=25):
+    where, params = list_where(status, weekly, before_id)
+    return f"SELECT {','.join(LIST_COLS)} FROM lines{where} ORDER BY id DESC LIMIT ?", (*params, limit)
+
+# ----- nhắc: CAS trên last_remind_iso (chỉ một instance gửi) -----
+CLAIM_REMINDER = ("UPDATE lines SET last_remind_iso=? WHERE id=? AND status='OPEN' "
+                  "AND (last_remind_iso IS NULL OR last_remind_iso<>?)")
+RELEASE_REMINDER = "UPDATE lines SET last_remind_iso=? WHERE id=? AND last_remind_iso=?"
+
+# ----- seen_updates (dedup.py) -----
+CLAIM_UPDATE = ("INSERT INTO seen_updates(update_id,seen_at,done) VALUES(?,?,0) ON CONFLICT(update_id) "
+                "DO UPDATE SET seen_at=excluded.seen_at WHERE done=0 AND seen_at<?")
+UPDATE_DONE = "SELECT done FROM seen_updates WHERE update_id=?"
+FINISH_UPDATE = "UPDATE seen_updates SET done=1 WHERE update_id=?"
+RELEASE_UPDATE = "DELETE FROM seen_updates WHERE update_id=? AND done=0"
+PRUNE_UPDATES = "DELETE FROM seen_updates WHERE update_id<?"
+
+# ----- line_stats -----
+LINE_STATS_BY_ID = "SELECT * FROM line_stats WHERE line_id=?"
+LINE_STATS_SAVE = (
+    "INSERT INTO line_stats(line_id,n_bids,bid_sum,paid_cum,k_now,best_k_roi,best_k_profit,updated_at) "
+    "VALUES(?,?,?,?,?,?,?,?) ON CONFLICT(line_id) DO UPDATE SET "
+    "n_bids=excluded.n_bids, bid_sum=excluded.bid_sum, paid_cum=excluded.paid_cum, k_now=excluded.k_now, "
+    "best_k_roi=excluded.best_k_roi, best_k_profit=excluded.best_k_profit, updated_at=excluded.updated_at")
+
+# ----- sổ đóng tiền (ledger.py) -----
+PAYMENT_INSERT = "INSERT INTO payments(line_id,pay_date,amount) VALUES(?,?,?)"
+BALANCE_ADD = (
+    "INSERT INTO line_balances(line_id,paid_total,n_payments,last_pay_date,updated_at) VALUES(?,?,1,?,?) "
+    "ON CONFLICT(line_id) DO UPDATE SET paid_total=paid_total+excluded.paid_total, "
+    "n_payments=n_payments+1, last_pay_date=MAX(COALESCE(last_pay_date,''), excluded.last_pay_date), "
+    "updated_at=excluded.updated_at")
+BALANCE_OF_LINE = "SELECT paid_total, n_payments FROM line_balances WHERE line_id=?"
+ALL_BALANCES = "SELECT * FROM line_balances"
+
+def balances_in(n: int) -> str:
+    return f"SELECT * FROM line_balances WHERE line_id IN ({','.join('?' * n)})"
+
+# ----- config -----
+CONFIG_GET = "SELECT value FROM config WHERE key=?"
+CONFIG_SET = "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+
+# ----- /tongquan, /report (portfolio.py) -----
+PORTFOLIO_LINES = "SELECT id, name, legs, contrib, thau_rate FROM lines WHERE status='OPEN' AND legs>0 ORDER BY id"
+PORTFOLIO_ROUNDS = ("SELECT r.line_id, r.k, r.bid FROM rounds r JOIN lines l ON l.id=r.line_id "
+                    "WHERE l.status='OPEN' AND l.legs>0")
+# {best}: best_k_roi | best_k_profit (portfolio.best_col)
+SUMMARY_SQL = """SELECT l.id, l.name, l.legs, l.contrib, l.thau_rate, s.k_now, s.paid_cum, s.{best},
+    (SELECT bid FROM rounds WHERE line_id=l.id AND k=s.k_now),
+    (SELECT bid FROM rounds WHERE line_id=l.id AND k=s.{best}),
+    (SELECT COALESCE(SUM(bid), 0) FROM rounds WHERE line_id=l.id AND k>=1 AND k<s.{best})
+FROM lines l LEFT JOIN line_stats s ON s.line_id=l.id
+WHERE l.status='OPEN' AND l.legs>0 ORDER BY l.id"""
+
+def rounds_in(n: int) -> str:
+    return f"SELECT line_id, k, bid FROM rounds WHERE line_id IN ({','.join('?' * n)})"
+
+# name -> (sql, tham số mẫu) cho EXPLAIN QUERY PLAN
+HOT_QUERIES = {
+    "line_by_id": (LINE_BY_ID, (1,)),
+    "bids_of_line": (BIDS_OF_LINE, (1,)),
+    "round_upsert": (ROUND_UPSERT, (1, 1, 1, None)),
+    "open_lines": (OPEN_LINES, ()),
+    **{f"list_{s or 'all'}_{kind}_{page}": list_lines(s, w, b)          # /danhsach [mở|đóng] [tuần|tháng]
+       for s in (None, "OPEN") for kind, w in (("any", None), ("weekly", True), ("monthly", False))
+       for page, b in (("first", None), ("next", 100))},
+    "claim_reminder": (CLAIM_REMINDER, ("2025-01-01", 1, "2025-01-01")),
+    "release_reminder": (RELEASE_REMINDER, (None, 1, "2025-01-01")),
+    "claim_update": (CLAIM_UPDATE, (1, 0, 0)),
+    "update_done": (UPDATE_DONE, (1,)),
+    "finish_update": (FINISH_UPDATE, (1,)),
+    "release_update": (RELEASE_UPDATE, (1,)),
+    "prune_updates": (PRUNE_UPDATES, (1,)),
+    "line_stats_by_id": (LINE_STATS_BY_ID, (1,)),
+    "line_stats_save": (LINE_STATS_SAVE, (1, 0, 0, 0, 1, 1, 1, "2025-01-01")),
+    "payment_insert": (PAYMENT_INSERT, (1, "2025-01-01", 1)),
+    "balance_add": (BALANCE_ADD, (1, 1, "2025-01-01", "2025-01-01")),
+    "balance_of_line": (BALANCE_OF_LINE, (1,)),
+    "balances_in": (balances_in(2), (1, 2)),
+    "config_get": (CONFIG_GET, ("bot_cfg",)),
+    "config_set": (CONFIG_SET, ("bot_cfg", "{}")),
+    "portfolio_lines": (PORTFOLIO_LINES, ()),
+    "portfolio_rounds": (PORTFOLIO_ROUNDS, ()),
+    "summary_roi": (SUMMARY_SQL.format(best="best_k_roi"), ()),
+    "summary_lai": (SUMMARY_SQL.format(best="best_k_profit"), ()),
+    "rounds_in": (rounds_in(2), (1, 2)),
+}
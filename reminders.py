@@ -0,0 +1,140 @@
+import asyncio, heapq, itertools, logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("huibot.reminders")
+
+ISO_FMT = "%Y-%m-%d"
+RETRY_LATER = timedelta(minutes=15)   # chưa có report_chat_id / gửi lỗi
+RESYNC_EVERY = timedelta(days=1)      # nạp lại lịch (đổi giờ từ instance khác)
+
+def next_fire(line, now: datetime):
+    """Thời điểm nhắc kế tiếp của dây: ngày của kỳ k gần nhất (>= hôm nay) lúc HH:MM.
+
+    Nhắc của hôm nay bị lỡ giờ (instance khởi động muộn) vẫn được gửi ngay,
+    trừ khi last_remind_iso cho thấy đã gửi rồi. None khi dây đã đóng/hết kỳ.
+    """
+    if line.get("status") == "CLOSED":
+        return None
+    start = datetime.strptime(str(line["start_date"]), ISO_FMT)
+    period, legs = int(line["period_days"]), int(line["legs"])
+    hh, mm = int(line.get("remind_hour") or 0), int(line.get("remind_min") or 0)
+    today = datetime(now.year, now.month, now.day)
+    days = (today - start).days
+    k = 1 if days <= 0 else -(-days // period) + 1
+    last = line.get("last_remind_iso")
+    while k <= legs:
+        d = start + timedelta(days=(k-1)*period)
+        if d.strftime(ISO_FMT) != last:
+            return d.replace(hour=hh, minute=mm), k
+        k += 1
+    return None
+
+class ReminderScheduler:
+    """Min-heap of the next reminder per open line, run on the bot event loop.
+
+    The task sleeps until the earliest entry is due (or a reschedule makes an
+    earlier one), so cost is O(log n) per line change rather than a periodic
+    scan. Sending is guarded by a compare-and-set on last_remind_iso, so when
+    several instances share the DB only one of them sends each reminder.
+
+    `repo` is the storage backend (repo.Repository); `send(line, k)` is an
+    async callable returning True when delivered.
+    """
+
+    def __init__(self, repo, send, now=datetime.now):
+        self._repo = repo
+        self._send = send
+        self._now = now
+        self._heap = []          # (fire_at, line_id, gen)
+        self._gen = {}           # line_id -> current gen; stale heap entries are skipped
+        self._gens = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self.sent = self.skipped = 0
+
+    def __len__(self):
+        return len(self._gen)
+
+    def schedule(self, line, at: datetime = None):
+        lid = int(line["id"])
+        if at is None:
+            nf = next_fire(line, self._now())
+            if nf is None:
+                return self.cancel(lid)
+            at = nf[0]
+        gen = next(self._gens)
+        self._gen[lid] = gen
+        if not self._heap or at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (at, lid, gen))
+        if len(self._heap) > 2 * len(self._gen) + 64:   # dọn các mục đã bị thay thế
+            self._heap = [e for e in self._heap if self._gen.get(e[1]) == e[2]]
+            heapq.heapify(self._heap)
+
+    def cancel(self, line_id: int):
+        self._gen.pop(int(line_id), None)
+
+    async def load_all(self):
+        self._heap.clear(); self._gen.clear()
+        for line in await self._repo.open_lines():
+            self.schedule(line)
+        logger.info("reminders: %d open lines scheduled", len(self._gen))
+
+    async def _fire(self, line_id: int):
+        line = await self._repo.load_line(line_id)
+        if not line:
+            return self.cancel(line_id)
+        now = self._now()
+        nf = next_fire(line, now)
+        if nf is None:
+            return self.cancel(line_id)
+        at, k = nf
+        if at > now:                       # giờ nhắc đã đổi (ở instance khác)
+            return self.schedule(line, at)
+        day_iso = at.strftime(ISO_FMT)
+        prev = line.get("last_remind_iso")
+        if not await self._repo.claim_reminder(line_id, day_iso):
+            self.skipped += 1
+        else:
+            try:
+                ok = await self._send({**line, "last_remind_iso": day_iso}, k)
+            except Exception:
+                logger.exception("reminder send failed for line %s", line_id)
+                ok = False
+            if not ok:
+                await self._repo.release_reminder(line_id, day_iso, prev)
+                return self.schedule(line, now + RETRY_LATER)
+            self.sent += 1
+        self.schedule({**line, "last_remind_iso": day_iso})
+
+    async def run(self):
+        await self.load_all()
+        resync_at = self._now() + RESYNC_EVERY
+        while True:
+            now = self._now()
+            if now >= resync_at:
+                await self.load_all()
+                resync_at = now + RESYNC_EVERY
+            while self._heap and self._heap[0][0] <= now:
+                at, lid, gen = heapq.heappop(self._heap)
+                if self._gen.get(lid) != gen:
+                    continue
+                del self._gen[lid]
+                try:
+                    await self._fire(lid)
+                except Exception:
+                    logger.exception("reminder for line %s failed", lid)
+            self._wakeup.clear()
+            until = min(self._heap[0][0], resync_at) if self._heap else resync_at
+            timeout = max(0.0, (until - self._now()).total_seconds())
+            try:
+                # asyncio.timeout (not wait_for): a cancel arriving together with
+                # a wakeup must not be swallowed
+                async with asyncio.timeout(timeout):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        nxt = self._heap[0][0].isoformat() if self._heap else None
+        return {"lines": len(self._gen), "heap": len(self._heap),
+                "next": nxt, "sent": self.sent, "skipped": self.skipped}
@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+
+class RenderCache:
+    """Bounded LRU of rendered replies (/tomtat, /hottot).
+
+    One slot per (line_id, cmd, metric) holding the text rendered for a
+    (line version, date). Write paths bump the line's version in LineCache,
+    so a stale slot simply stops matching and is overwritten on the next
+    render; the date in the key covers day rollover (kỳ hiện tại, nợ, ...).
+    maxsize=0 disables it (put() keeps nothing).
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # (line_id, cmd, metric) -> (version, day, text)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, line_id: int, version, cmd: str, metric: str, day: str):
+        key = (line_id, cmd, metric)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and e[0] == version and e[1] == day:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return e[2]
+            self.misses += 1
+        return None
+
+    def put(self, line_id: int, version, cmd: str, metric: str, day: str, text: str):
+        if not self.maxsize:
+            return text
+        key = (line_id, cmd, metric)
+        with self._lock:
+            self._entries[key] = (version, day, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return text
+
+    def invalidate(self, line_id: int = None):
+        with self._lock:
+            if line_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == line_id]:
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
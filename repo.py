@@ -0,0 +1,528 @@
+"""Storage backends behind one async interface.
+
+`get_repository()` picks the backend: DATABASE_URL set → SQLAlchemyRepository
+(Postgres via asyncpg, shared by all Cloud Run instances); otherwise
+SQLiteRepository on DB_PATH (local file, db_sqlite helpers).
+"""
+import os, json, time, sqlite3
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import db_sqlite
+import ledger
+import line_stats
+import portfolio
+import queries
+import write_coalescer
+from queries import LIST_COLS
+
+# export: table -> (columns, line column, date column, order); order = PK, so rows stream without a sort
+EXPORT_TABLES = {
+    "lines": (("id", "name", "period_days", "start_date", "legs", "contrib", "bid_type", "bid_value", "status",
+               "base_rate", "cap_rate", "thau_rate", "remind_hour", "remind_min", "last_remind_iso"),
+              "id", "start_date", ("id",)),
+    "rounds": (("line_id", "k", "bid", "round_date"), "line_id", "round_date", ("line_id", "k")),
+    "payments": (("id", "line_id", "pay_date", "amount"), "line_id", "pay_date", ("id",)),
+}
+EXPORT_CHUNK = 1000
+
+class Repository(ABC):
+    """Every data operation app.py needs. Rows are plain dicts keyed by column."""
+
+    name = "base"
+    shared = False      # True: other instances write to the same DB (per-process caches go stale)
+
+    async def init(self):
+        """Create missing tables."""
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def create_line(self, name, period_days, start_date, legs, contrib,
+                          base_rate, cap_rate, thau_rate) -> int: ...
+
+    @abstractmethod
+    async def upsert_round(self, line, k: int, bid: int, round_date: Optional[str], bids: dict = None):
+        """Insert/replace bid of kỳ k and refresh line_stats in the same transaction.
+
+        `bids` is the line's full {k: bid} map *after* this write when the caller
+        already has it (line cache); otherwise it is read inside the transaction.
+        Shared backends always re-read it there, under a lock on the line row.
+        """
+
+    @abstractmethod
+    async def upsert_rounds(self, line, rows: list, bids: dict):
+        """Bulk form of upsert_round: rows = [(k, bid, round_date)], one statement, one transaction.
+
+        `bids` is the line's full {k: bid} map after the import (for line_stats);
+        shared backends re-read it as in upsert_round.
+        """
+
+    @abstractmethod
+    async def load_line(self, line_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def load_bids(self, line_id: int) -> dict: ...
+
+    @abstractmethod
+    async def update_line(self, line_id: int, **fields) -> int: ...
+
+    @abstractmethod
+    async def list_lines(self, status: Optional[str] = None, weekly: Optional[bool] = None,
+                         before_id: Optional[int] = None, limit: int = 25) -> list: ...
+
+    @abstractmethod
+    async def open_lines(self) -> list: ...
+
+    @abstractmethod
+    async def portfolio_rows(self):
+        """([(id, name, legs, contrib, thau_rate)] by id, [(line_id, k, bid)]) for open lines."""
+
+    @abstractmethod
+    async def portfolio_summary(self, metric: str = "roi"):
+        """portfolio.load_summary(metric) rows for open lines: line_stats + 3 rounds lookups per line."""
+
+    @abstractmethod
+    async def claim_reminder(self, line_id: int, day_iso: str) -> bool: ...
+
+    @abstractmethod
+    async def release_reminder(self, line_id: int, day_iso: str, prev: Optional[str]): ...
+
+    @abstractmethod
+    async def claim_update(self, update_id: int, lease: int) -> Optional[bool]:
+        """Claim a Telegram update_id for processing → True; False if it was already processed;
+        None if another instance claimed it less than `lease` seconds ago and has not finished."""
+
+    @abstractmethod
+    async def finish_update(self, update_id: int):
+        """Mark a claimed update_id as processed."""
+
+    @abstractmethod
+    async def release_update(self, update_id: int):
+        """Drop an unfinished claim (processing failed) so a redelivery is processed."""
+
+    @abstractmethod
+    async def prune_updates(self, below_id: int) -> int:
+        """Forget update_ids < below_id → number of rows removed."""
+
+    @abstractmethod
+    async def add_payment(self, line_id: int, amount: int, pay_date: str):
+        """Insert a payment and add it to line_balances in one transaction → (paid_total, n_payments)."""
+
+    @abstractmethod
+    async def balances(self, line_ids=None) -> dict:
+        """{line_id: {paid_total, n_payments, last_pay_date}} for `line_ids` (None = all)."""
+
+    @abstractmethod
+    def export_chunks(self, table: str, line_id: Optional[int] = None,
+                      date_from: Optional[str] = None, date_to: Optional[str] = None, size: int = EXPORT_CHUNK):
+        """Async generator of row-tuple lists (EXPORT_TABLES columns) read through a server-side cursor."""
+
+    @abstractmethod
+    async def cfg_get(self, key, default=None): ...
+
+    @abstractmethod
+    async def cfg_set(self, key, value): ...
+
+# ================= SQLite (db_sqlite) =================
+class SQLiteRepository(Repository):
+    """Sync db_sqlite helpers: reads on the DB thread pool (db_sqlite.run_db),
+    writes group-committed by the writer thread (write_coalescer.run_write)."""
+
+    name = "sqlite"
+
+    def __init__(self):
+        self.db = db_sqlite
+        self._run = db_sqlite.run_db
+        self._write = write_coalescer.run_write
+
+    def _init(self):
+        line_stats.ensure_built(self.db.init_db())
+
+    async def init(self):
+        await self._run(self._init)
+
+    def _create_line(self, name, period_days, start_date, legs, contrib, base_rate, cap_rate, thau_rate):
+        with self.db.transaction():
+            line_id = self.db.insert_and_get_id(
+                "INSERT INTO lines(name,period_days,start_date,legs,contrib,bid_type,bid_value,status,base_rate,cap_rate,thau_rate,remind_hour,remind_min,last_remind_iso) "
+                "VALUES(?,?,?,?,?,'dynamic',0,'OPEN',?,?,?,8,0,NULL)",
+                (name, period_days, start_date, legs, contrib, base_rate, cap_rate, thau_rate))
+            line_stats.save({"id": line_id, "contrib": contrib, "legs": legs, "thau_rate": thau_rate}, {})
+        return line_id
+
+    async def create_line(self, *args):
+        return await self._write(self._create_line, *args)
+
+    def _upsert_round(self, line, k, bid, round_date, bids):
+        line_id = int(line["id"])
+        with self.db.transaction():
+            self.db.exec_sql(queries.ROUND_UPSERT, (line_id, k, bid, round_date))
+            if bids is None:
+                bids = self._load_bids(line_id)
+            line_stats.save(line, bids)
+
+    async def upsert_round(self, line, k, bid, round_date, bids=None):
+        await self._write(self._upsert_round, line, k, bid, round_date, bids)
+
+    def _upsert_rounds(self, line, rows, bids):
+        line_id = int(line["id"])
+        with self.db.transaction() as conn:
+            conn.executemany(queries.ROUND_UPSERT, [(line_id, k, bid, d) for k, bid, d in rows])
+            line_stats.save(line, bids)
+
+    async def upsert_rounds(self, line, rows, bids):
+        await self._write(self._upsert_rounds, line, rows, bids)
+
+    def _load_line(self, line_id):
+        rows = self.db.get_all(queries.LINE_BY_ID, (line_id,))
+        return rows[0] if rows else None
+
+    async def load_line(self, line_id):
+        return await self._run(self._load_line, line_id)
+
+    def _load_bids(self, line_id):
+        rows = self.db.get_all(queries.BIDS_OF_LINE, (line_id,))
+        return {int(r["k"]): int(r["bid"]) for r in rows}
+
+    async def load_bids(self, line_id):
+        return await self._run(self._load_bids, line_id)
+
+    async def update_line(self, line_id, **fields):
+        cols = ", ".join(f"{c}=?" for c in fields)
+        return await self._write(self.db.exec_sql, f"UPDATE lines SET {cols} WHERE id=?", (*fields.values(), line_id))
+
+    async def list_lines(self, status=None, weekly=None, before_id=None, limit=25):
+        return await self.db.aget_all(*queries.list_lines(status, weekly, before_id, limit))
+
+    async def open_lines(self):
+        return await self.db.aget_all(queries.OPEN_LINES)
+
+    async def portfolio_rows(self):
+        return await self._run(portfolio.load_open)
+
+    async def portfolio_summary(self, metric="roi"):
+        return await self._run(portfolio.load_summary, metric)
+
+    async def claim_reminder(self, line_id, day_iso):
+        # CAS: chỉ một instance đổi được last_remind_iso sang ngày hôm nay
+        return await self._write(self.db.exec_sql, queries.CLAIM_REMINDER, (day_iso, line_id, day_iso)) == 1
+
+    async def release_reminder(self, line_id, day_iso, prev):
+        await self._write(self.db.exec_sql, queries.RELEASE_REMINDER, (prev, line_id, day_iso))
+
+    def _claim_update(self, update_id, lease):
+        now = int(time.time())
+        if self.db.exec_sql(queries.CLAIM_UPDATE, (update_id, now, now - lease)):
+            return True
+        done = self.db.get_all(queries.UPDATE_DONE, (update_id,))[0]["done"]
+        return False if done else None
+
+    async def claim_update(self, update_id, lease):
+        return await self._write(self._claim_update, update_id, lease)
+
+    async def finish_update(self, update_id):
+        await self._write(self.db.exec_sql, queries.FINISH_UPDATE, (update_id,))
+
+    async def release_update(self, update_id):
+        await self._write(self.db.exec_sql, queries.RELEASE_UPDATE, (update_id,))
+
+    async def prune_updates(self, below_id):
+        return await self._write(self.db.exec_sql, queries.PRUNE_UPDATES, (below_id,))
+
+    async def add_payment(self, line_id, amount, pay_date):
+        return await self._write(ledger.add_payment, line_id, amount, pay_date)
+
+    async def balances(self, line_ids=None):
+        return await self._run(ledger.balances, line_ids)
+
+    async def export_chunks(self, table, line_id=None, date_from=None, date_to=None, size=EXPORT_CHUNK):
+        cols, line_col, date_col, order = EXPORT_TABLES[table]
+        where, params = [], []
+        if line_id is not None: where.append(f"{line_col}=?"); params.append(line_id)
+        if date_from: where.append(f"{date_col}>=?"); params.append(date_from)
+        if date_to: where.append(f"{date_col}<=?"); params.append(date_to)
+        q = (f"SELECT {','.join(cols)} FROM {table}" + (" WHERE " + " AND ".join(where) if where else "")
+             + f" ORDER BY {','.join(order)}")
+        # Kết nối riêng chỉ đọc: cursor sống suốt lượt tải, mỗi lần fetchmany chạy trên DB pool
+        conn = await self._run(lambda: sqlite3.connect(f"file:{self.db.DB_PATH}?mode=ro", uri=True,
+                                                       check_same_thread=False))
+        try:
+            cur = await self._run(conn.execute, q, params)
+            while True:
+                rows = await self._run(cur.fetchmany, size)
+                if not rows: break
+                yield rows
+        finally:
+            await self._run(conn.close)
+
+    async def cfg_get(self, key, default=None):
+        return await self._run(self.db.cfg_get, key, default)
+
+    async def cfg_set(self, key, value):
+        await self._write(self.db.cfg_set, key, value)
+
+# ================= SQLAlchemy (async engine from db.py) =================
+class SQLAlchemyRepository(Repository):
+    name = "sqlalchemy"
+    shared = True
+
+    def __init__(self, db_url: Optional[str] = None):
+        import db as sa_db
+        self.sa = sa_db
+        self.db_url = db_url
+        self.engine = None
+
+    async def init(self):
+        await self.sa.init_engine(self.db_url)
+        self.engine = await self.sa.get_engine()
+        await self.sa.run_migrations()          # RuntimeError nếu DB mới hơn code
+
+    async def close(self):
+        await self.sa.dispose_engine()
+
+    def _insert(self, model):
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(model)
+
+    async def create_line(self, name, period_days, start_date, legs, contrib, base_rate, cap_rate, thau_rate):
+        from sqlalchemy import insert
+        L = self.sa.Line
+        async with self.engine.begin() as conn:
+            res = await conn.execute(insert(L).values(
+                name=name, period_days=period_days, start_date=start_date, legs=legs, contrib=contrib,
+                bid_type="dynamic", bid_value=0, status="OPEN", base_rate=base_rate, cap_rate=cap_rate,
+                thau_rate=thau_rate, remind_hour=8, remind_min=0, last_remind_iso=None).returning(L.id))
+            line_id = res.scalar_one()
+            await self._save_stats(conn, {"id": line_id, "contrib": contrib, "legs": legs, "thau_rate": thau_rate}, {})
+        return line_id
+
+    async def _save_stats(self, conn, line, bids):
+        from datetime import datetime
+        st = line_stats.compute(line, bids)
+        st["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        stmt = self._insert(self.sa.LineStat).values(line_id=int(line["id"]), **st)
+        await conn.execute(stmt.on_conflict_do_update(index_elements=["line_id"], set_=st))
+
+    async def _lock_line(self, conn, line_id):
+        # Khoá dòng lines (Postgres: FOR UPDATE) tới hết transaction: ghi thăm của các instance
+        # khác vào cùng dây phải chờ, nên line_stats luôn tính từ thăm đã commit mới nhất.
+        from sqlalchemy import select
+        L = self.sa.Line
+        await conn.execute(select(L.id).where(L.id == line_id).with_for_update())
+
+    async def _bids_in(self, conn, line_id):
+        from sqlalchemy import select
+        R = self.sa.Round
+        return {int(r.k): int(r.bid) for r in await conn.execute(select(R.k, R.bid).where(R.line_id == line_id))}
+
+    async def upsert_round(self, line, k, bid, round_date, bids=None):
+        # DB dùng chung: `bids` của caller có thể đã cũ (instance khác vừa ghi) → luôn đọc lại
+        R = self.sa.Round
+        line_id = int(line["id"])
+        async with self.engine.begin() as conn:
+            await self._lock_line(conn, line_id)
+            stmt = self._insert(R).values(line_id=line_id, k=k, bid=bid, round_date=round_date)
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=["line_id", "k"], set_={"bid": bid, "round_date": round_date}))
+            await self._save_stats(conn, line, await self._bids_in(conn, line_id))
+
+    async def upsert_rounds(self, line, rows, bids):
+        R = self.sa.Round
+        line_id = int(line["id"])
+        async with self.engine.begin() as conn:
+            await self._lock_line(conn, line_id)
+            stmt = self._insert(R)
+            stmt = stmt.on_conflict_do_update(index_elements=["line_id", "k"],
+                                              set_={"bid": stmt.excluded.bid, "round_date": stmt.excluded.round_date})
+            if rows:
+                await conn.execute(stmt, [{"line_id": line_id, "k": k, "bid": b, "round_date": d} for k, b, d in rows])
+            await self._save_stats(conn, line, await self._bids_in(conn, line_id))
+
+    async def load_line(self, line_id):
+        from sqlalchemy import select
+        L = self.sa.Line
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(L.__table__).where(L.id == line_id))).first()
+        return dict(row._mapping) if row else None
+
+    async def load_bids(self, line_id):
+        from sqlalchemy import select
+        R = self.sa.Round
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(select(R.k, R.bid).where(R.line_id == line_id).order_by(R.k))
+            return {int(r.k): int(r.bid) for r in rows}
+
+    async def update_line(self, line_id, **fields):
+        from sqlalchemy import update
+        L = self.sa.Line
+        async with self.engine.begin() as conn:
+            res = await conn.execute(update(L).where(L.id == line_id).values(**fields))
+            return res.rowcount
+
+    async def list_lines(self, status=None, weekly=None, before_id=None, limit=25):
+        from sqlalchemy import select
+        L = self.sa.Line
+        q = select(*(getattr(L, c) for c in LIST_COLS))
+        if status: q = q.where(L.status == status)
+        if weekly is True: q = q.where(L.period_days == 7)
+        elif weekly is False: q = q.where(L.period_days != 7)
+        if before_id is not None: q = q.where(L.id < before_id)
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(q.order_by(L.id.desc()).limit(limit))
+            return [dict(r._mapping) for r in rows]
+
+    async def open_lines(self):
+        from sqlalchemy import select
+        L = self.sa.Line
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(select(L.__table__).where(L.status == "OPEN"))
+            return [dict(r._mapping) for r in rows]
+
+    async def portfolio_rows(self):
+        from sqlalchemy import select
+        L, R = self.sa.Line, self.sa.Round
+        async with self.engine.connect() as conn:
+            lines = (await conn.execute(
+                select(L.id, L.name, L.legs, L.contrib, L.thau_rate)
+                .where(L.status == "OPEN", L.legs > 0).order_by(L.id))).all()
+            rounds = (await conn.execute(
+                select(R.line_id, R.k, R.bid).join(L, L.id == R.line_id)
+                .where(L.status == "OPEN", L.legs > 0))).all()
+        return [tuple(r) for r in lines], [tuple(r) for r in rounds]
+
+    async def portfolio_summary(self, metric="roi"):
+        from sqlalchemy import select, func
+        L, R, S = self.sa.Line, self.sa.Round, self.sa.LineStat
+        best = getattr(S, portfolio.best_col(metric))
+        bid_at = lambda k: select(R.bid).where(R.line_id == L.id, R.k == k).scalar_subquery()
+        pre = select(func.coalesce(func.sum(R.bid), 0)).where(
+            R.line_id == L.id, R.k >= 1, R.k < best).scalar_subquery()
+        async with self.engine.connect() as conn:
+            rows = [tuple(r) for r in (await conn.execute(
+                select(L.id, L.name, L.legs, L.contrib, L.thau_rate, S.k_now, S.paid_cum, best,
+                       bid_at(S.k_now), bid_at(best), pre)
+                .outerjoin(S, S.line_id == L.id)
+                .where(L.status == "OPEN", L.legs > 0).order_by(L.id))).all()]
+            missing = [r[0] for r in rows if r[5] is None]
+            bids = {}
+            if missing:
+                for lid, k, b in (await conn.execute(
+                        select(R.line_id, R.k, R.bid).where(R.line_id.in_(missing)))).all():
+                    bids.setdefault(lid, {})[k] = b
+        return rows, bids
+
+    async def claim_reminder(self, line_id, day_iso):
+        from sqlalchemy import update, or_
+        L = self.sa.Line
+        async with self.engine.begin() as conn:
+            res = await conn.execute(
+                update(L).where(L.id == line_id, L.status == "OPEN",
+                                or_(L.last_remind_iso.is_(None), L.last_remind_iso != day_iso))
+                .values(last_remind_iso=day_iso))
+            return res.rowcount == 1
+
+    async def release_reminder(self, line_id, day_iso, prev):
+        from sqlalchemy import update
+        L = self.sa.Line
+        async with self.engine.begin() as conn:
+            await conn.execute(update(L).where(L.id == line_id, L.last_remind_iso == day_iso)
+                               .values(last_remind_iso=prev))
+
+    async def claim_update(self, update_id, lease):
+        from sqlalchemy import select
+        S = self.sa.SeenUpdate
+        now = int(time.time())
+        ins = self._insert(S).values(update_id=update_id, seen_at=now, done=0)
+        async with self.engine.begin() as conn:
+            res = await conn.execute(ins.on_conflict_do_update(
+                index_elements=["update_id"], set_={"seen_at": ins.excluded.seen_at},
+                where=(S.done == 0) & (S.seen_at < now - lease)))
+            if res.rowcount == 1:
+                return True
+            return False if (await conn.execute(select(S.done).where(S.update_id == update_id))).scalar() else None
+
+    async def finish_update(self, update_id):
+        from sqlalchemy import update
+        S = self.sa.SeenUpdate
+        async with self.engine.begin() as conn:
+            await conn.execute(update(S).where(S.update_id == update_id).values(done=1))
+
+    async def release_update(self, update_id):
+        from sqlalchemy import delete
+        S = self.sa.SeenUpdate
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(S).where(S.update_id == update_id, S.done == 0))
+
+    async def prune_updates(self, below_id):
+        from sqlalchemy import delete
+        S = self.sa.SeenUpdate
+        async with self.engine.begin() as conn:
+            return (await conn.execute(delete(S).where(S.update_id < below_id))).rowcount
+
+    async def add_payment(self, line_id, amount, pay_date):
+        from sqlalchemy import insert, select, case, or_
+        from datetime import datetime
+        P, B = self.sa.Payment, self.sa.LineBalance
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(P).values(line_id=line_id, pay_date=pay_date, amount=amount))
+            stmt = self._insert(B).values(line_id=line_id, paid_total=amount, n_payments=1, last_pay_date=pay_date,
+                                          updated_at=datetime.now().isoformat(timespec="seconds"))
+            await conn.execute(stmt.on_conflict_do_update(index_elements=["line_id"], set_={
+                "paid_total": B.paid_total + stmt.excluded.paid_total,
+                "n_payments": B.n_payments + 1,
+                "last_pay_date": case((or_(B.last_pay_date.is_(None), stmt.excluded.last_pay_date > B.last_pay_date),
+                                       stmt.excluded.last_pay_date), else_=B.last_pay_date),
+                "updated_at": stmt.excluded.updated_at}))
+            row = (await conn.execute(select(B.paid_total, B.n_payments).where(B.line_id == line_id))).one()
+        return int(row.paid_total), int(row.n_payments)
+
+    async def balances(self, line_ids=None):
+        from sqlalchemy import select
+        B = self.sa.LineBalance
+        q = select(B.line_id, B.paid_total, B.n_payments, B.last_pay_date)
+        if line_ids is not None:
+            q = q.where(B.line_id.in_([int(i) for i in line_ids]))
+        async with self.engine.connect() as conn:
+            return {int(r.line_id): dict(r._mapping) for r in await conn.execute(q)}
+
+    async def cfg_get(self, key, default=None):
+        from sqlalchemy import select
+        C = self.sa.ConfigEntry
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(C.value).where(C.key == key))).first()
+        if not row: return default
+        try:
+            return json.loads(row.value)
+        except Exception:
+            return default
+
+    async def export_chunks(self, table, line_id=None, date_from=None, date_to=None, size=EXPORT_CHUNK):
+        from sqlalchemy import select
+        cols, line_col, date_col, order = EXPORT_TABLES[table]
+        t = self.sa.Base.metadata.tables[table]
+        q = select(*(t.c[c] for c in cols)).order_by(*(t.c[c] for c in order))
+        if line_id is not None: q = q.where(t.c[line_col] == line_id)
+        if date_from: q = q.where(t.c[date_col] >= date_from)
+        if date_to: q = q.where(t.c[date_col] <= date_to)
+        async with self.engine.connect() as conn:
+            result = await conn.stream(q.execution_options(yield_per=size))
+            async for part in result.partitions(size):
+                yield [tuple(r) for r in part]
+
+    async def cfg_set(self, key, value):
+        C = self.sa.ConfigEntry
+        v = json.dumps(value)
+        async with self.engine.begin() as conn:
+            stmt = self._insert(C).values(key=key, value=v)
+            await conn.execute(stmt.on_conflict_do_update(index_elements=["key"], set_={"value": v}))
+
+def get_repository() -> Repository:
+    db_url = (os.environ.get("DATABASE_URL") or "").strip()
+    if db_url:
+        return SQLAlchemyRepository(db_url)
+    return SQLiteRepository()
@@ -0,0 +1,110 @@
+import asyncio, logging
+
+logger = logging.getLogger("huibot.shards")
+
+class ShardedRunner:
+    """Runs updates on `workers` tasks of the bot loop, sharded by key (chat id).
+
+    An update goes to worker hash(key) % workers and each worker handles its
+    shard in arrival order, so updates of one chat never overtake each other
+    while different chats run concurrently (at most `workers` at a time). A full
+    shard (`shard_max`) makes put() wait, which backs up the webhook queue.
+    """
+
+    def __init__(self, handler, workers: int = 8, shard_max: int = 100):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.shard_max = shard_max
+        self._queues = None
+        self._tasks = []
+        self.processed = self.failed = self.busy = self.max_busy = 0
+
+    def start(self):
+        """Create the worker tasks (call on the bot loop)."""
+        self._queues = [asyncio.Queue(self.shard_max) for _ in range(self.workers)]
+        self._tasks = [asyncio.get_running_loop().create_task(self._work(q), name=f"shard-{i}")
+                       for i, q in enumerate(self._queues)]
+
+    async def put(self, key, item) -> asyncio.Future:
+        """Queue `item` on its shard; the future resolves when the handler is done."""
+        if self._queues is None:
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_retrieved)     # queue mode không chờ kết quả; lỗi đã được log
+        await self._queues[hash(key) % self.workers].put((item, fut))
+        return fut
+
+    async def run(self, key, item):
+        """Queue `item` and wait for it (webhook sync mode)."""
+        return await (await self.put(key, item))
+
+    async def _work(self, q: asyncio.Queue):
+        while True:
+            item, fut = await q.get()
+            self.busy += 1
+            if self.busy > self.max_busy: self.max_busy = self.busy
+            try:
+                res = await self.handler(item)
+            except Exception as e:
+                self.failed += 1
+                logger.exception("update failed in shard")
+                if not fut.done(): fut.set_exception(e)
+            else:
+                if not fut.done(): fut.set_result(res)
+            finally:
+                self.busy -= 1
+                self.processed += 1
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self._queues] if self._queues else []
+        return {"workers": self.workers, "shard_max": self.shard_max, "pending": sum(depths),
+                "max_shard_depth": max(depths, default=0), "busy": self.busy, "max_busy": self.max_busy,
+                "processed": self.processed, "failed": self.failed}
+
+def _retrieved(fut):
+    if not fut.cancelled(): fut.exception()
+
+class KeyedLocks:
+    """One asyncio.Lock per key (line_id), dropped when nobody holds or waits for it.
+
+        async with line_locks(line_id): ...   # đọc-sửa-ghi thăm của một dây
+    """
+
+    def __init__(self):
+        self._locks = {}          # key -> [lock, users]
+        self.waits = 0
+
+    def __call__(self, key):
+        return _Held(self, key)
+
+    def __len__(self):
+        return len(self._locks)
+
+class _Held:
+    __slots__ = ("owner", "key", "entry")
+
+    def __init__(self, owner: KeyedLocks, key):
+        self.owner, self.key = owner, key
+
+    async def __aenter__(self):
+        e = self.owner._locks.get(self.key)
+        if e is None:
+            e = self.owner._locks[self.key] = [asyncio.Lock(), 0]
+        e[1] += 1
+        self.entry = e
+        if e[0].locked(): self.owner.waits += 1
+        try:
+            await e[0].acquire()
+        except BaseException:
+            self._drop()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.entry[0].release()
+        self._drop()
+
+    def _drop(self):
+        e = self.entry
+        e[1] -= 1
+        if e[1] == 0 and self.owner._locks.get(self.key) is e:
+            del self.owner._locks[self.key]
@@ -1,82 +1,193 @@
-import sqlite3
-from google.cloud import firestore
+"""Chuyển dữ liệu SQLite (db_sqlite.py) sang Firestore — đọc luồng, ghi theo lô, chạy tiếp được.
+
+    python sqlite_to_firestore.py [db/hui.db] [--batch 400] [--concurrency 4]
+                                  [--checkpoint migrate.ckpt.json] [--tables lines,rounds,payments,config]
+
+- lines    → lines/{id}
+- rounds   → lines/{line_id}/rounds/{k}
+- payments → payments/{id}
+- config   → config/{key}   (value đã json.loads)
+
+Mỗi bảng được đọc theo khoá chính (fetchmany), ghi bằng WriteBatch (≤ 500 thao tác),
+tối đa `concurrency` batch cùng lúc. Checkpoint lưu khoá cuối cùng đã commit liên tục,
+nên chạy lại sẽ tiếp từ đó; ghi lại một document là idempotent (set).
+Đặt FIRESTORE_EMULATOR_HOST=localhost:8080 để chạy với emulator.
+"""
+import os, sys, json, time, sqlite3, argparse, logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-db = firestore.Client()
+logger = logging.getLogger("huibot.migrate")
 
-def migrate(sqlite_path="db/hui.db"):
-    conn = sqlite3.connect(sqlite_path)
-    cur = conn.cursor()
+MAX_BATCH = 500          # giới hạn của Firestore WriteBatch
+RETRIES = 3
 
-    # Adjust these queries to match your real schema.
+def _date(s):
     try:
-        cur.execute("SELECT id, name, telegram_id, phone, notes, created_at FROM members")
-        for rid, name, tg_id, phone, notes, created_at in cur.fetchall():
-            doc = {
-                "name": name,
-                "telegram_id": str(tg_id) if tg_id is not None else None,
-                "phone": phone,
-                "notes": notes,
-                "created_at": datetime.fromisoformat(created_at) if created_at else firestore.SERVER_TIMESTAMP,
-            }
-            db.collection("members").document(str(rid)).set(doc)
-    except Exception:
-        pass
+        return datetime.fromisoformat(s) if s else None
+    except ValueError:
+        logger.warning("ngày không đúng ISO, giữ nguyên chuỗi: %r", s)
+        return s
 
+def _json(s):
     try:
-        cur.execute("""SELECT id, title, type, start_date, slots, face_value, floor_pct, cap_pct, bid_pct, status, created_at
-                       FROM pools""")
-        for (pid, title, typ, start_date, slots, face_value, floor_pct, cap_pct, bid_pct, status, created_at) in cur.fetchall():
-            doc = {
-                "title": title,
-                "type": typ,
-                "start_date": datetime.fromisoformat(start_date) if start_date else None,
-                "slots": slots,
-                "face_value": face_value,
-                "floor_pct": float(floor_pct) if floor_pct is not None else None,
-                "cap_pct": float(cap_pct) if cap_pct is not None else None,
-                "bid_pct": float(bid_pct) if bid_pct is not None else None,
-                "status": status or "open",
-                "created_at": datetime.fromisoformat(created_at) if created_at else firestore.SERVER_TIMESTAMP,
-            }
-            db.collection("pools").document(str(pid)).set(doc)
+        return json.loads(s)
     except Exception:
-        pass
+        return s
 
-    try:
-        cur.execute("""SELECT id, pool_id, round_order, date, winner_member_id, bid_pct, amount_due, paid
-                       FROM rounds""")
-        for (rid, pool_id, order, date, winner_member_id, bid_pct, amount_due, paid) in cur.fetchall():
-            doc = {
-                "order": order,
-                "date": datetime.fromisoformat(date) if date else None,
-                "winner_member_id": str(winner_member_id) if winner_member_id else None,
-                "bid_pct": float(bid_pct) if bid_pct is not None else None,
-                "amount_due": amount_due,
-                "paid": bool(paid),
-            }
-            db.collection("pools").document(str(pool_id)) \                  .collection("rounds").document(str(rid)).set(doc)
-    except Exception:
-        pass
+# table -> (key columns, SELECT (không có WHERE/ORDER), row -> (path segments, doc))
+TABLES = {
+    "lines": (("id",),
+              "SELECT id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+              "base_rate,cap_rate,thau_rate,remind_hour,remind_min,last_remind_iso FROM lines",
+              lambda r: (("lines", str(r["id"])), {
+                  "name": r["name"], "period_days": r["period_days"], "start_date": _date(r["start_date"]),
+                  "legs": r["legs"], "contrib": r["contrib"], "bid_type": r["bid_type"],
+                  "bid_value": r["bid_value"], "status": r["status"] or "OPEN",
+                  "base_rate": r["base_rate"], "cap_rate": r["cap_rate"], "thau_rate": r["thau_rate"],
+                  "remind_hour": r["remind_hour"], "remind_min": r["remind_min"],
+                  "last_remind_iso": r["last_remind_iso"]})),
+    "rounds": (("line_id", "k"),
+               "SELECT line_id,k,bid,round_date FROM rounds",
+               lambda r: (("lines", str(r["line_id"]), "rounds", str(r["k"])), {
+                   "k": r["k"], "bid": r["bid"], "round_date": _date(r["round_date"])})),
+    "payments": (("id",),
+                 "SELECT id,line_id,pay_date,amount FROM payments",
+                 lambda r: (("payments", str(r["id"])), {
+                     "line_id": str(r["line_id"]), "pay_date": _date(r["pay_date"]), "amount": r["amount"]})),
+    "config": (("key",),
+               "SELECT key,value FROM config",
+               lambda r: (("config", str(r["key"])), {"value": _json(r["value"])})),
+}
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def last_key(self, table):
+        return self.state.get(table, {}).get("last_key")
 
+    def done(self, table):
+        return self.state.get(table, {}).get("done", False)
+
+    def save(self, table, last_key=None, done=False):
+        st = self.state.setdefault(table, {})
+        if last_key is not None: st["last_key"] = list(last_key)
+        st["done"] = done
+        if not self.path: return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+def _stream(conn, table):
+    """query(after) → cursor đọc theo khoá chính, bắt đầu sau khoá `after` (checkpoint)."""
+    keys, select, _ = TABLES[table]
+    def query(after):
+        order = ",".join(keys)
+        if after is None:
+            return conn.execute(f"{select} ORDER BY {order}")
+        cond = f"({order}) > ({','.join('?' * len(keys))})"
+        return conn.execute(f"{select} WHERE {cond} ORDER BY {order}", tuple(after))
+    return query, keys
+
+def _commit(client, docs):
+    last_exc = None
+    for attempt in range(RETRIES):
+        try:
+            b = client.batch()
+            for path, doc in docs:
+                b.set(client.document(*path), doc)
+            b.commit()
+            return None
+        except Exception as e:
+            last_exc = e
+            time.sleep(0.5 * 2 ** attempt)
+    return last_exc
+
+def migrate_table(conn, client, table, ckpt, batch=400, concurrency=4, pool=None):
+    if ckpt.done(table):
+        logger.info("%s: đã xong theo checkpoint, bỏ qua", table)
+        return {"table": table, "rows": 0, "errors": 0, "seconds": 0.0, "rows_per_s": 0.0, "skipped": True}
+    query, keys = _stream(conn, table)
+    to_doc = TABLES[table][2]
+    cur = query(ckpt.last_key(table))
+    inflight = deque()          # (last_key, future) theo thứ tự đọc
+    rows = errors = 0
+    stalled = False             # một batch lỗi hẳn: không đẩy checkpoint qua nó nữa
+    t0 = time.perf_counter()
+
+    def drain(block):
+        nonlocal errors, stalled
+        while inflight and (block or inflight[0][1].done()):
+            last_key, fut = inflight.popleft()
+            exc = fut.result()
+            if exc is not None:
+                errors += 1; stalled = True
+                logger.error("%s: batch tới khoá %s lỗi: %s", table, last_key, exc)
+            elif not stalled:
+                ckpt.save(table, last_key)
+            block = block and len(inflight) >= concurrency
+
+    while True:
+        chunk = cur.fetchmany(batch)
+        if not chunk: break
+        docs = [to_doc(r) for r in chunk]
+        last_key = tuple(chunk[-1][k] for k in keys)
+        inflight.append((last_key, pool.submit(_commit, client, docs)))
+        rows += len(chunk)
+        drain(block=len(inflight) >= concurrency)
+    while inflight:
+        drain(block=True)
+    if not stalled:
+        ckpt.save(table, done=True)
+    dt = time.perf_counter() - t0
+    res = {"table": table, "rows": rows, "errors": errors, "seconds": round(dt, 3),
+           "rows_per_s": round(rows / dt, 1) if dt else 0.0}
+    logger.info("%s: %d dòng, %d batch lỗi, %.1f dòng/s", table, rows, errors, res["rows_per_s"])
+    return res
+
+def migrate(sqlite_path="db/hui.db", client=None, tables=tuple(TABLES), batch=400,
+            concurrency=4, checkpoint="migrate.ckpt.json"):
+    if client is None:
+        from google.cloud import firestore
+        client = firestore.Client()
+    batch = max(1, min(batch, MAX_BATCH))
+    conn = sqlite3.connect(sqlite_path)
+    conn.row_factory = sqlite3.Row
+    ckpt = Checkpoint(checkpoint)
+    results = []
     try:
-        cur.execute("""SELECT id, pool_id, round_order, member_id, amount, paid_at, method
-                       FROM payments""")
-        for (pid, pool_id, round_order, member_id, amount, paid_at, method) in cur.fetchall():
-            doc = {
-                "pool_id": str(pool_id),
-                "round_order": round_order,
-                "member_id": str(member_id),
-                "amount": amount,
-                "paid_at": datetime.fromisoformat(paid_at) if paid_at else None,
-                "method": method,
-            }
-            db.collection("payments").document(str(pid)).set(doc)
-    except Exception:
-        pass
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for t in tables:
+                results.append(migrate_table(conn, client, t, ckpt, batch, concurrency, pool))
+    finally:
+        conn.close()
+    return results
 
-    conn.close()
-    print("Migration done.")
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="SQLite → Firestore")
+    ap.add_argument("sqlite_path", nargs="?", default=os.environ.get("DB_PATH", "db/hui.db"))
+    ap.add_argument("--batch", type=int, default=400, help=f"số document mỗi WriteBatch (≤ {MAX_BATCH})")
+    ap.add_argument("--concurrency", type=int, default=4, help="số batch commit song song")
+    ap.add_argument("--checkpoint", default="migrate.ckpt.json", help="file checkpoint ('' = không lưu)")
+    ap.add_argument("--tables", default=",".join(TABLES))
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    tables = [t for t in args.tables.split(",") if t]
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        ap.error(f"bảng không hỗ trợ: {', '.join(sorted(unknown))}")
+    results = migrate(args.sqlite_path, tables=tables, batch=args.batch,
+                      concurrency=args.concurrency, checkpoint=args.checkpoint or None)
+    print(json.dumps(results, indent=2))
+    print("Migration done." if not any(r["errors"] for r in results) else "Migration finished with errors.")
+    return 1 if any(r["errors"] for r in results) else 0
 
 if __name__ == "__main__":
-    migrate()
+    sys.exit(main())
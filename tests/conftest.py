@@ -0,0 +1,33 @@
+"""Test chạy trên DB SQLite tạm (không đụng db/hui.db) và không khởi động bot Telegram."""
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="huitest-"), "hui.db")
+os.environ.pop("DATABASE_URL", None)
+os.environ.update(BOT_TOKEN="", TELEGRAM_TOKEN="", REMINDERS_ENABLED="0", WEBHOOK_SECRET="")
+
+import pytest
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """db_sqlite trên file riêng của test, đã migrate (kết nối của luồng hiện tại)."""
+    import db_sqlite
+    db_sqlite.close_db()
+    monkeypatch.setattr(db_sqlite, "DB_PATH", str(tmp_path / "hui.db"))
+    db_sqlite.init_db()
+    yield db_sqlite
+    db_sqlite.close_db()
+
+@pytest.fixture
+def app_db(fresh_db, monkeypatch):
+    """fresh_db cho cả app: luồng DB và luồng ghi (giữ kết nối theo luồng) tạo mới, cache trống,
+    trả lời không qua outbox."""
+    import app, write_coalescer
+    monkeypatch.setattr(fresh_db, "_executor", None)
+    if write_coalescer.coalescer():
+        monkeypatch.setattr(write_coalescer, "_coalescer", write_coalescer.WriteCoalescer())
+    monkeypatch.setitem(app.app_state, "outbox", None)
+    app.line_cache.invalidate()
+    yield fresh_db
+    if fresh_db._executor: fresh_db._executor.shutdown()
+    app.line_cache.invalidate()
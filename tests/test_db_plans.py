@@ -0,0 +1,23 @@
+"""Truy vấn nóng không được quét cả bảng (EXPLAIN QUERY PLAN trên DB đã migrate)."""
+import inspect
+
+import ledger
+import line_stats
+import portfolio
+import queries
+import repo
+
+def test_hot_queries_use_indexes(fresh_db):
+    assert fresh_db.stored_version() == fresh_db.SCHEMA_VERSION
+    assert fresh_db.full_scans() == {}
+    # mọi trang /danhsach (trang đầu, trang sau, lọc trạng thái/kỳ) đều được kiểm tra
+    assert sum(name.startswith("list_") for name in queries.HOT_QUERIES) == 12
+
+def test_checked_sql_is_the_sql_that_runs():
+    # code chạy hằng trong queries, không chép lại chuỗi SQL
+    for mod in (repo, ledger, line_stats, portfolio):
+        src = inspect.getsource(mod)
+        for sql in ("SELECT * FROM lines WHERE id=?", "INSERT INTO rounds", "UPDATE seen_updates",
+                    "INSERT INTO line_balances", "INSERT INTO line_stats", "WHERE status='OPEN' AND legs>0"):
+            assert sql not in src, (mod.__name__, sql)
+    assert portfolio.SUMMARY_SQL is queries.SUMMARY_SQL
@@ -0,0 +1,179 @@
+"""UpdateDedup: cửa sổ RAM, giữ/nhả/xong trong seen_updates, prune; /webhook nhận cùng update_id hai lần."""
+import asyncio, time
+
+import pytest
+
+import app
+import bench
+from dedup import UpdateDedup
+from repo import SQLAlchemyRepository, SQLiteRepository
+from update_queue import UpdateQueue
+
+def test_window_check_forget_and_eviction():
+    d = UpdateDedup(window=3)
+    assert d.check(1) and not d.check(1)
+    d.forget(1)
+    assert d.check(1)
+    for uid in (2, 3, 4):
+        assert d.check(uid)
+    assert d.check(1)                      # 1 đã ra khỏi cửa sổ 3 id
+    assert not d.check(4)
+    assert d.stats()["dup_memory"] == 2 and d.stats()["size"] == 3
+
+@pytest.fixture(params=["sqlite", "sqlalchemy"])
+def repo(request, app_db, tmp_path):
+    if request.param == "sqlite":
+        yield SQLiteRepository()
+        return
+    pytest.importorskip("aiosqlite")
+    r = SQLAlchemyRepository(f"sqlite+aiosqlite:///{tmp_path / 'sa.db'}")
+    asyncio.run(r.init())
+    yield r
+    asyncio.run(r.close())
+
+def _age(repo, update_id, seconds):
+    """Lùi seen_at của update_id (giả như đã giữ từ `seconds` giây trước)."""
+    async def go():
+        if isinstance(repo, SQLiteRepository):
+            return await repo._write(repo.db.exec_sql, "UPDATE seen_updates SET seen_at=seen_at-? WHERE update_id=?",
+                                     (seconds, update_id))
+        from sqlalchemy import update
+        S = repo.sa.SeenUpdate
+        async with repo.engine.begin() as conn:
+            await conn.execute(update(S).where(S.update_id == update_id).values(seen_at=S.seen_at - seconds))
+    return go()
+
+def test_claim_done_release_and_lease(repo):
+    async def go():
+        a, b = UpdateDedup(repo, lease=60), UpdateDedup(repo, lease=60)     # hai instance
+        assert await a.claim(1) is True
+        assert await b.claim(1) is None                  # a đang xử lý
+        await a.done(1)
+        assert await b.claim(1) is False                 # đã xong
+        await _age(repo, 1, 3600)
+        assert await b.claim(1) is False                 # xong thì hết hạn giữ cũng không nhận lại
+
+        assert await a.claim(2) is True
+        await a.release(2)                               # handler lỗi
+        assert await b.claim(2) is True
+        await b.done(2)
+        await a.release(2)                               # nhả sau khi xong: không xoá
+        assert await a.claim(2) is False
+
+        assert await a.claim(3) is True                  # a chết giữa chừng
+        await _age(repo, 3, 59)
+        assert await b.claim(3) is None
+        await _age(repo, 3, 2)
+        assert await b.claim(3) is True                  # quá hạn giữ: b nhận lại
+        assert await a.claim(3) is None
+        return a.stats(), b.stats()
+    a, b = asyncio.run(go())
+    assert (b["busy"], b["dup_db"], a["busy"], a["dup_db"], a["released"]) == (2, 2, 1, 1, 2)
+
+def test_prune_keeps_newest(app_db):
+    repo = SQLiteRepository()
+    d = UpdateDedup(repo, keep=5, prune_every=4)
+
+    async def go():
+        for uid in range(1, 13):
+            assert await d.claim(uid)
+            await d.done(uid)
+    asyncio.run(go())
+    # prune sau lần nhận thứ 4, 8, 12: giữ id >= max - keep
+    ids = [r["update_id"] for r in app_db.get_all("SELECT update_id FROM seen_updates ORDER BY 1")]
+    assert ids == list(range(7, 13))
+
+def test_db_errors_do_not_drop_updates():
+    class Broken:
+        async def claim_update(self, update_id, lease): raise RuntimeError("db down")
+        async def finish_update(self, update_id): raise RuntimeError("db down")
+        async def release_update(self, update_id): raise RuntimeError("db down")
+
+    d = UpdateDedup(Broken())
+
+    async def go():
+        assert await d.claim(1) is True
+        await d.done(1)
+        await d.release(1)
+    asyncio.run(go())
+    assert d.stats()["db_errors"] == 3
+
+# ----- /webhook: bot thật, Telegram giả (bench._fake_request) -----
+@pytest.fixture
+def bot(app_db, monkeypatch):
+    monkeypatch.setattr(app, "BOT_TOKEN", "123456:test")
+    app.run_bot_background(request=bench._fake_request())
+    assert app.bot_ready.wait(30)
+    monkeypatch.setitem(app.app_state, "queue", None)
+    return app.app.test_client()
+
+@pytest.fixture
+def queue_mode(bot, monkeypatch):
+    q = UpdateQueue(100)
+    q.bind(app.app_state["loop"])
+    task = asyncio.run_coroutine_threadsafe(
+        q.run(lambda u: app.app_state["runner"].put(app.update_key(u), u)), app.app_state["loop"])
+    monkeypatch.setitem(app.app_state, "queue", q)
+    yield bot
+    task.cancel()
+
+def _lines(db, name):
+    return db.get_all("SELECT COUNT(*) n FROM lines WHERE name=?", (name,))[0]["n"]
+
+def _wait_lines(db, name, n, timeout=5):
+    t = time.monotonic() + timeout
+    while _lines(db, name) < n and time.monotonic() < t:
+        time.sleep(0.01)
+    return _lines(db, name)
+
+def _tao(uid, name):
+    return bench._update(uid, 42, f"/tao {name} tuần 02-08-2025 10 2tr 5 50 10")
+
+def _send_twice(client, db, uid, name, wait):
+    body = _tao(uid, name)
+    codes = [client.post("/webhook", json=body).status_code]
+    wait(db, name, 1)
+    codes.append(client.post("/webhook", json=body).status_code)       # cùng instance: cửa sổ RAM
+    app.dedup.forget(uid)
+    codes.append(client.post("/webhook", json=body).status_code)       # instance khác: seen_updates
+    return codes
+
+def test_webhook_sync_same_update_twice(bot, app_db):
+    dup_db = app.dedup.dup_db
+    assert _send_twice(bot, app_db, 7001, "sync", lambda *a: None) == [200, 200, 200]
+    assert _lines(app_db, "sync") == 1
+    assert app.dedup.dup_db == dup_db + 1
+    assert app_db.get_all("SELECT done FROM seen_updates WHERE update_id=7001") == [{"done": 1}]
+
+def test_webhook_queue_same_update_twice(queue_mode, app_db):
+    assert _send_twice(queue_mode, app_db, 7101, "queue", _wait_lines) == [200, 200, 200]
+    time.sleep(0.2)
+    assert _wait_lines(app_db, "queue", 1) == 1
+    t = time.monotonic() + 5
+    while app_db.get_all("SELECT done FROM seen_updates WHERE update_id=7101") != [{"done": 1}]:
+        assert time.monotonic() < t
+        time.sleep(0.01)
+
+def test_webhook_sync_failed_update_is_redelivered(bot, app_db, monkeypatch):
+    reply, sent = app.reply, []
+
+    async def flaky(upd, text, **kw):
+        sent.append(upd.update_id)
+        if len(sent) == 1: raise RuntimeError("telegram down")
+        return await reply(upd, text, **kw)
+    monkeypatch.setattr(app, "reply", flaky)
+    body = bench._update(7201, 42, "/start")
+    assert bot.post("/webhook", json=body).status_code == 500       # handler lỗi: Telegram sẽ gửi lại
+    assert app_db.get_all("SELECT * FROM seen_updates WHERE update_id=7201") == []
+    assert bot.post("/webhook", json=body).status_code == 200
+    assert sent == [7201, 7201]
+    assert app_db.get_all("SELECT done FROM seen_updates WHERE update_id=7201") == [{"done": 1}]
+    assert bot.post("/webhook", json=body).status_code == 200 and len(sent) == 2
+
+def test_webhook_sync_in_progress_elsewhere_asks_for_retry(bot, app_db):
+    # instance khác đã giữ update_id và chưa xong: 503 để Telegram gửi lại sau (phòng nó chết giữa chừng)
+    assert asyncio.run(UpdateDedup(SQLiteRepository()).claim(7301)) is True
+    r = bot.post("/webhook", json=_tao(7301, "busy"))
+    assert r.status_code == 503 and r.headers["Retry-After"]
+    assert _lines(app_db, "busy") == 0
+    assert app.dedup.check(7301)                       # không ghi nhớ trong RAM: lần gửi lại được xét lại
@@ -0,0 +1,105 @@
+"""Sổ đóng tiền: line_balances cộng dồn khớp với rebuild() từ payments; k_due/expected_due ở ranh giới kỳ."""
+import asyncio, random
+from datetime import date, timedelta
+
+import pytest
+
+import ledger
+from repo import SQLAlchemyRepository, SQLiteRepository
+
+def _payments(seed=0, n=300, lines=(1, 2, 3, 7)):
+    rnd = random.Random(seed)
+    day0 = date(2025, 1, 1)
+    # ngày không theo thứ tự ghi (nhập bù) để last_pay_date phải là MAX chứ không phải lần ghi cuối
+    return [(rnd.choice(lines), rnd.randint(1, 50) * 100_000, (day0 + timedelta(days=rnd.randint(0, 200))).isoformat())
+            for _ in range(n)]
+
+def _expected(payments):
+    out = {}
+    for lid, amount, d in payments:
+        b = out.setdefault(lid, {"paid_total": 0, "n_payments": 0, "last_pay_date": ""})
+        b["paid_total"] += amount; b["n_payments"] += 1; b["last_pay_date"] = max(b["last_pay_date"], d)
+    return out
+
+def _fields(bal):
+    return {lid: {f: b[f] for f in ledger.BAL_FIELDS} for lid, b in bal.items()}
+
+@pytest.fixture(params=["sqlite", "sqlalchemy"])
+def repo(request, tmp_path):
+    if request.param == "sqlite":
+        request.getfixturevalue("app_db")
+        yield SQLiteRepository()
+        return
+    pytest.importorskip("aiosqlite")
+    r = SQLAlchemyRepository(f"sqlite+aiosqlite:///{tmp_path / 'sa.db'}")
+    asyncio.run(r.init())
+    yield r
+    asyncio.run(r.close())
+
+def test_incremental_balances_match_payments(repo):
+    pays = _payments()
+
+    async def go():
+        totals = {}
+        # SQLite: đồng thời như nhiều /dongtien cùng lúc (chung lô group commit); aiosqlite thì tuần tự
+        step = 25 if isinstance(repo, SQLiteRepository) else 1
+        for chunk in range(0, len(pays), step):
+            res = await asyncio.gather(*(repo.add_payment(*p) for p in pays[chunk:chunk + step]))
+            for (lid, _, _), (paid, n) in zip(pays[chunk:chunk + step], res):
+                totals[lid] = max(totals.get(lid, (0, 0)), (paid, n))
+        return totals, await repo.balances(), await repo.balances([1, 7, 99])
+    totals, bal, some = asyncio.run(go())
+    want = _expected(pays)
+    assert _fields(bal) == want
+    assert _fields(some) == {1: want[1], 7: want[7]}
+    assert totals == {lid: (b["paid_total"], b["n_payments"]) for lid, b in want.items()}
+    if isinstance(repo, SQLiteRepository):
+        assert ledger.rebuild(check_only=True) == []
+
+def test_rebuild_fixes_drift(fresh_db):
+    pays = _payments(seed=1, n=60)
+    for p in pays:
+        ledger.add_payment(*p)
+    fresh_db.exec_sql("UPDATE line_balances SET paid_total=paid_total+1 WHERE line_id=2")
+    fresh_db.exec_sql("DELETE FROM line_balances WHERE line_id=3")
+    fresh_db.exec_sql("INSERT INTO line_balances(line_id,paid_total,n_payments) VALUES(50,1,1)")
+    drift = dict(ledger.rebuild(check_only=True))
+    assert sorted(drift) == [2, 3, 50]
+    assert drift[2] == {"paid_total": (_expected(pays)[2]["paid_total"] + 1, _expected(pays)[2]["paid_total"])}
+    assert ledger.rebuild() and ledger.rebuild(check_only=True) == []
+    assert _fields(ledger.balances()) == _expected(pays)
+
+# ----- kỳ tới hạn -----
+@pytest.mark.parametrize("period", [7, 30])            # hụi tuần / hụi tháng (30 ngày, như /tao)
+def test_k_due_at_period_boundaries(period):
+    line = {"start_date": "2025-01-31", "period_days": period, "legs": 5, "contrib": 1_000_000}
+    start = date(2025, 1, 31)
+    assert ledger.k_due(line, start - timedelta(days=1)) == 0
+    assert ledger.k_due(line, start) == 1
+    for k in range(2, 6):
+        day_k = start + timedelta(days=(k - 1) * period)
+        assert ledger.k_due(line, day_k - timedelta(days=1)) == k - 1
+        assert ledger.k_due(line, day_k) == k
+    assert ledger.k_due(line, start + timedelta(days=10 * period)) == 5      # không quá số chân
+
+@pytest.mark.parametrize("period", [7, 30])
+def test_expected_due_counts_bids_of_due_periods_only(period):
+    line = {"start_date": "2025-01-31", "period_days": period, "legs": 4, "contrib": 1_000_000}
+    bids = {1: 300_000, 2: 250_000, 3: 200_000}
+    start = date(2025, 1, 31)
+    assert ledger.expected_due(line, bids, start - timedelta(days=1)) == 0
+    assert ledger.expected_due(line, bids, start) == 700_000
+    day3 = start + timedelta(days=2 * period)
+    assert ledger.expected_due(line, bids, day3 - timedelta(days=1)) == 700_000 + 750_000
+    assert ledger.expected_due(line, bids, day3) == 700_000 + 750_000 + 800_000
+    # kỳ 4 chưa có thăm: tính đủ M
+    assert ledger.expected_due(line, bids, start + timedelta(days=3 * period)) == 2_250_000 + 1_000_000
+
+def test_line_report_balance_and_arrears():
+    line = {"id": 1, "name": "a", "start_date": "2025-01-06", "period_days": 7, "legs": 4, "contrib": 1_000_000}
+    r = ledger.line_report(line, {1: 400_000}, {"paid_total": 1_000_000, "n_payments": 2,
+                                                "last_pay_date": "2025-01-13"}, date(2025, 1, 13))
+    assert (r["k_due"], r["expected"], r["paid"], r["balance"], r["arrears"]) == (2, 1_600_000, 1_000_000,
+                                                                               -600_000, 600_000)
+    r = ledger.line_report(line, {}, None, date(2025, 1, 5))
+    assert (r["expected"], r["paid"], r["arrears"], r["n_payments"]) == (0, 0, 0, 0)
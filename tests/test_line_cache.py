@@ -0,0 +1,33 @@
+"""LineCache: nạp lại sau miss không được ghi đè dữ liệu mới hơn ghi trong lúc đang đọc DB."""
+from line_cache import LineCache
+from models import Line, Bids
+
+ROW = {"id": 1, "name": "D1", "period_days": 7, "start_date": "2025-01-06", "legs": 5, "contrib": 1_000_000,
+       "status": "OPEN", "thau_rate": 10}
+
+def test_write_during_fill_is_not_overwritten():
+    c = LineCache()
+    assert c.lookup(1) is None
+    tok = c.begin_fill(1)
+    stale = Bids.from_map(5, {})             # đọc DB trước khi /tham ghi
+    c.put_bid(1, 1, 300_000)                 # /tham: ghi DB rồi put_bid (dây chưa có trong cache)
+    line, bids, _ = c.store(1, Line(ROW), stale, tok)
+    assert bids == {}                        # người đọc vẫn nhận bản đã đọc ...
+    assert c.lookup(1) is None               # ... nhưng không được cache
+    tok = c.begin_fill(1)
+    c.store(1, Line(ROW), Bids.from_map(5, {1: 300_000}), tok)
+    assert c.lookup(1)[1] == {1: 300_000}
+
+def test_existing_entry_wins_over_late_fill():
+    c = LineCache()
+    t1, t2 = c.begin_fill(1), c.begin_fill(1)
+    v = c.store(1, Line(ROW), Bids.from_map(5, {}), t2)[2]
+    c.put_bid(1, 2, 400_000)
+    line, bids, ver = c.store(1, Line(ROW), Bids.from_map(5, {}), t1)
+    assert bids == {2: 400_000} and ver > v
+
+def test_fill_without_writes_is_cached():
+    c = LineCache()
+    e = c.get(1, lambda i: Line(ROW), lambda i: Bids.from_map(5, {3: 100}))
+    assert c.lookup(1) == e and c.stats()["size"] == 1
+    assert c.get(2, lambda i: None, lambda i: None) is None
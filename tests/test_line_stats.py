@@ -0,0 +1,14 @@
+"""line_stats.ensure_built: khởi động lạnh chỉ dựng lại bảng khi vừa migrate hoặc bảng còn trống."""
+import line_stats
+
+def test_cold_start_rebuilds_line_stats_only_when_needed(fresh_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(line_stats, "rebuild", lambda check_only=False: calls.append(1))
+    assert fresh_db.init_db() is False                 # đã migrate bởi fixture
+    line_stats.ensure_built(False)
+    assert calls == [1]                                # line_stats còn trống
+    fresh_db.db().execute("INSERT INTO line_stats(line_id) VALUES(1)")
+    line_stats.ensure_built(False)
+    assert calls == [1]                                # khởi động bình thường: không dựng lại
+    line_stats.ensure_built(True)
+    assert calls == [1, 1]                             # vừa migrate
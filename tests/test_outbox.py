@@ -0,0 +1,29 @@
+"""Outbox: bucket của chat đã đầy và rảnh quá chat_idle_ttl bị bỏ, bucket đang bị giữ (429) thì không."""
+import asyncio
+
+from outbox import Outbox
+
+class FakeBot:
+    async def send_message(self, chat_id, text, **kw):
+        return {"chat_id": chat_id, "text": text}
+
+def test_idle_chat_buckets_are_evicted():
+    async def main():
+        now = [0.0]
+        ob = Outbox(FakeBot(), global_rate=1e6, chat_rate=1.0, chat_burst=3,
+                    chat_idle_ttl=300.0, sweep_every=60.0, clock=lambda: now[0])
+        task = asyncio.get_running_loop().create_task(ob.run())
+        try:
+            await asyncio.gather(*(ob.send(c, "x") for c in range(1000)))
+            assert ob.stats()["chats"] == 1000
+            ob._chats[7].blocked_until = 10_000.0          # đang chờ retry_after
+            now[0] = 100.0
+            await ob.send(2000, "x")                       # quét lúc 100s: chưa quá TTL
+            assert ob.stats()["chats"] == 1001 and ob.evicted == 0
+            now[0] = 400.0
+            await ob.send(3000, "x")
+            assert set(ob._chats) == {7, 3000}              # 2000: dùng lúc 100s, đã rảnh 300s
+            assert ob.evicted == 1000 and ob.sent == 1002
+        finally:
+            task.cancel()
+    asyncio.run(main())
@@ -0,0 +1,18 @@
+"""parse_import: dấu phân cách ', ' / ';' / khoảng trắng; chỉ dòng đầu tiên có thể là tiêu đề."""
+from app import parse_import
+
+LINE = {"legs": 10, "contrib": 1_000_000, "base_rate": 0, "cap_rate": 100}
+
+def test_comma_space_csv():
+    rows, errors = parse_import("1, 500000, 02-08-2025\n2 ,600k\n3;700.000; 2025-08-16\n4\t800000", LINE)
+    assert errors == []
+    assert rows == {1: (500_000, "2025-08-02"), 2: (600_000, None), 3: (700_000, "2025-08-16"), 4: (800_000, None)}
+
+def test_only_first_line_is_a_header():
+    rows, errors = parse_import("# xuất từ bảng tính\n\nky, tham, ngay\n1,500000\nabc, 1\n2,600000", LINE)
+    assert rows == {1: (500_000, None), 2: (600_000, None)}
+    assert errors == [(5, "abc, 1", "kỳ phải là số")]
+
+def test_non_numeric_rows_after_a_numeric_first_line_are_errors():
+    rows, errors = parse_import("1 500000\nx 2\ny 3", LINE)
+    assert rows == {1: (500_000, None)} and [e[0] for e in errors] == [2, 3]
@@ -0,0 +1,75 @@
+"""payout.evaluate/best_k phải cho đúng kết quả của vòng lặp compute_profit_var cũ, trên dây ngẫu nhiên."""
+import random
+
+import pytest
+
+import payout
+from models import Line, Bids
+
+# ----- bản cũ (app.py trước khi có payout.py), giữ nguyên làm chuẩn so sánh -----
+def payout_at_k(line, bids: dict, k: int) -> int:
+    M, N = int(line["contrib"]), int(line["legs"])
+    T_k = int(bids.get(k, 0))
+    D = int(round(M * float(line.get("thau_rate", 0)) / 100.0))
+    return (k-1)*M + (N - k)*(M - T_k) - D
+
+def paid_so_far_if_win_at_k(bids: dict, M: int, k: int) -> int:
+    return sum((M - int(bids.get(j, 0))) for j in range(1, k))
+
+def compute_profit_var(line, k: int, bids: dict):
+    M = int(line["contrib"])
+    po = payout_at_k(line, bids, k)
+    paid = paid_so_far_if_win_at_k(bids, M, k)
+    base = paid if paid > 0 else M
+    profit = po - paid
+    roi = profit / base if base else 0.0
+    return profit, roi, po, paid
+
+def best_k_var(line, bids: dict, metric="roi"):
+    bestk, bestkey, bestinfo = 1, -1e18, None
+    for kk in range(1, int(line["legs"]) + 1):
+        p, r, po, paid = compute_profit_var(line, kk, bids)
+        key = r if metric == "roi" else p
+        if key > bestkey:
+            bestk, bestkey, bestinfo = kk, key, (p, r, po, paid)
+    return bestk, bestinfo
+
+def random_line(rnd: random.Random):
+    legs = rnd.choice((0, 1, 2, rnd.randint(3, 30), rnd.randint(40, 120)))
+    M = rnd.choice((100_000, 500_000, 1_000_000, 2_000_000, rnd.randint(1, 5_000_000)))
+    row = {"id": 1, "name": "D", "period_days": 7, "start_date": "2025-01-06", "legs": legs, "contrib": M,
+           "bid_type": "dynamic", "bid_value": 0, "status": "OPEN", "base_rate": 0, "cap_rate": 100,
+           "thau_rate": rnd.choice((0, 5, 10, 12.5, rnd.uniform(0, 30)))}
+    ks = [k for k in range(1, legs + 1) if rnd.random() < rnd.choice((0.0, 0.3, 0.8, 1.0))]
+    bids = {k: rnd.choice((0, M, rnd.randint(0, M), rnd.randint(0, 2 * M))) for k in ks}
+    return row, bids
+
+@pytest.fixture(params=["python", "numpy"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        if payout.numpy() is None: pytest.skip("numpy chưa cài")
+        monkeypatch.setattr(payout, "NUMPY_MIN_LEGS", 1)
+    else:
+        monkeypatch.setattr(payout, "NUMPY_MIN_LEGS", 10**9)
+    return request.param
+
+@pytest.mark.parametrize("kind", ["dict", "Bids"])
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_k_loop(engine, kind, seed):
+    rnd = random.Random(seed)
+    for _ in range(10):
+        row, bids = random_line(rnd)
+        line, b = (row, bids) if kind == "dict" else (Line(row), Bids.from_map(row["legs"], bids))
+        po, paid, profit, roi = payout.evaluate(line, b)
+        assert len(po) == row["legs"]
+        for k in range(1, row["legs"] + 1):
+            assert (int(profit[k-1]), float(roi[k-1]), int(po[k-1]), int(paid[k-1])) == \
+                compute_profit_var(row, k, bids)
+        for metric in ("roi", "lai"):
+            assert payout.best_k(line, b, metric) == best_k_var(row, bids, metric)
+
+@pytest.mark.parametrize("k", [0, -1, 6])
+def test_bids_from_map_rejects_k_outside_legs(k):
+    assert dict(Bids.from_map(5, {"1": 300_000, 5: 100_000}).items()) == {1: 300_000, 5: 100_000}
+    with pytest.raises(ValueError, match=f"kỳ {k} ngoài 1..5"):
+        Bids.from_map(5, {1: 300_000, k: 100_000})
@@ -0,0 +1,26 @@
+"""portfolio.report qua line_stats (load_summary) phải trùng với tính lại từ toàn bộ rounds."""
+import random
+
+import pytest
+
+import line_stats
+import portfolio
+
+@pytest.mark.parametrize("metric", ["roi", "lai"])
+def test_summary_matches_full_evaluation(fresh_db, metric):
+    rnd = random.Random(3)
+    with fresh_db.transaction() as conn:
+        for i in range(1, 201):
+            legs = rnd.choice((0, 1, 5, 12, 27, 60))
+            M = rnd.choice((500_000, 1_000_000, 2_000_000))
+            conn.execute("INSERT INTO lines(id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+                         "base_rate,cap_rate,thau_rate) VALUES(?,?,7,'2025-01-06',?,?,'dynamic',0,?,5,50,?)",
+                         (i, f"D{i}", legs, M, rnd.choice(("OPEN", "OPEN", "CLOSED")), rnd.choice((0, 7.5, 10))))
+            ks = [k for k in range(1, legs + 3) if rnd.random() < 0.6]      # có cả kỳ lẻ, kỳ > legs
+            conn.executemany("INSERT INTO rounds(line_id,k,bid) VALUES(?,?,?)",
+                             ((i, k, rnd.randint(0, M)) for k in ks))
+    line_stats.rebuild()
+    fresh_db.db().execute("DELETE FROM line_stats WHERE line_id % 7 = 0")   # dây chưa có line_stats
+    rows, bids = portfolio.load_summary(metric)
+    assert any(r[5] is None for r in rows) and bids
+    assert portfolio.report(metric) == portfolio.report(metric, rows=portfolio.load_open())
@@ -0,0 +1,209 @@
+"""ReminderScheduler: thứ tự heap, gen khi sửa dây, nạp lại hằng ngày, CAS last_remind_iso giữa các instance."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from reminders import RESYNC_EVERY, RETRY_LATER, ReminderScheduler, next_fire
+from repo import SQLiteRepository
+
+def _line(lid, start="2025-01-06", hh=8, mm=0, period=7, legs=10, last=None, status="OPEN"):
+    return {"id": lid, "name": f"d{lid}", "status": status, "start_date": start, "period_days": period,
+            "legs": legs, "remind_hour": hh, "remind_min": mm, "last_remind_iso": last}
+
+class FakeRepo:
+    """Các hàm repo mà ReminderScheduler dùng; CAS giống UPDATE ... WHERE của SQLiteRepository."""
+
+    def __init__(self, *lines):
+        self.lines = {l["id"]: dict(l) for l in lines}
+
+    async def open_lines(self):
+        return [dict(l) for l in self.lines.values() if l["status"] == "OPEN"]
+
+    async def load_line(self, line_id):
+        l = self.lines.get(line_id)
+        return dict(l) if l else None
+
+    async def claim_reminder(self, line_id, day_iso):
+        await asyncio.sleep(0)                     # để instance kia chen vào giữa
+        l = self.lines[line_id]
+        if l["status"] != "OPEN" or l["last_remind_iso"] == day_iso:
+            return False
+        l["last_remind_iso"] = day_iso
+        return True
+
+    async def release_reminder(self, line_id, day_iso, prev):
+        l = self.lines[line_id]
+        if l["last_remind_iso"] == day_iso:
+            l["last_remind_iso"] = prev
+
+class Clock:
+    def __init__(self, t): self.t = t
+    def __call__(self): return self.t
+
+class Sender:
+    def __init__(self, fail=0):
+        self.sent, self.fail = [], fail
+
+    async def __call__(self, line, k):
+        await asyncio.sleep(0)
+        if self.fail:
+            self.fail -= 1
+            return False
+        self.sent.append((line["id"], k, line["last_remind_iso"]))
+        return True
+
+async def _advance(clock, scheds, to):
+    clock.t = to
+    for s in scheds: s._wakeup.set()
+    for _ in range(10): await asyncio.sleep(0.005)
+
+def _run(*scheds):
+    return [asyncio.create_task(s.run()) for s in scheds]
+
+# ----- next_fire -----
+def test_next_fire_periods():
+    line = _line(1, start="2025-01-06", hh=7, mm=45)                     # thứ hai, 7 ngày/kỳ, 10 kỳ
+    assert next_fire(line, datetime(2025, 1, 1)) == (datetime(2025, 1, 6, 7, 45), 1)
+    assert next_fire(line, datetime(2025, 1, 6, 23)) == (datetime(2025, 1, 6, 7, 45), 1)    # lỡ giờ: vẫn gửi
+    assert next_fire({**line, "last_remind_iso": "2025-01-06"}, datetime(2025, 1, 6, 23)) == \
+        (datetime(2025, 1, 13, 7, 45), 2)
+    assert next_fire(line, datetime(2025, 1, 7)) == (datetime(2025, 1, 13, 7, 45), 2)
+    assert next_fire(line, datetime(2025, 3, 10)) == (datetime(2025, 3, 10, 7, 45), 10)
+    assert next_fire({**line, "last_remind_iso": "2025-03-10"}, datetime(2025, 3, 10)) is None
+    assert next_fire(line, datetime(2025, 3, 11)) is None
+    assert next_fire({**line, "status": "CLOSED"}, datetime(2025, 1, 1)) is None
+
+# ----- một instance -----
+def test_heap_fires_in_time_order():
+    repo = FakeRepo(_line(1, hh=9), _line(2, hh=7), _line(3, hh=8, mm=30))
+    clock, send = Clock(datetime(2025, 1, 6, 6)), Sender()
+    s = ReminderScheduler(repo, send, now=clock)
+
+    async def go():
+        task, = _run(s)
+        await _advance(clock, [s], clock.t)
+        assert s.stats()["next"] == "2025-01-06T07:00:00"
+        for h in (7, 8, 9):
+            await _advance(clock, [s], datetime(2025, 1, 6, h, 59))
+        task.cancel()
+    asyncio.run(go())
+    assert send.sent == [(2, 1, "2025-01-06"), (3, 1, "2025-01-06"), (1, 1, "2025-01-06")]
+    assert {l["last_remind_iso"] for l in repo.lines.values()} == {"2025-01-06"}
+    assert s.stats()["next"] == "2025-01-13T07:00:00" and len(s) == 3
+
+def test_edit_and_cancel_invalidate_old_entries():
+    repo = FakeRepo(_line(1, hh=8), _line(2, hh=8))
+    clock, send = Clock(datetime(2025, 1, 6, 6)), Sender()
+    s = ReminderScheduler(repo, send, now=clock)
+
+    async def go():
+        task, = _run(s)
+        await _advance(clock, [s], clock.t)
+        repo.lines[1]["remind_hour"] = 10                  # /hen 1 10:00
+        s.schedule(repo.lines[1])
+        s.cancel(2)                                        # /dong 2
+        repo.lines[2]["status"] = "CLOSED"
+        await _advance(clock, [s], datetime(2025, 1, 6, 9))
+        assert send.sent == []                             # mục 08:00 cũ của dây 1 bị bỏ qua
+        await _advance(clock, [s], datetime(2025, 1, 6, 10))
+        task.cancel()
+    asyncio.run(go())
+    assert send.sent == [(1, 1, "2025-01-06")]
+    assert len(s) == 1
+
+def test_heap_is_compacted_on_many_edits():
+    s = ReminderScheduler(FakeRepo(), Sender(), now=Clock(datetime(2025, 1, 1)))
+    for i in range(1000):
+        s.schedule(_line(i % 10, hh=i % 24))
+    assert len(s) == 10 and len(s._heap) <= 2 * 10 + 64
+
+def test_hour_changed_elsewhere_reschedules_instead_of_sending():
+    repo = FakeRepo(_line(1, hh=8))
+    clock, send = Clock(datetime(2025, 1, 6, 6)), Sender()
+    s = ReminderScheduler(repo, send, now=clock)
+
+    async def go():
+        task, = _run(s)
+        await _advance(clock, [s], clock.t)
+        repo.lines[1]["remind_hour"] = 11                  # instance khác chạy /hen
+        await _advance(clock, [s], datetime(2025, 1, 6, 8))
+        assert send.sent == [] and s.stats()["next"] == "2025-01-06T11:00:00"
+        await _advance(clock, [s], datetime(2025, 1, 6, 11))
+        task.cancel()
+    asyncio.run(go())
+    assert send.sent == [(1, 1, "2025-01-06")]
+
+def test_daily_resync_picks_up_lines_from_other_instances():
+    repo = FakeRepo(_line(1, hh=8))
+    clock, send = Clock(datetime(2025, 1, 6, 9)), Sender()
+    s = ReminderScheduler(repo, send, now=clock)
+
+    async def go():
+        task, = _run(s)
+        await _advance(clock, [s], clock.t)
+        repo.lines[2] = _line(2, start="2025-01-07", hh=8)    # /tao ở instance khác
+        await _advance(clock, [s], datetime(2025, 1, 6, 9) + RESYNC_EVERY - timedelta(minutes=1))
+        assert [x[0] for x in send.sent] == [1]              # chưa nạp lại: chưa biết dây 2 (lỡ 08:00)
+        await _advance(clock, [s], datetime(2025, 1, 6, 9) + RESYNC_EVERY)
+        task.cancel()
+    asyncio.run(go())
+    assert [x[:2] for x in send.sent] == [(1, 1), (2, 1)]     # nhắc lỡ của dây 2 gửi ngay sau khi nạp lại
+
+def test_failed_send_releases_claim_and_retries():
+    repo = FakeRepo(_line(1, hh=8, last="2024-12-30"))
+    clock, send = Clock(datetime(2025, 1, 6, 8)), Sender(fail=1)
+    s = ReminderScheduler(repo, send, now=clock)
+
+    async def go():
+        task, = _run(s)
+        await _advance(clock, [s], clock.t)
+        assert send.sent == [] and repo.lines[1]["last_remind_iso"] == "2024-12-30"   # nhả về giá trị cũ
+        await _advance(clock, [s], clock.t + RETRY_LATER)
+        task.cancel()
+    asyncio.run(go())
+    assert send.sent == [(1, 1, "2025-01-06")] and repo.lines[1]["last_remind_iso"] == "2025-01-06"
+
+# ----- nhiều instance chung DB: CAS -----
+@pytest.fixture(params=["fake", "sqlite"])
+def shared_repo(request):
+    lines = [_line(1, hh=8), _line(2, hh=8, mm=30)]
+    if request.param == "fake":
+        return FakeRepo(*lines)
+    db = request.getfixturevalue("app_db")
+    for l in lines:
+        db.exec_sql("INSERT INTO lines(id,name,status,start_date,period_days,legs,remind_hour,remind_min) "
+                    "VALUES(?,?,?,?,?,?,?,?)", (l["id"], l["name"], l["status"], l["start_date"],
+                                                l["period_days"], l["legs"], l["remind_hour"], l["remind_min"]))
+    return SQLiteRepository()
+
+def test_racing_schedulers_send_each_reminder_once(shared_repo):
+    clock = Clock(datetime(2025, 1, 6, 7))
+    sends = [Sender(), Sender(), Sender()]                 # 3 instance Cloud Run
+    scheds = [ReminderScheduler(shared_repo, snd, now=clock) for snd in sends]
+
+    async def go():
+        tasks = _run(*scheds)
+        await _advance(clock, scheds, clock.t)
+        for day in (6, 13, 20):
+            await _advance(clock, scheds, datetime(2025, 1, day, 9))
+        for t in tasks: t.cancel()
+    asyncio.run(go())
+    sent = sorted(x for snd in sends for x in snd.sent)
+    assert sent == [(lid, k, f"2025-01-{d:02d}") for lid in (1, 2) for k, d in ((1, 6), (2, 13), (3, 20))]
+    # instance thua: CAS trả False (skipped), hoặc nạp dây thấy last_remind_iso đã là hôm nay và hẹn kỳ sau
+    assert sum(s.sent for s in scheds) == 6 and sum(s.skipped for s in scheds) <= 12
+
+def test_released_claim_lets_another_instance_send(shared_repo):
+    clock = Clock(datetime(2025, 1, 6, 8))
+    a, b = Sender(fail=10), Sender()                      # instance a không gửi được
+    sa = ReminderScheduler(shared_repo, a, now=clock)
+    sb = ReminderScheduler(shared_repo, b, now=clock)
+
+    async def go():
+        sa.schedule(await shared_repo.load_line(1))
+        await sa._fire(1)                                  # a giành, gửi lỗi, nhả
+        sb.schedule(await shared_repo.load_line(1))
+        await sb._fire(1)
+    asyncio.run(go())
+    assert b.sent == [(1, 1, "2025-01-06")] and sb.skipped == 0
@@ -0,0 +1,50 @@
+"""Backend dùng chung (SQLAlchemy): line_stats tính từ thăm đã commit, không từ `bids` cũ của instance gọi."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import line_stats
+from repo import SQLAlchemyRepository
+
+def test_stale_caller_bids_do_not_reach_line_stats(tmp_path):
+    async def main():
+        r = SQLAlchemyRepository(f"sqlite+aiosqlite:///{tmp_path / 'sa.db'}")
+        await r.init()
+        try:
+            assert r.shared
+            lid = await r.create_line("c", 7, "2025-01-06", 6, 1_000_000, 0, 100, 10)
+            line = await r.load_line(lid)
+            await r.upsert_round(line, 1, 300_000, None, {1: 300_000})          # instance A
+            await r.upsert_round(line, 2, 200_000, None, {2: 200_000})          # instance B: chưa thấy kỳ 1
+            await r.upsert_rounds(line, [(3, 100_000, None)], {3: 100_000})
+            bids = {1: 300_000, 2: 200_000, 3: 100_000}
+            assert await r.load_bids(lid) == bids
+            rows, _ = await r.portfolio_summary("roi")
+            want = line_stats.compute(line, bids)
+            assert rows[0][5:8] == (want["k_now"], want["paid_cum"], want["best_k_roi"])
+        finally:
+            await r.close()
+    asyncio.run(main())
+
+def test_statements_are_timed_in_db_histogram(tmp_path):
+    from metrics import DB_SECONDS
+
+    def count(label):
+        s = DB_SECONDS._series.get(label)
+        return sum(s.counts) if s else 0
+
+    async def main():
+        r = SQLAlchemyRepository(f"sqlite+aiosqlite:///{tmp_path / 'sa.db'}")
+        await r.init()
+        try:
+            before = {lbl: count(lbl) for lbl in ("insert:lines", "select:lines", "insert:payments")}
+            lid = await r.create_line("m", 7, "2025-01-06", 6, 1_000_000, 0, 100, 10)
+            await r.load_line(lid)
+            await r.add_payment(lid, 100_000, "2025-01-06")
+            assert {lbl: count(lbl) - n for lbl, n in before.items()} == \
+                {"insert:lines": 1, "select:lines": 1, "insert:payments": 1}
+        finally:
+            await r.close()
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""Route HTTP: chạy repo trên app_loop() mà không khởi động bot PTB; /export nén theo Accept-Encoding."""
+import asyncio, gzip, threading
+
+import pytest
+
+import app
+
+def test_routes_do_not_start_the_bot(app_db, monkeypatch):
+    monkeypatch.setattr(app, "BOT_TOKEN", "123456:test")
+    monkeypatch.setitem(app.app_state, "started", False)
+    started = []
+    monkeypatch.setattr(app, "run_bot_background", lambda *a, **kw: started.append(1))
+    lid = app_db.insert_and_get_id(
+        "INSERT INTO lines(name,period_days,start_date,legs,contrib,base_rate,cap_rate,thau_rate,status) "
+        "VALUES('r',7,'2025-01-06',5,1000000,0,100,10,'OPEN')")
+    c = app.app.test_client()
+    assert c.post(f"/import/{lid}", data="1,300000\n2,250000").status_code == 200
+    assert c.post("/payments", json={"line_id": lid, "amount": "1tr", "pay_date": "2025-01-06"}).status_code == 201
+    assert c.get(f"/balances?line_id={lid}").get_json()["per_line"][0]["paid"] == 1_000_000
+    assert c.get("/report").status_code == 200
+    assert c.get("/export/rounds.csv").get_data(as_text=True).count("\n") == 3
+    assert started == []
+    assert app.repo_loop() is app.app_state["loop"]
+
+def test_shared_repo_is_initialised_once_on_the_app_loop(monkeypatch):
+    class Repo:
+        name, loops = "sqlalchemy", []
+        async def init(self): self.loops.append(asyncio.get_running_loop())
+
+    monkeypatch.setattr(app, "repo", Repo())
+    monkeypatch.setitem(app.app_state, "loop", None)
+    monkeypatch.setitem(app.app_state, "repo_init", None)
+    loops = set()
+    threads = [threading.Thread(target=lambda: loops.add(app.repo_loop())) for _ in range(8)]   # luồng gunicorn
+    for t in threads: t.start()
+    for t in threads: t.join()
+    loop, = loops
+    assert Repo.loops == [loop] and app.app_loop() is loop
+    loop.call_soon_threadsafe(loop.stop)
+
+@pytest.mark.parametrize("accept, gz", [("gzip", True), ("br, gzip;q=0.5", True), ("gzip;q=0", False),
+                                        ("identity", False), ("", False), ("x-gzip-foo", False)])
+def test_export_gzip_follows_accept_encoding(app_db, accept, gz):
+    app_db.exec_sql("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(1,1,300000,'2025-01-06')")
+    r = app.app.test_client().get("/export/rounds.csv", headers={"Accept-Encoding": accept} if accept else {})
+    body = r.get_data()
+    assert (r.headers.get("Content-Encoding") == "gzip") is gz
+    assert (gzip.decompress(body) if gz else body).decode().splitlines()[1].startswith("1,1,300000")
@@ -0,0 +1,58 @@
+"""Schema có version cho backend SQLAlchemy: DB mới, DB cũ tạo bằng create_all(), DB mới hơn code."""
+import asyncio, sqlite3
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import db as sa_db
+from repo import SQLAlchemyRepository
+
+def _init(path):
+    async def go():
+        r = SQLAlchemyRepository(f"sqlite+aiosqlite:///{path}")
+        try:
+            await r.init()
+            return await r.claim_update(5, 60), await r.balances()
+        finally:
+            await r.close()
+    return asyncio.run(go())
+
+def _versions(path):
+    with sqlite3.connect(path) as conn:
+        return [v for v, in conn.execute("SELECT version FROM schema_version ORDER BY 1")]
+
+def test_fresh_database_gets_every_version(tmp_path):
+    path = tmp_path / "sa.db"
+    assert _init(path) == (True, {})
+    assert _versions(path) == list(range(1, sa_db.SCHEMA_VERSION + 1))
+    _init(path)                                            # lần khởi động sau: không áp lại
+    assert _versions(path) == list(range(1, sa_db.SCHEMA_VERSION + 1))
+
+def test_database_from_old_create_all_is_adopted(tmp_path):
+    path = tmp_path / "sa.db"
+    with sqlite3.connect(path) as conn:                    # trước khi có line_balances và seen_updates.done
+        conn.execute("CREATE TABLE lines(id INTEGER PRIMARY KEY, name TEXT, period_days INTEGER, start_date TEXT, "
+                     "legs INTEGER, contrib BIGINT, bid_type TEXT, bid_value BIGINT, status TEXT, base_rate FLOAT, "
+                     "cap_rate FLOAT, thau_rate FLOAT, remind_hour INTEGER, remind_min INTEGER, last_remind_iso TEXT)")
+        conn.execute("CREATE TABLE payments(id INTEGER PRIMARY KEY, line_id INTEGER, pay_date TEXT, amount BIGINT)")
+        conn.execute("CREATE TABLE seen_updates(update_id BIGINT PRIMARY KEY, seen_at BIGINT)")
+        conn.executemany("INSERT INTO payments(line_id,pay_date,amount) VALUES(?,?,?)",
+                         [(1, "2025-01-06", 100), (1, "2025-01-13", 200), (2, "2025-01-06", 50)])
+        conn.execute("INSERT INTO seen_updates VALUES(5, 0)")
+    claimed, bal = _init(path)
+    assert claimed is False                                # id cũ coi như đã xử lý xong
+    assert {lid: (b["paid_total"], b["n_payments"], b["last_pay_date"]) for lid, b in bal.items()} == \
+        {1: (300, 2, "2025-01-13"), 2: (50, 1, "2025-01-06")}
+    with sqlite3.connect(path) as conn:
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert "idx_payments_line_date" in names
+    assert _versions(path) == list(range(1, sa_db.SCHEMA_VERSION + 1))
+
+def test_newer_database_fails_loudly(tmp_path):
+    path = tmp_path / "sa.db"
+    _init(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO schema_version(version) VALUES(?)", (sa_db.SCHEMA_VERSION + 1,))
+    with pytest.raises(RuntimeError, match="newer than this code"):
+        _init(path)
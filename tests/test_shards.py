@@ -0,0 +1,76 @@
+"""Hai chat gửi /tham xen kẽ vào cùng một dây qua ShardedRunner: thứ tự từng chat, bids và line_stats cuối cùng."""
+import asyncio
+
+import app
+import db_sqlite
+import line_stats
+from shards import ShardedRunner
+
+class _Msg:
+    message_id = 1
+    def __init__(self, out): self.out = out
+    async def reply_text(self, text, **kw):
+        await asyncio.sleep(0)
+        self.out.append(text)
+
+class _Chat:
+    type = "group"
+    def __init__(self, chat_id): self.id = chat_id
+
+class _Update:
+    def __init__(self, chat_id, out):
+        self.effective_chat = _Chat(chat_id)
+        self.message = self.effective_message = _Msg(out)
+
+class _Ctx:
+    def __init__(self, args): self.args = args
+
+def _stats_ok(line_id):
+    """line_stats của dây khớp với rounds, đọc cả hai trong một snapshot."""
+    conn = db_sqlite.db()
+    conn.execute("BEGIN")
+    try:
+        line = dict(conn.execute("SELECT * FROM lines WHERE id=?", (line_id,)).fetchone())
+        bids = dict(conn.execute("SELECT k,bid FROM rounds WHERE line_id=?", (line_id,)).fetchall())
+        st = conn.execute("SELECT * FROM line_stats WHERE line_id=?", (line_id,)).fetchone()
+    finally:
+        conn.execute("COMMIT")
+    return {f: st[f] for f in line_stats.FIELDS} == line_stats.compute(line, bids)
+
+def test_interleaved_tham_two_chats_one_line(app_db):
+    legs = 20
+    # chat 1 các kỳ lẻ, chat 2 các kỳ chẵn; mỗi kỳ gửi hai lần, lần sau phải thắng
+    sent = {1: [], 2: []}
+    for rnd in (1, 2):
+        for k in range(1, legs + 1):
+            sent[2 - k % 2].append((k, (200 if rnd == 1 else 300) * 1000 + k * 10_000))
+    updates = [(chat, seq, k, bid) for seq in range(legs) for chat in (1, 2)
+               for k, bid in [sent[chat][seq]]]
+
+    async def go():
+        lid = await app.repo.create_line("race", 7, "2025-01-06", legs, 2_000_000, 5.0, 50.0, 10.0)
+        seen, replies, drift = {1: [], 2: []}, {1: [], 2: []}, []
+
+        async def handler(u):
+            chat, seq, k, bid = u
+            seen[chat].append(seq)
+            await app.cmd_tham(_Update(chat, replies[chat]), _Ctx([str(lid), str(k), str(bid)]))
+            drift.append(not _stats_ok(lid))
+
+        r = ShardedRunner(handler, workers=4)
+        futs = [await r.put(u[0], u) for u in updates]
+        await asyncio.gather(*futs)
+        assert r.stats()["failed"] == 0
+        return lid, seen, replies, drift, await app.repo.load_bids(lid)
+
+    lid, seen, replies, drift, bids = asyncio.run(go())
+    assert not any(drift)       # sau mỗi /tham line_stats khớp rounds (không ghi đè bằng bản bids cũ)
+    assert seen == {1: list(range(legs)), 2: list(range(legs))}
+    for chat in (1, 2):
+        assert [t.startswith("✅") for t in replies[chat]] == [True] * legs
+        assert [int(t.split(": ")[1].split()[0].replace(",", "")) for t in replies[chat]] == \
+            [bid for _, bid in sent[chat]]
+    assert bids == {k: 300_000 + k * 10_000 for k in range(1, legs + 1)}
+    assert len(app.line_locks) == 0
+    assert _stats_ok(lid)
+    assert line_stats.rebuild(check_only=True) == []
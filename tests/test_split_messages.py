@@ -0,0 +1,21 @@
+"""split_messages: mỗi tin ≤ 4096 đơn vị UTF-16 (cách Telegram đếm), kể cả dòng toàn emoji."""
+import random
+
+import app
+from app import split_messages, tg_len, TG_MAX_TEXT
+
+def test_emoji_line_longer_than_limit_is_cut_by_utf16():
+    out = split_messages(["📌" * 3000, "ok"])
+    assert [tg_len(m) for m in out] == [TG_MAX_TEXT, 2]
+    assert out[0] == "📌" * 2048
+
+def test_cut_never_splits_a_surrogate_pair():
+    out = split_messages(["a" + "😀" * 3000], limit=100)
+    assert out == ["a" + "😀" * 49]
+
+def test_lines_are_packed_without_exceeding_limit():
+    rnd = random.Random(0)
+    lines = ["".join(rnd.choice("aă😀🎉x ") for _ in range(rnd.randint(0, 700))) for _ in range(300)]
+    out = split_messages(lines, limit=1000)
+    assert all(tg_len(m) <= 1000 for m in out)
+    assert "\n".join(out) == "\n".join(app.tg_cut(ln, 1000) for ln in lines)
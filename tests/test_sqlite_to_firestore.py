@@ -0,0 +1,118 @@
+"""sqlite_to_firestore: ánh xạ field, kích thước batch, chạy tiếp sau một batch lỗi (client Firestore giả).
+
+Bản chạy với emulator chỉ chạy khi có FIRESTORE_EMULATOR_HOST.
+"""
+import os, sqlite3
+from datetime import datetime
+
+import pytest
+
+import sqlite_to_firestore as m
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client, self.ops = client, []
+
+    def set(self, ref, doc):
+        self.ops.append((ref, doc))
+
+    def commit(self):
+        c = self.client
+        if c.fail_on and any(ref == c.fail_on for ref, _ in self.ops) and c.failures < c.times:
+            c.failures += 1
+            raise RuntimeError("injected")
+        c.sizes.append(len(self.ops))
+        c.docs.update(self.ops)
+
+class FakeClient:
+    def __init__(self, fail_on=None, times=0):
+        """fail_on: batch chứa document này lỗi `times` lần đầu commit."""
+        self.docs, self.sizes = {}, []
+        self.fail_on, self.times, self.failures = fail_on, times, 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def document(self, *path):
+        return path
+
+@pytest.fixture
+def src(fresh_db):
+    with fresh_db.transaction() as conn:
+        conn.executemany("INSERT INTO lines(id,name,period_days,start_date,legs,contrib,bid_type,bid_value,status,"
+                         "base_rate,cap_rate,thau_rate) VALUES(?,?,7,'2025-01-06',30,2000000,'dynamic',0,?,5,50,10)",
+                         ((i, f"D{i}", "CLOSED" if i == 2 else "OPEN") for i in range(1, 41)))
+        conn.executemany("INSERT INTO rounds(line_id,k,bid,round_date) VALUES(?,?,?,?)",
+                         ((i, k, 100_000 * k, "2025-01-13" if k == 1 else None)
+                          for i in range(1, 41) for k in range(1, 31)))
+        conn.executemany("INSERT INTO payments(line_id,pay_date,amount) VALUES(?,?,?)",
+                         ((i % 40 + 1, "2025-02-01", 1_800_000) for i in range(25)))
+        conn.execute("INSERT INTO config(key,value) VALUES('bot_cfg','{\"report_chat_id\": -5}')")
+        conn.execute("INSERT INTO config(key,value) VALUES('raw','not json')")
+    return fresh_db.DB_PATH
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(m.time, "sleep", lambda s: None)
+
+def test_field_mapping(src, tmp_path):
+    c = FakeClient()
+    res = m.migrate(src, client=c, checkpoint=str(tmp_path / "ck.json"))
+    assert [(r["table"], r["rows"], r["errors"]) for r in res] == \
+        [("lines", 40, 0), ("rounds", 1200, 0), ("payments", 25, 0), ("config", 2, 0)]
+    line = c.docs[("lines", "2")]
+    assert line["start_date"] == datetime(2025, 1, 6) and line["status"] == "CLOSED"
+    assert (line["name"], line["legs"], line["contrib"], line["thau_rate"], line["remind_hour"]) == ("D2", 30, 2_000_000, 10, 8)
+    assert c.docs[("lines", "3", "rounds", "1")] == {"k": 1, "bid": 100_000, "round_date": datetime(2025, 1, 13)}
+    assert c.docs[("lines", "3", "rounds", "30")]["round_date"] is None
+    assert c.docs[("payments", "1")] == {"line_id": "1", "pay_date": datetime(2025, 2, 1), "amount": 1_800_000}
+    assert c.docs[("config", "bot_cfg")] == {"value": {"report_chat_id": -5}}
+    assert c.docs[("config", "raw")] == {"value": "not json"}
+    assert len(c.docs) == 40 + 1200 + 25 + 2
+
+def test_malformed_date_keeps_raw_string(src, caplog):
+    with sqlite3.connect(src) as conn:
+        conn.execute("UPDATE rounds SET round_date='13/01/2025' WHERE line_id=3 AND k=2")
+        conn.execute("UPDATE payments SET pay_date='' WHERE id=2")
+    c = FakeClient()
+    res = m.migrate(src, client=c, tables=("rounds", "payments"), checkpoint=None)
+    assert [r["errors"] for r in res] == [0, 0]
+    assert c.docs[("lines", "3", "rounds", "2")]["round_date"] == "13/01/2025"
+    assert c.docs[("payments", "2")]["pay_date"] is None
+    assert "'13/01/2025'" in caplog.text
+
+def test_batch_sizes(src):
+    c = FakeClient()
+    m.migrate(src, client=c, tables=("rounds",), batch=7, concurrency=1, checkpoint=None)
+    assert c.sizes == [7] * (1200 // 7) + [1200 % 7]
+    c = FakeClient()
+    m.migrate(src, client=c, tables=("rounds",), batch=10_000, concurrency=3, checkpoint=None)
+    assert sorted(c.sizes) == [200, 500, 500]                    # tối đa MAX_BATCH mỗi WriteBatch
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_resume_after_failed_batch(src, tmp_path, concurrency):
+    ck = str(tmp_path / "ck.json")
+    # batch thứ 4 (dòng 301..400: dây 11 kỳ 1 → dây 14 kỳ 10) lỗi cả RETRIES lần thử
+    bad = FakeClient(fail_on=("lines", "12", "rounds", "1"), times=m.RETRIES)
+    res = m.migrate(src, client=bad, tables=("rounds",), batch=100, concurrency=concurrency, checkpoint=ck)
+    assert res[0]["errors"] == 1
+    state = m.Checkpoint(ck).state["rounds"]
+    assert state == {"last_key": [10, 30], "done": False}       # dừng ngay trước batch lỗi
+    assert ("lines", "11", "rounds", "1") not in bad.docs
+
+    good = FakeClient()
+    good.docs = bad.docs                                         # cùng "database", chạy lại
+    res = m.migrate(src, client=good, tables=("rounds",), batch=100, concurrency=concurrency, checkpoint=ck)
+    assert res[0]["errors"] == 0 and res[0]["rows"] == 900       # chỉ đọc lại từ sau checkpoint
+    assert len(good.docs) == 1200
+    assert m.Checkpoint(ck).done("rounds")
+    assert m.migrate(src, client=good, tables=("rounds",), checkpoint=ck)[0].get("skipped")
+
+@pytest.mark.skipif(not os.environ.get("FIRESTORE_EMULATOR_HOST"), reason="cần FIRESTORE_EMULATOR_HOST")
+def test_emulator_roundtrip(src, tmp_path):
+    firestore = pytest.importorskip("google.cloud.firestore")
+    client = firestore.Client(project=os.environ.get("GOOGLE_CLOUD_PROJECT", "huibot-test"))
+    res = m.migrate(src, client=client, batch=50, checkpoint=str(tmp_path / "ck.json"))
+    assert not any(r["errors"] for r in res)
+    assert client.document("lines", "3", "rounds", "2").get().to_dict()["bid"] == 200_000
+    assert client.document("config", "bot_cfg").get().to_dict() == {"value": {"report_chat_id": -5}}
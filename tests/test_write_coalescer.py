@@ -0,0 +1,104 @@
+"""Group commit: SAVEPOINT mỗi lệnh ghi, kết quả trả sau COMMIT, lô tối đa `batch`, transaction() lồng bên trong."""
+import sqlite3, threading
+
+import pytest
+
+import db_sqlite
+from repo import SQLiteRepository
+from write_coalescer import WriteCoalescer
+
+def _set(key, value):
+    db_sqlite.exec_sql("INSERT OR REPLACE INTO config(key,value) VALUES(?,?)", (key, value))
+    return key
+
+def _fail(key):
+    _set(key, "x")
+    raise ValueError(key)
+
+def _config(path):
+    """Đọc bằng kết nối riêng: chỉ thấy dữ liệu đã COMMIT."""
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT key, value FROM config"))
+    finally:
+        conn.close()
+
+@pytest.fixture
+def gated(fresh_db):
+    """WriteCoalescer mới (luồng ghi mở kết nối tới DB của test) và một lệnh ghi chặn luồng ghi
+    cho tới khi mở cổng, để các lệnh gửi sau dồn thành lô."""
+    wc = WriteCoalescer(window_ms=0)
+    gate, entered = threading.Event(), threading.Event()
+
+    def hold():
+        entered.set()
+        assert gate.wait(10)
+    first = wc.submit(hold)
+    assert entered.wait(10)
+    yield wc, gate, first
+
+def test_failing_write_rolls_back_alone(gated, fresh_db):
+    wc, gate, first = gated
+    futs = [wc.submit(_set, "a", "1"), wc.submit(_fail, "b"), wc.submit(_set, "c", "3")]
+    gate.set()
+    first.result(10)
+    assert futs[0].result(10) == "a" and futs[2].result(10) == "c"
+    with pytest.raises(ValueError):
+        futs[1].result(10)
+    assert _config(fresh_db.DB_PATH) == {"a": "1", "c": "3"}
+    st = wc.stats()
+    assert (st["writes"], st["commits"], st["failed"], st["max_batch"]) == (4, 2, 1, 3)
+
+def test_results_only_after_commit(gated, fresh_db):
+    wc, gate, first = gated
+    seen = []
+    futs = [wc.submit(_set, k, k) for k in "xyz"]
+    for f in futs:
+        # chạy trong luồng ghi lúc set_result: dữ liệu của cả lô phải đã commit
+        f.add_done_callback(lambda f: seen.append((f.result(), _config(fresh_db.DB_PATH))))
+    gate.set()
+    for f in futs: f.result(10)
+    wc.submit(lambda: None).result(10)           # callback của lô trước đã chạy xong (cùng luồng ghi)
+    assert seen == [(k, {"x": "x", "y": "y", "z": "z"}) for k in "xyz"]
+
+def test_batch_is_capped(fresh_db):
+    wc = WriteCoalescer(window_ms=50, batch=3)
+    gate, entered = threading.Event(), threading.Event()
+    batches = []
+    flush = wc._flush
+    wc._flush = lambda items: (batches.append(len(items)), flush(items))
+
+    def hold():
+        entered.set()
+        assert gate.wait(10)
+    first = wc.submit(hold)
+    assert entered.wait(10)
+    futs = [wc.submit(_set, f"k{i}", str(i)) for i in range(7)]
+    gate.set()
+    first.result(10)
+    for f in futs: f.result(10)
+    assert batches == [1, 3, 3, 1]
+    assert len(_config(fresh_db.DB_PATH)) == 7 and wc.stats()["max_batch"] == 3
+
+def test_repo_transactions_nest_inside_batch(gated, fresh_db):
+    wc, gate, first = gated
+    repo = SQLiteRepository()
+    line = {"id": 1, "contrib": 1_000_000, "legs": 4, "thau_rate": 10}
+
+    def bad_import():
+        with db_sqlite.transaction():            # như các hàm ghi của repo: lồng trong SAVEPOINT của lô
+            repo._upsert_round(line, 3, 300_000, None, None)
+            raise RuntimeError("bad row")
+
+    futs = [wc.submit(db_sqlite.exec_sql, "INSERT INTO lines(id,name,legs,contrib,thau_rate,status) "
+                      "VALUES(1,'a',4,1000000,10,'OPEN')"),
+            wc.submit(repo._upsert_round, line, 1, 100_000, None, None), wc.submit(bad_import),
+            wc.submit(repo._upsert_round, line, 2, 200_000, None, None)]
+    gate.set()
+    futs[1].result(10); futs[3].result(10)
+    with pytest.raises(RuntimeError):
+        futs[2].result(10)
+    assert {r["k"]: r["bid"] for r in fresh_db.get_all("SELECT k, bid FROM rounds")} == {1: 100_000, 2: 200_000}
+    assert fresh_db.get_all("SELECT n_bids, bid_sum FROM line_stats WHERE line_id=1") == \
+        [{"n_bids": 2, "bid_sum": 300_000}]
+    assert wc.stats()["commits"] == 2
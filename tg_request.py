@@ -0,0 +1,35 @@
+"""Request của Bot có đo thời gian, tách khỏi app.py để chỉ import telegram khi dựng bot."""
+import time
+
+from telegram.request import BaseRequest
+
+import metrics
+
+class TimedRequest(BaseRequest):
+    """Bọc request của Bot: đo thời gian mỗi lần gọi Bot API (nhãn = method) cho /metrics."""
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **kw):
+        api = url.rsplit("/", 1)[-1]
+        t = time.perf_counter()
+        try:
+            code, body = await self.inner.do_request(url, method, request_data, **kw)
+        except Exception:
+            metrics.TELEGRAM_ERRORS.inc(api)
+            raise
+        finally:
+            metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - t, api)
+        if code >= 400: metrics.TELEGRAM_ERRORS.inc(api)
+        return code, body
@@ -0,0 +1,75 @@
+import asyncio, collections, logging, threading, time
+
+logger = logging.getLogger("huibot.queue")
+
+class UpdateQueue:
+    """Bounded hand-off from webhook threads to the PTB event loop.
+
+    `put()` is called from gunicorn threads and never blocks; it returns False
+    when the queue is full so the route can answer 503. `run()` is the consumer
+    task living on the bot loop.
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self.enqueued = self.rejected = self.processed = self.failed = 0
+        self.max_depth = 0
+        self.wait_total = self.wait_max = self.wait_last = 0.0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, item) -> bool:
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                self.rejected += 1
+                return False
+            self._items.append((time.monotonic(), item))
+            self.enqueued += 1
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def _pop(self):
+        with self._lock:
+            return self._items.popleft() if self._items else None
+
+    def _record_wait(self, t_enq: float):
+        w = time.monotonic() - t_enq
+        self.wait_last = w
+        self.wait_total += w
+        if w > self.wait_max: self.wait_max = w
+
+    async def run(self, handler):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while (entry := self._pop()) is not None:
+                t_enq, item = entry
+                self._record_wait(t_enq)
+                try:
+                    await handler(item)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("queued update failed")
+                self.processed += 1
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict:
+        done = self.processed or 1
+        return {
+            "depth": self.depth(), "maxsize": self.maxsize, "max_depth": self.max_depth,
+            "enqueued": self.enqueued, "rejected": self.rejected,
+            "processed": self.processed, "failed": self.failed,
+            "wait_ms_avg": round(self.wait_total / done * 1000, 3),
+            "wait_ms_max": round(self.wait_max * 1000, 3),
+            "wait_ms_last": round(self.wait_last * 1000, 3),
+        }
@@ -0,0 +1,110 @@
+"""Group commit: writes arriving within a few ms share one SQLite transaction.
+
+One writer thread takes the first queued write plus everything queued behind
+it and runs them between one BEGIN IMMEDIATE and one COMMIT. During a burst
+(previous batch > 1 write) it also waits up to DB_WRITE_WINDOW_MS for more, up
+to DB_WRITE_BATCH writes; a lone write is committed without waiting.
+DB_WRITE_WINDOW_MS=0 groups only writes already queued behind the first one.
+
+Each write runs inside its own SAVEPOINT, so a failing write is rolled back
+alone and only its caller sees the exception; results are handed out after
+the COMMIT succeeds. DB_GROUP_COMMIT=0 turns this off (each write commits on
+the DB thread pool).
+"""
+import os, time, queue, asyncio, logging, threading
+from concurrent.futures import Future
+
+import db_sqlite
+
+logger = logging.getLogger("huibot.writes")
+
+GROUP_COMMIT = os.environ.get("DB_GROUP_COMMIT", "1").strip() not in ("0", "false", "no")
+WRITE_WINDOW_MS = float(os.environ.get("DB_WRITE_WINDOW_MS", "0.5"))
+WRITE_BATCH = int(os.environ.get("DB_WRITE_BATCH", "64"))
+
+class WriteCoalescer:
+    def __init__(self, window_ms: float = WRITE_WINDOW_MS, batch: int = WRITE_BATCH):
+        self.window = window_ms / 1000
+        self.batch = max(1, batch)
+        self._q = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_batch = 0
+        self.writes = self.commits = self.failed = self.max_batch = 0
+
+    def submit(self, fn, *args) -> Future:
+        """Queue `fn(*args)` (sync, uses db_sqlite helpers); the future resolves after COMMIT."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+        fut = Future()
+        self._q.put((fn, args, fut))
+        return fut
+
+    def _collect(self):
+        items = [self._q.get()]
+        # Chỉ chờ thêm khi đang có dồn ghi (lô trước > 1); ghi lẻ tẻ commit ngay
+        deadline = time.monotonic() + (self.window if self._last_batch > 1 else 0)
+        while len(items) < self.batch:
+            left = deadline - time.monotonic()
+            try:
+                items.append(self._q.get(timeout=left) if left > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            self._last_batch = len(items)
+            try:
+                self._flush(items)
+            except Exception:
+                logger.exception("group commit of %d writes failed", len(items))
+
+    def _flush(self, items):
+        conn = db_sqlite.db()
+        done = []                          # (future, result, exc)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, fut in items:
+                conn.execute("SAVEPOINT w")
+                try:
+                    res = fn(*args)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO w")
+                    done.append((fut, None, e))
+                else:
+                    done.append((fut, res, None))
+                conn.execute("RELEASE w")
+            conn.execute("COMMIT")
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, fut in items:
+                if not fut.done(): fut.set_exception(e)
+            self.failed += len(items)
+            raise
+        self.writes += len(items); self.commits += 1
+        self.max_batch = max(self.max_batch, len(items))
+        for fut, res, exc in done:
+            if exc is None: fut.set_result(res)
+            else: self.failed += 1; fut.set_exception(exc)
+
+    def stats(self) -> dict:
+        return {"window_ms": self.window * 1000, "batch": self.batch, "writes": self.writes,
+                "commits": self.commits, "failed": self.failed, "max_batch": self.max_batch,
+                "avg_batch": round(self.writes / self.commits, 2) if self.commits else 0.0}
+
+_coalescer = WriteCoalescer() if GROUP_COMMIT else None
+
+def coalescer():
+    return _coalescer
+
+async def run_write(fn, *args):
+    """Awaitable write: group-committed when enabled, else one transaction on the DB pool."""
+    if _coalescer is None:
+        return await db_sqlite.run_db(fn, *args)
+    return await asyncio.wrap_future(_coalescer.submit(fn, *args))